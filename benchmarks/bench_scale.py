@@ -0,0 +1,149 @@
+"""
+    Tree building, rendering and writing at scale
+    ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+    Times update_gen_builder_tree, build_tree and render_and_write_gen_tree
+    separately on synthetic key trees from 1k up to 1M leaves, then the path
+    builds take by default: gen_tree_from_runs_fused, and
+    render_and_write_gen_tree_async with the manifest cache, cold and warm.
+    Records the peak RSS of each case. Every case runs in a fresh process
+    so peak memory is not carried over between sizes.
+
+    python benchmarks/bench_scale.py --leaves 1000 10000 100000
+    python benchmarks/bench_scale.py --save benchmarks/baseline.json
+    python benchmarks/bench_scale.py --compare benchmarks/baseline.json
+"""
+import argparse
+import json
+import multiprocessing
+import platform
+import resource
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+from synthetic import synthetic_runs, width_for_leaves
+
+from sphinxcontrib.jinjagen.bulk import gen_tree_from_runs_fused
+from sphinxcontrib.jinjagen.cache import FileGenCache
+from sphinxcontrib.jinjagen.deps import TemplateDependencyGraph
+from sphinxcontrib.jinjagen.filegen2 import (FileGenBuilderRoots, add_runs_to_cache, build_tree,
+                                             render_and_write_gen_tree, update_gen_builder_tree)
+from sphinxcontrib.jinjagen.writer import render_and_write_gen_tree_async
+
+DEFAULT_LEAVES = [1000, 10000, 100000]
+PHASES = ['update_gen_builder_tree', 'build_tree', 'render_and_write_gen_tree',
+          'gen_tree_from_runs_fused', 'render_and_write_gen_tree_async', 'render_warm_cache']
+# a case regresses when a phase is this much slower, or peak RSS this much larger, than the baseline
+DEFAULT_TOLERANCE = 1.25
+
+
+def peak_rss_mib() -> float:
+    maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kilobytes on linux, bytes on macos
+    return maxrss / 2**20 if sys.platform == 'darwin' else maxrss / 2**10
+
+
+def run_case(case: dict) -> dict:
+    runs = synthetic_runs(case['width'], case['depth'], case['runs'])
+    seconds = {}
+    with tempfile.TemporaryDirectory() as out_dir:
+        start = time.perf_counter()
+        gen_builder_roots = FileGenBuilderRoots({})
+        for run_data in runs:
+            update_gen_builder_tree(gen_builder_roots, run_data)
+        seconds['update_gen_builder_tree'] = time.perf_counter() - start
+
+        start = time.perf_counter()
+        gen_roots = build_tree(gen_builder_roots, out_dir)
+        seconds['build_tree'] = time.perf_counter() - start
+
+        if case['render']:
+            start = time.perf_counter()
+            render_and_write_gen_tree(gen_roots)
+            seconds['render_and_write_gen_tree'] = time.perf_counter() - start
+        del gen_roots, gen_builder_roots
+
+        start = time.perf_counter()
+        gen_roots = gen_tree_from_runs_fused(str(Path(out_dir, 'fused')), runs)
+        seconds['gen_tree_from_runs_fused'] = time.perf_counter() - start
+
+        if case['render']:
+            manifest_path = Path(out_dir, 'manifest.json')
+            run_defs = [run_data.run_def for run_data in runs]
+            graph = TemplateDependencyGraph.build(runs[0].template.environment, run_defs)
+            for phase in ('render_and_write_gen_tree_async', 'render_warm_cache'):
+                start = time.perf_counter()
+                cache = FileGenCache.load(manifest_path)
+                cache.template_graph = graph
+                add_runs_to_cache(cache, run_defs)
+                render_and_write_gen_tree_async(gen_roots, cache)
+                cache.save()
+                seconds[phase] = time.perf_counter() - start
+
+    return {**case, 'seconds': seconds, 'peak_rss_mib': peak_rss_mib()}
+
+
+def case_name(case: dict) -> str:
+    return f"{case['width']}^{case['depth']}x{case['runs']}"
+
+
+def compare(results: list, baseline: dict, tolerance: float) -> bool:
+    ok = True
+    for result in results:
+        base = baseline.get(case_name(result))
+        if base is None:
+            continue
+        ratios = {phase: result['seconds'][phase] / base['seconds'][phase]
+                  for phase in result['seconds'] if base['seconds'].get(phase)}
+        ratios['peak_rss'] = result['peak_rss_mib'] / base['peak_rss_mib']
+        for measure, ratio in ratios.items():
+            flag = 'REGRESSION' if ratio > tolerance else ''
+            ok = ok and not flag
+            print(f'  {case_name(result):16} {measure:26} {ratio:6.2f}x baseline {flag}')
+    return ok
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1].strip())
+    parser.add_argument('--leaves', type=int, nargs='+', default=DEFAULT_LEAVES)
+    parser.add_argument('--depth', type=int, default=3)
+    parser.add_argument('--runs', type=int, default=2)
+    parser.add_argument('--no-render', dest='render', action='store_false',
+                        help='only build the tree, e.g. for 1M leaves')
+    parser.add_argument('--save', type=Path, help='write results as a baseline json file')
+    parser.add_argument('--compare', type=Path, help='compare against a baseline json file')
+    parser.add_argument('--tolerance', type=float, default=DEFAULT_TOLERANCE)
+    args = parser.parse_args()
+
+    cases = [{'width': width_for_leaves(leaves, args.depth), 'depth': args.depth,
+              'runs': args.runs, 'render': args.render} for leaves in args.leaves]
+
+    results = []
+    ctx = multiprocessing.get_context('spawn')
+    for case in cases:
+        with ctx.Pool(1) as pool:
+            result = pool.apply(run_case, (case,))
+        results.append(result)
+        phases = '  '.join(f'{phase} {result["seconds"][phase]:8.2f}s'
+                           for phase in PHASES if phase in result['seconds'])
+        print(f'{case_name(result):16} {result["width"] ** result["depth"]:>9} leaves  {phases}  '
+              f'peak {result["peak_rss_mib"]:8.1f} MiB')
+
+    if args.save:
+        args.save.write_text(json.dumps({
+            'python': platform.python_version(),
+            'machine': platform.machine(),
+            'cases': {case_name(r): r for r in results},
+        }, indent=2, sort_keys=True))
+
+    if args.compare:
+        baseline = json.loads(args.compare.read_text())
+        print(f'compared with {args.compare} (python {baseline["python"]}, {baseline["machine"]})')
+        if not compare(results, baseline['cases'], args.tolerance):
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
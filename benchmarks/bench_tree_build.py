@@ -0,0 +1,56 @@
+"""
+    Generation tree build timings
+    ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+    Times gen_tree_from_runs against the fused single pass builders on
+    synthetic wide and deep key trees.
+
+    python benchmarks/bench_tree_build.py --runs 2
+"""
+import argparse
+import time
+
+from synthetic import leaf_keypaths, synthetic_runs
+
+from sphinxcontrib.jinjagen.bulk import gen_tree_from_keypaths, gen_tree_from_runs_fused
+from sphinxcontrib.jinjagen.filegen2 import gen_tree_from_runs
+
+SHAPES = {
+    'wide': (200, 2),
+    'deep': (2, 15),
+}
+
+
+def best_of(repeat, fn):
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1].strip())
+    parser.add_argument('--runs', type=int, default=2)
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    for shape, (width, depth) in SHAPES.items():
+        runs = synthetic_runs(width, depth, args.runs)
+        keypaths = sorted(leaf_keypaths(runs[0].run_def.gen_key_roots.roots['gen']))
+
+        print(f'{shape}: {width}^{depth} = {len(keypaths)} leaves x {args.runs} runs')
+        timings = {
+            'gen_tree_from_runs': best_of(args.repeat, lambda: gen_tree_from_runs('out', runs)),
+            'gen_tree_from_runs_fused': best_of(args.repeat, lambda: gen_tree_from_runs_fused('out', runs)),
+            'gen_tree_from_keypaths': best_of(
+                args.repeat, lambda: gen_tree_from_keypaths('out', [(r, keypaths) for r in runs])),
+        }
+        baseline = timings['gen_tree_from_runs']
+        for name, seconds in timings.items():
+            print(f'  {name:26} {seconds * 1000:9.1f} ms  {baseline / seconds:5.2f}x')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,45 @@
+"""
+    Generation tree memory
+    ~~~~~~~~~~~~~~~~~~~~~~
+
+    Compares the memory held by a FileGenRoots tree from gen_tree_from_runs
+    and by the array-backed tree from gen_compact_tree_from_runs.
+
+    python benchmarks/bench_tree_memory.py --width 100 --depth 3 --runs 2
+"""
+import argparse
+import gc
+import tracemalloc
+
+from synthetic import synthetic_runs
+
+from sphinxcontrib.jinjagen.compact import gen_compact_tree_from_runs
+from sphinxcontrib.jinjagen.filegen2 import gen_tree_from_runs
+
+
+def measure(build, runs):
+    gc.collect()
+    tracemalloc.start()
+    gen_roots = build('out', runs)
+    current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del gen_roots
+    return current, peak
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1].strip())
+    parser.add_argument('--width', type=int, default=100)
+    parser.add_argument('--depth', type=int, default=3)
+    parser.add_argument('--runs', type=int, default=2)
+    args = parser.parse_args()
+
+    runs = synthetic_runs(args.width, args.depth, args.runs)
+    print(f'{args.width ** args.depth} leaves x {args.runs} runs')
+    for name, build in [('FileGenRoots', gen_tree_from_runs), ('CompactGenRoots', gen_compact_tree_from_runs)]:
+        current, peak = measure(build, runs)
+        print(f'{name:16} held {current / 2**20:8.1f} MiB   peak {peak / 2**20:8.1f} MiB')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,72 @@
+"""
+    Sandboxed vs trusted render throughput
+    ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+    Renders the test-case1 templates over a scaled up key tree, once through
+    a SandboxedEnvironment and once through the precompiled trusted bundle.
+
+    python benchmarks/bench_trusted_render.py --keys 20000
+"""
+import argparse
+import tempfile
+import time
+from pathlib import Path
+
+from jinja2 import FileSystemLoader
+from jinja2.sandbox import SandboxedEnvironment
+
+from sphinxcontrib.jinjagen.bundle import build_trusted_env_from_runs
+from sphinxcontrib.jinjagen.filegen2 import (FileContext, FileGenRunDef, FileGenRunNameOption, GenKeyNode,
+                                             GenKeyRoots, gen_tree_from_runs, gen_tree_run_entries)
+
+TEMPLATES_DIR = Path(__file__).parent.parent / 'tests' / 'roots' / 'test-case1' / '_templates'
+
+
+def scaled_run_defs(n_keys: int, trusted: bool):
+    recipe_roots = GenKeyRoots.from_roots_iter([GenKeyNode.from_children_iter('gen', [
+        GenKeyNode.from_children_iter(f'source{s}', [
+            GenKeyNode.from_children_iter(f'recipe{r}', []) for r in range(n_keys // 100)])
+        for s in range(100)])])
+    source_roots = GenKeyRoots.from_roots_iter([GenKeyNode.from_children_iter('gen', [
+        GenKeyNode.from_children_iter(f'source{s}', []) for s in range(100)])])
+    return [
+        FileGenRunDef(recipe_roots, 'recipe', 'recipe.jinja', 'rst',
+                      FileGenRunNameOption.ALL_KEYS_DIRS, None, trusted),
+        FileGenRunDef(source_roots, 'recipe_source', 'recipe_source.jinja', 'rst',
+                      FileGenRunNameOption.ALL_KEYS_DIRS, None, trusted),
+    ]
+
+
+def time_render(template_env, run_defs, repeat: int) -> float:
+    runs = [run_def.create_run_data(template_env) for run_def in run_defs]
+    gen_roots = gen_tree_from_runs('out', runs)
+    entries = gen_tree_run_entries(gen_roots)
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for gen_node, run_entry in entries:
+            FileContext(gen_node, gen_roots, run_entry).render()
+        best = min(best, time.perf_counter() - start)
+    return len(entries) / best
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1].strip())
+    parser.add_argument('--keys', type=int, default=20000)
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    sandboxed_env = SandboxedEnvironment(loader=FileSystemLoader(str(TEMPLATES_DIR)))
+    sandboxed_rate = time_render(sandboxed_env, scaled_run_defs(args.keys, False), args.repeat)
+
+    with tempfile.TemporaryDirectory() as bundle_dir:
+        trusted_run_defs = scaled_run_defs(args.keys, True)
+        trusted_env = build_trusted_env_from_runs(sandboxed_env, trusted_run_defs, Path(bundle_dir))
+        trusted_rate = time_render(trusted_env, trusted_run_defs, args.repeat)
+
+    print(f'sandboxed: {sandboxed_rate:10.0f} entries/s')
+    print(f'trusted:   {trusted_rate:10.0f} entries/s ({trusted_rate / sandboxed_rate:.2f}x)')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,43 @@
+"""
+    Synthetic key trees and runs shared by the benchmarks
+    ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+"""
+from typing import Dict, Iterator, List, Tuple
+
+from jinja2 import DictLoader
+from jinja2.sandbox import SandboxedEnvironment
+
+from sphinxcontrib.jinjagen.filegen2 import (FileGenRunData, FileGenRunDef, FileGenRunNameOption, GenKeyNode,
+                                             GenKeyRoots)
+
+DEFAULT_TEMPLATES: Dict[str, str] = {
+    'entry.jinja': 'Entry\n=====\n\n{{ gen_run_entry.run_data.run_def.name }}\n{{ gen_run_entry.gen_key }}\n'
+                   '{% for k in gen_node.parent.children %}* {{ k }}\n{% endfor %}',
+}
+
+
+def synthetic_key_node(key: str, width: int, depth: int) -> GenKeyNode:
+    return GenKeyNode.from_children_iter(key, [
+        synthetic_key_node(f'{key}.{i}', width, depth - 1) for i in range(width)] if depth else [])
+
+
+def width_for_leaves(leaves: int, depth: int) -> int:
+    return max(1, round(leaves ** (1 / depth)))
+
+
+def leaf_keypaths(key_node: GenKeyNode, prefix: Tuple[str, ...] = ()) -> Iterator[Tuple[str, ...]]:
+    keypath = (*prefix, key_node.key)
+    if not key_node.children:
+        yield keypath
+    for child in key_node.children.values():
+        yield from leaf_keypaths(child, keypath)
+
+
+def synthetic_runs(width: int, depth: int, n_runs: int,
+                   templates: Dict[str, str] = DEFAULT_TEMPLATES) -> List[FileGenRunData]:
+    template_env = SandboxedEnvironment(loader=DictLoader(templates))
+    template_name = next(iter(templates))
+    key_roots = GenKeyRoots.from_roots_iter([synthetic_key_node('gen', width, depth)])
+    return [FileGenRunDef(key_roots, f'run{r}', template_name, 'rst',
+                          FileGenRunNameOption.ALL_KEYS_DIRS, None).create_run_data(template_env)
+            for r in range(n_runs)]
@@ -8,14 +8,32 @@
     :license: BSD, see LICENSE for details.
 """
 
-from jinja2.sandbox import SandboxedEnvironment
 import pbr.version
 
 # For type annotations
-from typing import Any, Dict, List, Optional
+from typing import Any, Dict, List, Optional, cast
+from pathlib import Path
+from functools import partial
 from sphinx.application import Sphinx
+from sphinx.util.logging import getLogger
 from sphinxcontrib.jinjagen.util import BuiltinTemplateLoaderEnvFactory, JinjaEnvFactory
-from .filegen2 import FileGenRunDef, gen_from_run_defs
+from .filegen2 import FileGenRoots, FileGenRunDef, RenderGenTree, gen_from_run_defs
+from .cache import FileGenCache
+from .config import GenConfig
+from .parallel import render_and_write_gen_tree_parallel
+from .ext import JinjagenDomain
+from .stats import GenReport
+from .writer import DEFAULT_QUEUE_SIZE, DEFAULT_WRITER_THREADS, render_and_write_gen_tree_async
+from .fragcache import DEFAULT_FRAGMENT_CACHE_SIZE
+from .pipeline import stream_from_run_defs
+from .virtual import VirtualDocs, activate, env_get_outdated, html_page_context, install_source_input
+from .watch import DEFAULT_WATCH_INTERVAL
+from .shard import GenShard
+from .subset import GenSubset
+from .incremental import env_get_outdated as generated_get_outdated, env_get_updated, env_purge_doc, \
+    record_generated_docs, remove_stale_outputs
+
+logger = getLogger(__name__)
 
 __version__ = '1.2.3' #pbr.version.VersionInfo('sphinxcontrib-jinjagen').version_string()
 
@@ -25,9 +43,77 @@ def builder_inited(app: Sphinx) -> None:
     if not run_defs or not run_env_factory or not app.env:
         return
 
-    template_env: SandboxedEnvironment = run_env_factory.build_env(app)
+    report: GenReport = GenReport()
+    config: GenConfig = GenConfig.from_app(app, report)
+    run_defs = config.run_defs
+    subset: Optional[GenSubset] = config.subset
+    shard: Optional[GenShard] = config.shard
+    cache: FileGenCache = config.load_cache(app)
+
+    # None follows sphinx -j
+    jobs: Optional[int] = app.config.jinjagen_parallel
+    if jobs is None:
+        jobs = app.parallel
+
+    render_tree: RenderGenTree = partial(render_and_write_gen_tree_parallel,
+        env_builder=config.build_env,
+        jobs=jobs)
+    if jobs <= 1 and app.config.jinjagen_write_queue_size > 0:
+        render_tree = partial(render_and_write_gen_tree_async,
+            queue_size=app.config.jinjagen_write_queue_size,
+            threads=app.config.jinjagen_writer_threads)
+    virtual_docs: Optional[VirtualDocs] = None
+    if app.config.jinjagen_virtual_docs:
+        if install_source_input(app):
+            virtual_docs = VirtualDocs(str(app.env.srcdir), app.env.doc2path,
+                deferred=app.config.jinjagen_virtual_deferred)
+            render_tree = virtual_docs.collect
+            if subset is not None:
+                logger.warning('jinjagen: with jinjagen_virtual_docs, docs outside jinjagen_only are not built')
+        else:
+            logger.warning('jinjagen: virtual docs need a newer Sphinx, writing files instead')
+    activate(virtual_docs)
+
+    domain: JinjagenDomain = cast(JinjagenDomain, app.env.get_domain(JinjagenDomain.name))
+    previous_genrefs: Dict[str, Dict[str, str]] = domain.genrefs
+    if app.config.jinjagen_streaming_tree and virtual_docs is None and shard is None:
+        domain.data['genrefs'] = {}
+        stream_from_run_defs(config.template_env, run_defs, str(app.env.srcdir), cache,
+            config.trusted_env,
+            report,
+            partial(domain.add_genref, src_dir=str(app.env.srcdir)),
+            config.contexts,
+            config.entry_filter)
+    else:
+        if app.config.jinjagen_streaming_tree:
+            logger.warning('jinjagen: jinjagen_streaming_tree is ignored with %s',
+                'jinjagen_virtual_docs' if virtual_docs is not None else 'jinjagen_shard')
+        gen_roots: FileGenRoots = gen_from_run_defs(config.template_env, run_defs, app.env.srcdir, cache,
+            render_tree,
+            config.trusted_env,
+            config.build_gen_tree,
+            report,
+            app.config.jinjagen_navigation,
+            config.contexts,
+            shard,
+            config.entry_filter)
+
+        with report.phase('index genrefs'):
+            domain.index_gen_roots(gen_roots, str(app.env.srcdir), config.entry_filter)
+    if subset is not None:
+        subset.merge_genrefs(previous_genrefs, domain.genrefs)
+
+    if app.config.jinjagen_remove_stale:
+        with report.phase('remove stale'):
+            remove_stale_outputs(cache)
+    record_generated_docs(app.env, previous_genrefs, report.write_stats)
+    if cache.volatile_runs:
+        logger.info('jinjagen: runs %s are rendered on every build, their templates or contexts '
+                    'cannot be fingerprinted', ', '.join(sorted(cache.volatile_runs)))
 
-    gen_from_run_defs(template_env, run_defs, app.env.srcdir)
+    report.log_summary()
+    if app.config.jinjagen_report_json:
+        report.write_json(Path(app.outdir, app.config.jinjagen_report_json))
 
 
 # unicode?
@@ -41,7 +127,37 @@ def setup(app: Sphinx) -> Dict[str, Any]:
     # test_runs = [jinjagen_run1]
     app.add_config_value('jinjagen_runs', [], 'env')
     app.add_config_value('jinjagen_run_env_factory', BuiltinTemplateLoaderEnvFactory(), 'env') #TODO check env
-    app.add_config_value('jinjagen_contexts', {}, 'env') #TODO check env
+    # name -> JinjagenContextBase, gen_ctx in templates; versioned by the manifest, not the env,
+    # as providers built from callables never compare equal to the previous build's
+    app.add_config_value('jinjagen_contexts', {}, '')
+    app.add_config_value('jinjagen_force_regen', False, '')
+    app.add_config_value('jinjagen_parallel', None, '')
+    app.add_config_value('jinjagen_bytecode_cache', True, '')
+    app.add_config_value('jinjagen_trusted_bundle', False, '')
+    app.add_config_value('jinjagen_compact_tree', False, '')
+    app.add_config_value('jinjagen_report_json', None, '') # path relative to the output dir
+    app.add_config_value('jinjagen_virtual_docs', False, 'env')
+    app.add_config_value('jinjagen_streaming_tree', False, '')
+    app.add_config_value('jinjagen_navigation', False, '')
+    app.add_config_value('jinjagen_fragment_cache_size', DEFAULT_FRAGMENT_CACHE_SIZE, '')
+    app.add_config_value('jinjagen_write_queue_size', DEFAULT_QUEUE_SIZE, '') # 0 writes inline while rendering
+    app.add_config_value('jinjagen_writer_threads', DEFAULT_WRITER_THREADS, '')
+    app.add_config_value('jinjagen_virtual_deferred', True, '')
+    app.add_config_value('jinjagen_watch_files', {}, '') # data file relative to conf.py -> context names or None
+    app.add_config_value('jinjagen_watch_interval', DEFAULT_WATCH_INTERVAL, '')
+    # delete outputs the previous build generated and this one did not, e.g. of
+    # removed keys or renamed runs; they are in the source tree, so off by default
+    app.add_config_value('jinjagen_remove_stale', False, '')
+    app.add_config_value('jinjagen_shard', None, '') # (index, count) or "index/count"
+    app.add_config_value('jinjagen_shard_strategy', 'hash', '') # or 'range'
+    app.add_config_value('jinjagen_only', [], '') # dotted key path globs, or JINJAGEN_ONLY
+    app.add_config_value('jinjagen_only_runs', [], '') # run name globs, or JINJAGEN_ONLY_RUNS
+    app.add_domain(JinjagenDomain)
     app.connect('builder-inited', builder_inited)
+    app.connect('env-get-outdated', env_get_outdated)
+    app.connect('env-get-outdated', generated_get_outdated)
+    app.connect('env-get-updated', env_get_updated)
+    app.connect('env-purge-doc', env_purge_doc)
+    app.connect('html-page-context', html_page_context)
 
     return {'version': __version__, 'parallel_read_safe': True}
@@ -0,0 +1,21 @@
+"""Command line tools: ``python -m sphinxcontrib.jinjagen watch|merge-shards ...``"""
+import sys
+from typing import Callable, Dict, List, Optional
+
+from . import shard, watch
+
+COMMANDS: Dict[str, Callable[[Optional[List[str]]], int]] = {
+    'watch': watch.main,
+    'merge-shards': shard.main,
+}
+
+
+def main(argv: List[str]) -> int:
+    if not argv or argv[0] not in COMMANDS:
+        print(f'usage: python -m sphinxcontrib.jinjagen {{{",".join(COMMANDS)}}} ...', file=sys.stderr)
+        return 2
+    return COMMANDS[argv[0]](argv[1:])
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
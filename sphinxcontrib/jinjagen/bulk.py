@@ -0,0 +1,99 @@
+from __future__ import annotations
+from typing import List, Dict, Tuple, Optional, Iterable, Sequence
+
+from .filegen2 import FileGenNode, FileGenRoots, FileGenRunData, FileGenRunEntry, GenKeyNode
+from .sources import KeyPathSource
+
+
+class FusedTreeBuilder:
+    """Builds ``FileGenRoots`` with run entries directly from the runs' key
+    trees or key paths, without the intermediate ``FileGenBuilderRoots``.
+
+    Nodes are merged into the final tree as keys arrive. Leaves are only
+    collected, and their run entries are created in ``finish`` once every
+    run has been added, when the number of runs per node is known.
+    """
+
+    def __init__(self, base_dir: str) -> None:
+        self.base_dir: str = base_dir
+        self.gen_roots: FileGenRoots = FileGenRoots({})
+        self._leaves: List[Tuple[FileGenNode, FileGenRunData]] = []
+
+    def _child(self, parent: Optional[FileGenNode], key: str) -> FileGenNode:
+        siblings = self.gen_roots.roots if parent is None else parent.children
+        node: Optional[FileGenNode] = siblings.get(key)
+        if node is None:
+            node = FileGenNode(key, parent, {}, {})
+            siblings[key] = node
+        return node
+
+    def add_key_roots(self, run_data: FileGenRunData, key_roots: Iterable[GenKeyNode]) -> None:
+        stack: List[Tuple[GenKeyNode, Optional[FileGenNode]]] = \
+            [(key_node, None) for key_node in reversed(list(key_roots))]
+        while stack:
+            key_node, parent = stack.pop()
+            node: FileGenNode = self._child(parent, key_node.key)
+            if key_node.children:
+                # reversed so children are created in key tree order
+                stack.extend((child, node) for child in reversed(key_node.children.values()))
+            else:
+                self._leaves.append((node, run_data))
+
+    def add_keypaths(self, run_data: FileGenRunData, keypaths: Iterable[Sequence[str]]) -> None:
+        """Add the leaf *keypaths* of one run. Consecutive keypaths share the
+        nodes of their common prefix, so sorted input does one lookup per
+        new key only. Any order is accepted.
+        """
+        path_nodes: List[FileGenNode] = []
+        prev_keypath: Sequence[str] = ()
+        for keypath in keypaths:
+            common: int = 0
+            for prev_key, key in zip(prev_keypath, keypath):
+                if prev_key != key:
+                    break
+                common += 1
+            del path_nodes[common:]
+            for key in keypath[common:]:
+                path_nodes.append(self._child(path_nodes[-1] if path_nodes else None, key))
+            if path_nodes:
+                self._leaves.append((path_nodes[-1], run_data))
+            prev_keypath = keypath
+
+    def finish(self) -> FileGenRoots:
+        runs_per_node: Dict[int, int] = {}
+        for node, _ in self._leaves:
+            runs_per_node[id(node)] = runs_per_node.get(id(node), 0) + 1
+
+        for node, run_data in self._leaves:
+            run_def = run_data.run_def
+            node.run_entry_by_name[run_def.name] = FileGenRunEntry(
+                gen_key=node.key,
+                run_data=run_data,
+                filepath=run_def.entry_filepath_from_key_dir(
+                    runs_per_node[id(node)] > 1, self.base_dir, node.key_dir))
+
+        self._leaves = []
+        return self.gen_roots
+
+
+def gen_tree_from_runs_fused(base_dir: str, runs: List[FileGenRunData]) -> FileGenRoots:
+    """Single pass equivalent of ``gen_tree_from_runs``. Runs with a key
+    path source are consumed as their key paths are read.
+    """
+    builder: FusedTreeBuilder = FusedTreeBuilder(base_dir)
+    for run_data in runs:
+        key_roots = run_data.run_def.gen_key_roots
+        if isinstance(key_roots, KeyPathSource):
+            builder.add_keypaths(run_data, key_roots)
+        else:
+            builder.add_key_roots(run_data, key_roots.roots.values())
+    return builder.finish()
+
+
+def gen_tree_from_keypaths(base_dir: str,
+    run_keypaths: Iterable[Tuple[FileGenRunData, Iterable[Sequence[str]]]]) -> FileGenRoots:
+    """Build the tree from each run's leaf key paths, ideally sorted."""
+    builder: FusedTreeBuilder = FusedTreeBuilder(base_dir)
+    for run_data, keypaths in run_keypaths:
+        builder.add_keypaths(run_data, keypaths)
+    return builder.finish()
@@ -0,0 +1,116 @@
+from __future__ import annotations
+from typing import Any, Dict, List, Iterable, Set
+
+import os
+from pathlib import Path
+from zipfile import ZIP_DEFLATED, ZipFile, ZipInfo
+
+from jinja2 import Environment, ModuleLoader
+from sphinx.util.logging import getLogger
+
+from .cache import fingerprint, template_fingerprint
+from .deps import TemplateDependencyGraph
+from .filegen2 import FileGenRunDef
+
+logger = getLogger(__name__)
+
+BUNDLE_PREFIX = 'jinjagen_bundle-'
+
+# Environment options kept as attributes of the same name
+ENV_OPTIONS = ('block_start_string', 'block_end_string', 'variable_start_string', 'variable_end_string',
+               'comment_start_string', 'comment_end_string', 'line_statement_prefix', 'line_comment_prefix',
+               'trim_blocks', 'lstrip_blocks', 'newline_sequence', 'keep_trailing_newline', 'optimized',
+               'undefined', 'finalize', 'autoescape', 'auto_reload')
+
+
+def env_options(template_env: Environment) -> Dict[str, Any]:
+    """Init options of *template_env* besides its loader and caches."""
+    options: Dict[str, Any] = {name: getattr(template_env, name) for name in ENV_OPTIONS}
+    options['enable_async'] = template_env.is_async
+    options['extensions'] = [type(ext) for ext in template_env.extensions.values()]
+    return options
+
+
+def _option_part(value: Any) -> str:
+    if isinstance(value, list):
+        return ','.join(_option_part(item) for item in value)
+    if callable(value):
+        return f'{getattr(value, "__module__", "")}.{getattr(value, "__qualname__", repr(value))}'
+    return repr(value)
+
+
+def env_options_fingerprint(template_env: Environment) -> str:
+    return fingerprint(f'{name}={_option_part(value)}'
+                       for name, value in sorted(env_options(template_env).items()))
+
+
+def unsandboxed_env_like(template_env: Environment, **kwargs) -> Environment:
+    """Plain ``Environment`` with the options, filters, tests, globals,
+    policies and extensions of *template_env*, so it renders the same.
+    Only for templates the project trusts.
+    """
+    for name, value in env_options(template_env).items():
+        kwargs.setdefault(name, value)
+    env: Environment = Environment(**kwargs)
+    if hasattr(template_env, 'fragment_cache_size'):
+        env.fragment_cache_size = template_env.fragment_cache_size # type: ignore
+    env.filters.update(template_env.filters)
+    env.tests.update(template_env.tests)
+    env.globals.update(template_env.globals)
+    env.policies.update(template_env.policies)
+    return env
+
+
+def trusted_template_names(graph: TemplateDependencyGraph, run_defs: Iterable[FileGenRunDef]) -> List[str]:
+    names: Set[str] = set()
+    for run_def in run_defs:
+        if run_def.trusted:
+            names.update(graph.dependencies(run_def.template_filepath))
+    return sorted(names)
+
+
+def compile_template_bundle(template_env: Environment,
+    graph: TemplateDependencyGraph,
+    template_names: List[str],
+    bundle_dir: Path) -> Path:
+    """Compile *template_names* into a zipped module bundle in *bundle_dir*.
+    The bundle is named after a fingerprint of the template sources and the
+    env's options, so an unchanged set of templates reuses the previous
+    bundle.
+    """
+    bundle_fingerprint: str = fingerprint([env_options_fingerprint(template_env),
+        *(template_fingerprint(graph, name) for name in template_names)])
+    bundle_path: Path = Path(bundle_dir, f'{BUNDLE_PREFIX}{bundle_fingerprint[:16]}.zip')
+    if bundle_path.is_file():
+        return bundle_path
+
+    bundle_dir.mkdir(exist_ok=True, parents=True)
+    for stale_path in bundle_dir.glob(f'{BUNDLE_PREFIX}*.zip'):
+        stale_path.unlink()
+
+    tmp_path: Path = bundle_path.with_suffix('.tmp')
+    compile_env: Environment = unsandboxed_env_like(template_env, loader=template_env.loader)
+    # written like Environment.compile_templates, which needs list_templates,
+    # e.g. not supported by Sphinx's BuiltinTemplateLoader
+    with ZipFile(tmp_path, 'w', ZIP_DEFLATED) as bundle:
+        for name in template_names:
+            source, filename, _ = compile_env.loader.get_source(compile_env, name) # type: ignore
+            info: ZipInfo = ZipInfo(ModuleLoader.get_module_filename(name))
+            info.external_attr = 0o755 << 16
+            bundle.writestr(info, compile_env.compile(source, name, filename, raw=True, defer_init=True))
+    os.replace(tmp_path, bundle_path)
+    logger.info('jinjagen: compiled %d trusted templates into %s', len(template_names), bundle_path)
+    return bundle_path
+
+
+def build_trusted_env(template_env: Environment, bundle_path: Path) -> Environment:
+    return unsandboxed_env_like(template_env, loader=ModuleLoader(str(bundle_path)))
+
+
+def build_trusted_env_from_runs(template_env: Environment,
+    run_defs: Iterable[FileGenRunDef],
+    bundle_dir: Path) -> Environment:
+    trusted_run_defs: List[FileGenRunDef] = [run_def for run_def in run_defs if run_def.trusted]
+    graph: TemplateDependencyGraph = TemplateDependencyGraph.build(template_env, trusted_run_defs)
+    return build_trusted_env(template_env, compile_template_bundle(
+        template_env, graph, trusted_template_names(graph, trusted_run_defs), bundle_dir))
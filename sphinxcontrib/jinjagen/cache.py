@@ -0,0 +1,149 @@
+from __future__ import annotations
+from typing import Any, List, Dict, Optional, Iterable, Set
+
+import hashlib
+import json
+import os
+from pathlib import Path
+
+from dataclasses import dataclass, field
+
+from sphinx.util.logging import getLogger
+
+from .deps import TEMPLATE_GRAPH_FILENAME, TemplateDependencyGraph
+
+logger = getLogger(__name__)
+
+MANIFEST_FILENAME = 'jinjagen_manifest.json'
+MANIFEST_VERSION = 1
+MISSING_TEMPLATE_DIGEST = 'missing'
+
+
+def fingerprint(parts: Iterable[str]) -> str:
+    h = hashlib.sha256()
+    for part in parts:
+        h.update(part.encode('utf-8'))
+        h.update(b'\0')
+    return h.hexdigest()
+
+
+def template_fingerprint(graph: TemplateDependencyGraph, template_name: str) -> str:
+    """Fingerprint of *template_name* and every template it pulls in,
+    from the sources digested when *graph* was built. Missing templates
+    count too, so adding one changes the fingerprint.
+    """
+    return fingerprint(
+        part
+        for dep_name in graph.dependencies(template_name, include_missing=True)
+        for part in (dep_name, graph.digests.get(dep_name, MISSING_TEMPLATE_DIGEST)))
+
+
+@dataclass
+class FileGenCache:
+    """Generation manifest mapping each output path to the fingerprint of
+    what produced it: template sources (with dependencies), run definition
+    and key path. Entries whose fingerprint matches the previous build and
+    whose output still exists are not re-rendered.
+
+    Run fingerprints include the whole tree, as templates can read other
+    nodes through ``gen_roots``, and the versions of the context providers
+    the run uses; a *volatile* run, e.g. using an unversioned provider or
+    a template with a dynamic ``{% include %}``, is re-rendered on every
+    build. Other data templates read is not tracked,
+    set *force* to regenerate everything.
+
+    The template dependency graph is kept next to the manifest, so the
+    templates changed since the previous build and the runs they affect
+    are known without comparing fingerprints.
+    """
+    manifest_path: Optional[Path]
+    previous: Dict[str, str]
+    force: bool = False
+    current: Dict[str, str] = field(default_factory=dict)
+    run_fingerprints: Dict[str, str] = field(default_factory=dict)
+    previous_template_graph: Optional[TemplateDependencyGraph] = None
+    template_graph: Optional[TemplateDependencyGraph] = None
+    # set by a sharded build, see GenShard.apply
+    shard: Optional[Dict[str, Any]] = None
+    # set by a build of part of the tree, see GenSubset.apply_to_cache
+    partial: Optional[str] = None
+    # part of volatile runs' fingerprints, never the same in two builds
+    build_nonce: str = field(default_factory=lambda: os.urandom(16).hex())
+    volatile_runs: Set[str] = field(default_factory=set)
+
+    @classmethod
+    def load(cls, manifest_path: Optional[Path], force: bool = False) -> FileGenCache:
+        previous: Dict[str, str] = {}
+        if manifest_path is not None and not force:
+            try:
+                data: Dict[str, Any] = json.loads(manifest_path.read_text())
+                if data.get('version') == MANIFEST_VERSION:
+                    previous = data['entries']
+            except FileNotFoundError:
+                pass
+            except (ValueError, KeyError):
+                logger.warning('jinjagen: ignoring unreadable manifest %s', manifest_path)
+        previous_graph: Optional[TemplateDependencyGraph] = None
+        if manifest_path is not None and not force:
+            previous_graph = TemplateDependencyGraph.load(manifest_path.with_name(TEMPLATE_GRAPH_FILENAME))
+        return cls(manifest_path, previous, force, previous_template_graph=previous_graph)
+
+    def changed_templates(self) -> Set[str]:
+        if self.template_graph is None:
+            return set()
+        return self.template_graph.changed_since(self.previous_template_graph)
+
+    def affected_runs(self) -> Set[str]:
+        """Runs whose templates, or templates they use, changed since the
+        previous build; all runs on a first build.
+        """
+        if self.template_graph is None:
+            return set()
+        return self.template_graph.affected_runs(self.changed_templates())
+
+    def add_run(self,
+        run_name: str,
+        template_name: str,
+        run_def_parts: Iterable[str],
+        volatile: bool = False) -> None:
+        assert self.template_graph is not None, 'set template_graph first'
+        volatile = volatile or self.template_graph.is_dynamic(template_name)
+        if volatile:
+            self.volatile_runs.add(run_name)
+        self.run_fingerprints[run_name] = fingerprint(
+            [*run_def_parts, template_fingerprint(self.template_graph, template_name),
+             self.partial or '', self.build_nonce if volatile else ''])
+
+    def entry_fingerprint(self, run_name: str, from_root_keypath: Iterable[str]) -> str:
+        return fingerprint([self.run_fingerprints[run_name], *from_root_keypath])
+
+    def is_unchanged(self, filepath: Path, entry_fingerprint: str) -> bool:
+        return not self.force and self.previous.get(str(filepath)) == entry_fingerprint
+
+    def is_fresh(self, filepath: Path, entry_fingerprint: str) -> bool:
+        return self.is_unchanged(filepath, entry_fingerprint) and filepath.is_file()
+
+    def keep_previous(self) -> None:
+        """Carry the previous build's entries over, for a build that only
+        generates part of the tree and leaves the rest on disk.
+        """
+        for filepath, entry_fingerprint in self.previous.items():
+            self.current.setdefault(filepath, entry_fingerprint)
+
+    def stale_paths(self) -> List[str]:
+        """Outputs of the previous build that this one did not generate."""
+        return sorted(set(self.previous) - set(self.current))
+
+    def record(self, filepath: Path, entry_fingerprint: str) -> None:
+        self.current[str(filepath)] = entry_fingerprint
+
+    def save(self) -> None:
+        if self.manifest_path is None:
+            return
+        self.manifest_path.parent.mkdir(exist_ok=True, parents=True)
+        data: Dict[str, Any] = {'version': MANIFEST_VERSION, 'entries': self.current}
+        if self.shard is not None:
+            data['shard'] = self.shard
+        self.manifest_path.write_text(json.dumps(data, sort_keys=True))
+        if self.template_graph is not None:
+            self.template_graph.save(self.manifest_path.with_name(TEMPLATE_GRAPH_FILENAME))
@@ -0,0 +1,188 @@
+from __future__ import annotations
+from typing import Callable, List, Dict, Tuple, Optional, Iterable, Iterator, Sequence
+
+import sys
+from array import array
+
+from dataclasses import dataclass, field
+
+from .filegen2 import FileGenRunData, FileGenRunEntry, GenKeyNode
+from .context import GenContexts
+from .navigation import GenNavigation
+from .node import StrKeyNodeBaseP, StrKeyRootNodes
+
+NO_NODE = -1
+
+
+class CompactGenTree:
+    """Generation tree stored as parallel arrays instead of node objects.
+
+    Node ``i`` has key ``keys[i]`` (interned), parent ``parents[i]`` and its
+    children are chained through ``first_child``/``next_sibling`` in
+    insertion order. ``run_masks[i]`` has bit ``r`` set when ``runs[r]``
+    has an entry at the node. Run entries and node views are created on
+    access, so only the arrays live for the whole build.
+    """
+
+    def __init__(self, base_dir: str, runs: List[FileGenRunData]) -> None:
+        self.base_dir: str = base_dir
+        self.runs: List[FileGenRunData] = runs
+        self.keys: List[str] = []
+        self.parents: array = array('l')
+        self.first_child: array = array('l')
+        self.next_sibling: array = array('l')
+        self.run_masks: List[int] = []
+        self.root_indices: Dict[str, int] = {}
+        # build only, dropped by freeze()
+        self._last_child: Optional[array] = array('l')
+        self._child_index: Optional[Dict[Tuple[int, str], int]] = {}
+
+    def __len__(self) -> int:
+        return len(self.keys)
+
+    def lookup_else_create(self, parent: int, key: str) -> int:
+        assert self._child_index is not None and self._last_child is not None, 'tree is frozen'
+        index_key: Tuple[int, str] = (parent, key)
+        found: Optional[int] = self._child_index.get(index_key)
+        if found is not None:
+            return found
+
+        i: int = len(self.keys)
+        self.keys.append(sys.intern(key))
+        self.parents.append(parent)
+        self.first_child.append(NO_NODE)
+        self.next_sibling.append(NO_NODE)
+        self.run_masks.append(0)
+        self._last_child.append(NO_NODE)
+        self._child_index[index_key] = i
+
+        if parent == NO_NODE:
+            self.root_indices[key] = i
+        elif self._last_child[parent] == NO_NODE:
+            self.first_child[parent] = i
+            self._last_child[parent] = i
+        else:
+            self.next_sibling[self._last_child[parent]] = i
+            self._last_child[parent] = i
+        return i
+
+    def add_run_key_roots(self, run_index: int, key_roots: Iterable[GenKeyNode]) -> None:
+        run_bit: int = 1 << run_index
+        stack: List[Tuple[GenKeyNode, int]] = [(key_node, NO_NODE) for key_node in key_roots]
+        while stack:
+            key_node, parent = stack.pop()
+            i: int = self.lookup_else_create(parent, key_node.key)
+            if key_node.children:
+                # reversed so children are created in key tree order
+                stack.extend((child, i) for child in reversed(key_node.children.values()))
+            else:
+                self.run_masks[i] |= run_bit
+
+    def freeze(self) -> None:
+        self._child_index = None
+        self._last_child = None
+
+    def child_indices(self, i: int) -> Iterator[int]:
+        c: int = self.first_child[i]
+        while c != NO_NODE:
+            yield c
+            c = self.next_sibling[c]
+
+    def keypath(self, i: int) -> List[str]:
+        path: List[str] = []
+        while i != NO_NODE:
+            path.append(self.keys[i])
+            i = self.parents[i]
+        path.reverse()
+        return path
+
+    def run_entries(self, i: int, keypath: Optional[Sequence[str]] = None) -> Dict[str, FileGenRunEntry]:
+        mask: int = self.run_masks[i]
+        if not mask:
+            return {}
+        has_siblings: bool = (mask & (mask - 1)) != 0
+        if keypath is None:
+            keypath = self.keypath(i)
+        return {
+            run_data.run_def.name: FileGenRunEntry(
+                gen_key=self.keys[i],
+                run_data=run_data,
+                filepath=run_data.run_def.entry_filepath_from_key_path(
+                    has_siblings, self.base_dir, keypath))
+            for r, run_data in enumerate(self.runs) if mask >> r & 1}
+
+    def node(self, i: int) -> CompactGenNode:
+        return CompactGenNode(self, i, tuple(self.keypath(i)))
+
+
+class CompactGenNode(StrKeyNodeBaseP):
+    """Light view of one node of a ``CompactGenTree``, with the same
+    attributes templates use on ``FileGenNode``. Its key path is fixed
+    when the view is created, from its parent's.
+    """
+    __slots__ = ('_tree', '_index', '_keypath')
+
+    def __init__(self, tree: CompactGenTree, index: int, keypath: Tuple[str, ...]) -> None:
+        self._tree = tree
+        self._index = index
+        self._keypath = keypath
+
+    def __eq__(self, other: object) -> bool:
+        return isinstance(other, CompactGenNode) \
+            and other._tree is self._tree and other._index == self._index
+
+    def __hash__(self) -> int:
+        return hash((id(self._tree), self._index))
+
+    def __repr__(self) -> str:
+        return f'CompactGenNode({".".join(self._keypath)!r})'
+
+    @property
+    def key(self) -> str: return self._tree.keys[self._index]
+
+    @property
+    def children(self) -> Dict[str, CompactGenNode]:
+        return {self._tree.keys[c]: CompactGenNode(self._tree, c, (*self._keypath, self._tree.keys[c]))
+            for c in self._tree.child_indices(self._index)}
+
+    @property
+    def parent(self) -> Optional[CompactGenNode]:
+        p: int = self._tree.parents[self._index]
+        return None if p == NO_NODE else CompactGenNode(self._tree, p, self._keypath[:-1])
+
+    @property
+    def run_entry_by_name(self) -> Dict[str, FileGenRunEntry]:
+        return self._tree.run_entries(self._index, self._keypath)
+
+    @property
+    def keypath(self) -> Tuple[str, ...]: return self._keypath
+
+    @property
+    def key_dir(self) -> str: return '/'.join(self._keypath)
+
+    def from_root_keypath(self, include_self: bool) -> Iterator[str]:
+        return iter(self._keypath if include_self else self._keypath[:-1])
+
+
+@dataclass
+class CompactGenRoots(StrKeyRootNodes[CompactGenNode]):
+    tree: CompactGenTree = field(default=None) # type: ignore
+    navigation: Optional[GenNavigation] = field(default=None, repr=False, compare=False)
+    contexts: Optional[GenContexts] = field(default=None, repr=False, compare=False)
+    entry_filter: Optional[Callable[[CompactGenNode, FileGenRunEntry], bool]] = \
+        field(default=None, repr=False, compare=False)
+
+    @classmethod
+    def from_tree(cls, tree: CompactGenTree) -> CompactGenRoots:
+        return cls({key: tree.node(i) for key, i in tree.root_indices.items()}, tree)
+
+
+def gen_compact_tree_from_runs(base_dir: str, runs: List[FileGenRunData]) -> CompactGenRoots:
+    """Drop-in for ``gen_tree_from_runs`` building a ``CompactGenTree``
+    straight from the runs' key trees, without the builder tree copy.
+    """
+    tree: CompactGenTree = CompactGenTree(base_dir, runs)
+    for run_index, run_data in enumerate(runs):
+        tree.add_run_key_roots(run_index, run_data.run_def.key_roots().roots.values())
+    tree.freeze()
+    return CompactGenRoots.from_tree(tree)
@@ -0,0 +1,83 @@
+from __future__ import annotations
+from typing import Callable, List, Optional, cast
+
+from pathlib import Path
+from functools import partial
+
+from dataclasses import dataclass
+
+from jinja2 import Environment
+from jinja2.sandbox import SandboxedEnvironment
+from sphinx.application import Sphinx
+
+from .bulk import gen_tree_from_runs_fused
+from .bundle import build_trusted_env_from_runs
+from .cache import FileGenCache, MANIFEST_FILENAME
+from .compact import gen_compact_tree_from_runs
+from .context import GenContexts
+from .filegen2 import BuildGenTree, FileGenNode, FileGenRunDef, FileGenRunEntry
+from .shard import GenShard
+from .stats import GenReport
+from .subset import GenSubset
+from .util import build_env_with_bytecode_cache
+
+
+@dataclass
+class GenConfig:
+    """The generation set up from the ``jinjagen_*`` config values, shared
+    by builder-inited and the watcher so both render the same entries:
+    the runs after ``jinjagen_only``, the envs, the tree builder, the shard
+    and the contexts.
+    """
+    run_defs: List[FileGenRunDef]
+    build_env: Callable[[], SandboxedEnvironment]
+    template_env: SandboxedEnvironment
+    build_gen_tree: BuildGenTree
+    subset: Optional[GenSubset] = None
+    shard: Optional[GenShard] = None
+    trusted_env: Optional[Environment] = None
+    contexts: Optional[GenContexts] = None
+
+    @classmethod
+    def from_app(cls, app: Sphinx, report: Optional[GenReport] = None) -> GenConfig:
+        report = report if report is not None else GenReport()
+        run_defs: List[FileGenRunDef] = app.config.jinjagen_runs
+        subset: Optional[GenSubset] = GenSubset.from_config(app.config.jinjagen_only,
+            app.config.jinjagen_only_runs)
+        if subset is not None:
+            run_defs = subset.apply(run_defs)
+
+        build_env: Callable[[], SandboxedEnvironment] = \
+            partial(build_env_with_bytecode_cache, app.config.jinjagen_run_env_factory, app) \
+            if app.config.jinjagen_bytecode_cache \
+            else partial(app.config.jinjagen_run_env_factory.build_env, app)
+        with report.phase('build env'):
+            template_env: SandboxedEnvironment = build_env()
+
+        trusted_env: Optional[Environment] = None
+        if app.config.jinjagen_trusted_bundle and any(run_def.trusted for run_def in run_defs):
+            with report.phase('compile bundle'):
+                trusted_env = build_trusted_env_from_runs(template_env, run_defs, Path(app.doctreedir))
+
+        return cls(run_defs,
+            build_env,
+            template_env,
+            cast(BuildGenTree, gen_compact_tree_from_runs) \
+                if app.config.jinjagen_compact_tree else gen_tree_from_runs_fused,
+            subset,
+            GenShard.from_config(app.config.jinjagen_shard, app.config.jinjagen_shard_strategy),
+            trusted_env,
+            GenContexts(app.config.jinjagen_contexts) if app.config.jinjagen_contexts else None)
+
+    @property
+    def entry_filter(self) -> Optional[Callable[[FileGenNode, FileGenRunEntry], bool]]:
+        return self.subset.includes_entry if self.subset is not None else None
+
+    def load_cache(self, app: Sphinx) -> FileGenCache:
+        """The manifest of this shard, if any, kept for a subset build."""
+        cache: FileGenCache = FileGenCache.load(
+            Path(app.doctreedir, self.shard.manifest_filename if self.shard is not None else MANIFEST_FILENAME),
+            force=app.config.jinjagen_force_regen)
+        if self.subset is not None:
+            self.subset.apply_to_cache(cache)
+        return cache
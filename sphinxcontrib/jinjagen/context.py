@@ -1,18 +1,173 @@
-from typing import NewType, Protocol, Callable, TypeVar, Generic, Mapping, Any, List, Dict, Tuple, Optional, Iterable, Sequence, Generator, Iterator
+from typing import Callable, Mapping, Any, List, Dict, Tuple, Optional, Iterable, Sequence, Collection
 from typing import ForwardRef
 from typing import cast
 
+from abc import ABC, abstractmethod
+
 from jinja2 import Template, Environment, FileSystemLoader
-from sphinxcontrib.jinjagen.util import JinjaEnvFactory
+from sphinxcontrib.jinjagen.cache import fingerprint
+
+
+class JinjagenContextBase(ABC):
+    """Data provider for templates, declared in ``jinjagen_contexts`` under
+    the name templates use through ``gen_ctx``. ``load`` runs on first
+    access and its result is kept for the rest of the build. Override
+    ``lookup`` to hand each node its own part of the data; that is
+    memoized per node.
+
+    *runs* limits the provider to the named runs, *subtree* to nodes under
+    that key path.
+    """
+
+    def __init__(self,
+        runs: Optional[Collection[str]] = None,
+        subtree: Sequence[str] = ()) -> None:
+        self.runs: Optional[Collection[str]] = runs
+        self.subtree: Tuple[str, ...] = tuple(subtree)
+
+    @abstractmethod
+    def load(self) -> Any:...
+
+    def lookup(self, data: Any, gen_node: Any) -> Any:
+        return data
+
+    def fingerprint(self) -> Optional[str]:
+        """Version of the data, e.g. a data file's mtime, kept in the
+        manifest with the runs the provider applies to; their entries are
+        re-rendered when it changes. None, the default, re-renders them on
+        every build.
+        """
+        return None
 
+    @property
+    def per_node(self) -> bool:
+        return type(self).lookup is not JinjagenContextBase.lookup
 
-class JinjagenContextBase:
+    # Sphinx pickles the config with the env, and conf.py callables such as
+    # lambdas cannot be; like Sphinx, leave them out, and private caches too
+    def __getstate__(self) -> Dict[str, Any]:
+        return {name: value for name, value in self.__dict__.items()
+                if not callable(value) and not name.startswith('_')}
 
-    ctxt: Dict[str, Any]
-    env_factory: JinjaEnvFactory
+    def applies_to_run(self, run_name: str) -> bool:
+        return self.runs is None or run_name in self.runs
+
+    def applies_to(self, run_name: str, keypath: Tuple[str, ...]) -> bool:
+        return self.applies_to_run(run_name) and keypath[:len(self.subtree)] == self.subtree
 
     #TODO where to get template dir?? just let it be the templates directory..., directive gives relative filepath
     # def build_file_loader(self, template_filepath: str) -> FileSystemLoader:
-    #    return 
+    #    return
+
+
+class ContextProvider(JinjagenContextBase):
+    """``JinjagenContextBase`` from callables: *load* and *fingerprint*
+    take no arguments, *lookup* gets the loaded data and the node.
+    """
+
+    def __init__(self,
+        load: Callable[[], Any],
+        lookup: Optional[Callable[[Any, Any], Any]] = None,
+        runs: Optional[Collection[str]] = None,
+        subtree: Sequence[str] = (),
+        fingerprint: Optional[Callable[[], Optional[str]]] = None) -> None:
+        super().__init__(runs, subtree)
+        self._load: Callable[[], Any] = load
+        self._lookup: Optional[Callable[[Any, Any], Any]] = lookup
+        self._fingerprint: Optional[Callable[[], Optional[str]]] = fingerprint
+
+    def load(self) -> Any:
+        return self._load()
+
+    def lookup(self, data: Any, gen_node: Any) -> Any:
+        return self._lookup(data, gen_node) if self._lookup is not None else data
+
+    def fingerprint(self) -> Optional[str]:
+        return self._fingerprint() if self._fingerprint is not None else None
+
+    @property
+    def per_node(self) -> bool:
+        return self._lookup is not None
+
+
+_NOT_LOADED = object()
+
+
+class GenContexts:
+    """The build's memo of ``jinjagen_contexts``: each provider is loaded
+    at most once, each per-node lookup done at most once per node.
+    """
+
+    def __init__(self, providers: Mapping[str, JinjagenContextBase]) -> None:
+        self.providers: Mapping[str, JinjagenContextBase] = providers
+        self._data: Dict[str, Any] = {}
+        self._by_node: Dict[Tuple[str, Tuple[str, ...]], Any] = {}
+
+    def data(self, name: str) -> Any:
+        data: Any = self._data.get(name, _NOT_LOADED)
+        if data is _NOT_LOADED:
+            data = self._data[name] = self.providers[name].load()
+        return data
+
+    def value(self, name: str, gen_node: Any) -> Any:
+        provider: JinjagenContextBase = self.providers[name]
+        if not provider.per_node:
+            return self.data(name)
+        memo_key: Tuple[str, Tuple[str, ...]] = (name, tuple(gen_node.keypath))
+        value: Any = self._by_node.get(memo_key, _NOT_LOADED)
+        if value is _NOT_LOADED:
+            value = self._by_node[memo_key] = provider.lookup(self.data(name), gen_node)
+        return value
+
+    def fingerprint(self, run_name: str) -> Optional[str]:
+        """Versions of the providers applying to *run_name*, None if one of
+        them has none.
+        """
+        parts: List[str] = []
+        for name, provider in sorted(self.providers.items()):
+            if provider.applies_to_run(run_name):
+                version: Optional[str] = provider.fingerprint()
+                if version is None:
+                    return None
+                parts.extend((name, version))
+        return fingerprint(parts)
+
+    def invalidate(self, names: Iterable[str]) -> None:
+        """Forget the named providers' data, e.g. after their files changed."""
+        names = set(names)
+        for name in names:
+            self._data.pop(name, None)
+        for memo_key in [memo_key for memo_key in self._by_node if memo_key[0] in names]:
+            del self._by_node[memo_key]
+
+    def for_entry(self, gen_node: Any, run_name: str) -> 'LazyContext':
+        return LazyContext(self, gen_node, run_name)
+
+
+class LazyContext:
+    """``gen_ctx`` of one rendered entry. ``gen_ctx.name`` or
+    ``gen_ctx['name']`` evaluates the provider on first use.
+    """
+
+    def __init__(self, contexts: GenContexts, gen_node: Any, run_name: str) -> None:
+        self._contexts: GenContexts = contexts
+        self._gen_node: Any = gen_node
+        self._run_name: str = run_name
+
+    def __contains__(self, name: str) -> bool:
+        provider: Optional[JinjagenContextBase] = self._contexts.providers.get(name)
+        return provider is not None \
+            and provider.applies_to(self._run_name, tuple(self._gen_node.keypath))
 
+    def __getitem__(self, name: str) -> Any:
+        if name not in self:
+            raise KeyError(name)
+        return self._contexts.value(name, self._gen_node)
 
+    def __getattr__(self, name: str) -> Any:
+        if name.startswith('_'):
+            raise AttributeError(name)
+        try:
+            return self[name]
+        except KeyError:
+            raise AttributeError(name) from None
@@ -0,0 +1,168 @@
+from __future__ import annotations
+from typing import Any, List, Dict, Optional, Iterable, Set, Tuple, TYPE_CHECKING
+
+import hashlib
+import json
+from pathlib import Path
+
+from dataclasses import dataclass, field
+
+from jinja2 import Environment, TemplateNotFound, meta
+from sphinx.util.logging import getLogger
+
+if TYPE_CHECKING:
+    from .filegen2 import FileGenNode, FileGenRunDef, FileGenRunEntry
+
+logger = getLogger(__name__)
+
+TEMPLATE_GRAPH_FILENAME = 'jinjagen_template_deps.json'
+TEMPLATE_GRAPH_VERSION = 1
+
+
+def template_source(template_env: Environment, template_name: str) -> str:
+    assert template_env.loader is not None
+    source, _, _ = template_env.loader.get_source(template_env, template_name)
+    return source
+
+
+@dataclass
+class TemplateDependencyGraph:
+    """Which templates each template extends, includes or imports
+    (``{% from ... import %}`` too), as resolved through the env's loader,
+    plus a digest of every template's source and each run's template.
+
+    Templates with a dynamic reference such as ``{% include var %}``, or
+    whose source the loader does not give, are in *dynamic* and count as
+    depending on every template.
+    """
+    edges: Dict[str, List[str]] = field(default_factory=dict)
+    digests: Dict[str, str] = field(default_factory=dict)
+    dynamic: Set[str] = field(default_factory=set)
+    missing: Set[str] = field(default_factory=set)
+    run_templates: Dict[str, str] = field(default_factory=dict)
+
+    @classmethod
+    def build(cls, template_env: Environment, run_defs: Iterable[FileGenRunDef]) -> TemplateDependencyGraph:
+        """Parse every template reachable from the runs once."""
+        graph: TemplateDependencyGraph = cls()
+        stack: List[str] = []
+        for run_def in run_defs:
+            graph.run_templates[run_def.name] = run_def.template_filepath
+            stack.append(run_def.template_filepath)
+        while stack:
+            name: str = stack.pop()
+            if name in graph.edges or name in graph.missing:
+                continue
+            try:
+                source: str = template_source(template_env, name)
+            except TemplateNotFound:
+                graph.missing.add(name)
+                continue
+            except RuntimeError:
+                # loaders without source access, e.g. ModuleLoader
+                graph.dynamic.add(name)
+                graph.edges[name] = []
+                continue
+            graph.digests[name] = hashlib.sha256(source.encode('utf-8')).hexdigest()
+            refs: List[str] = []
+            for ref in meta.find_referenced_templates(template_env.parse(source)):
+                if ref is None:
+                    graph.dynamic.add(name)
+                elif ref not in refs:
+                    refs.append(ref)
+            graph.edges[name] = sorted(refs)
+            stack.extend(refs)
+        return graph
+
+    def _reachable(self, template_name: str) -> Set[str]:
+        seen: Set[str] = set()
+        stack: List[str] = [template_name]
+        while stack:
+            name: str = stack.pop()
+            if name in seen:
+                continue
+            seen.add(name)
+            stack.extend(self.edges.get(name, ()))
+        return seen
+
+    def dependencies(self, template_name: str, include_missing: bool = False) -> List[str]:
+        """*template_name* and every template it pulls in, transitively,
+        or every template in the graph when one of them is dynamic.
+        Templates the loader could not find, e.g. of an
+        ``{% include ... ignore missing %}``, only with *include_missing*.
+        """
+        seen: Set[str] = self._reachable(template_name)
+        if not self.dynamic.isdisjoint(seen):
+            seen |= set(self.edges) | self.missing
+        return sorted(seen if include_missing else seen - self.missing)
+
+    def is_dynamic(self, template_name: str) -> bool:
+        """Whether *template_name* pulls in templates the graph cannot
+        name, so that not even ``dependencies`` covers all of them.
+        """
+        return not self.dynamic.isdisjoint(self._reachable(template_name))
+
+    def dependents(self, changed: Iterable[str]) -> Set[str]:
+        """Templates whose output may change when *changed* templates do."""
+        reverse: Dict[str, Set[str]] = {}
+        for name, refs in self.edges.items():
+            for ref in refs:
+                reverse.setdefault(ref, set()).add(name)
+        affected: Set[str] = set()
+        stack: List[str] = list(changed)
+        if stack:
+            stack.extend(self.dynamic)
+        while stack:
+            name: str = stack.pop()
+            if name in affected:
+                continue
+            affected.add(name)
+            stack.extend(reverse.get(name, ()))
+        return affected
+
+    def affected_runs(self, changed: Iterable[str]) -> Set[str]:
+        affected: Set[str] = self.dependents(changed)
+        return {run_name for run_name, template_name in self.run_templates.items()
+                if template_name in affected}
+
+    def changed_since(self, previous: Optional[TemplateDependencyGraph]) -> Set[str]:
+        """Templates added, edited or removed since *previous* was built."""
+        if previous is None:
+            return set(self.digests)
+        names: Set[str] = set(self.digests) | set(previous.digests)
+        return {name for name in names if self.digests.get(name) != previous.digests.get(name)}
+
+    def affected_entries(self,
+        entries: Iterable[Tuple[FileGenNode, FileGenRunEntry]],
+        changed: Iterable[str]) -> List[Tuple[FileGenNode, FileGenRunEntry]]:
+        """Of *entries* (e.g. ``gen_tree_run_entries(gen_roots)``), those
+        of runs *changed* affects, and so the output files to regenerate.
+        """
+        runs: Set[str] = self.affected_runs(changed)
+        return [(gen_node, run_entry) for gen_node, run_entry in entries
+                if run_entry.run_data.run_def.name in runs]
+
+    @classmethod
+    def load(cls, path: Path) -> Optional[TemplateDependencyGraph]:
+        try:
+            data: Dict[str, Any] = json.loads(path.read_text())
+            if data.get('version') != TEMPLATE_GRAPH_VERSION:
+                return None
+            return cls(data['edges'], data['digests'], set(data['dynamic']), set(data['missing']),
+                       data['run_templates'])
+        except FileNotFoundError:
+            return None
+        except (ValueError, KeyError):
+            logger.warning('jinjagen: ignoring unreadable template graph %s', path)
+            return None
+
+    def save(self, path: Path) -> None:
+        path.parent.mkdir(exist_ok=True, parents=True)
+        path.write_text(json.dumps({
+            'version': TEMPLATE_GRAPH_VERSION,
+            'edges': self.edges,
+            'digests': self.digests,
+            'dynamic': sorted(self.dynamic),
+            'missing': sorted(self.missing),
+            'run_templates': self.run_templates,
+        }, sort_keys=True))
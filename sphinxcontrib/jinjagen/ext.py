@@ -17,6 +17,8 @@ from docutils.nodes import Element, Node, TextElement, system_message
 
 
 from sphinx import addnodes
+from sphinx.addnodes import pending_xref
+from sphinx.builders import Builder
 from sphinx.directives import ObjectDescription
 from sphinx.domains import Domain, Index
 from sphinx.environment import BuildEnvironment
@@ -29,6 +31,7 @@ from sphinx.application import Sphinx
 from sphinx.util.logging import getLogger
 from sphinx.jinja2glue import BuiltinTemplateLoader
 
+from .filegen2 import FileGenNode, FileGenRoots, FileGenRunEntry, gen_tree_run_entries
 
 
 # Jinja directive, point to file by key?
@@ -48,17 +51,23 @@ class JinjagenGenDocRefRole(XRefRole):
         reference node and must return a new (or the same) ``(title, target)``
         tuple.
         """
-        #self.env.gentree
-        # target split on .
-        # look up keys in gen tree
-        # get absolute filepath of gentree
-        # return title, ws_re.sub(' ', filepath)
+        # target is [run_name:]dotted.key.path, resolved by JinjagenDomain.resolve_xref
         # ws_re is white space regex, replaces whitespace with ' '
-
         return title, ws_re.sub(' ', target)
 
 
 
+def lookup_genref(genrefs: Dict[str, Dict[str, str]], target: str) -> Optional[str]:
+    """Docname for ``run_name:dotted.key.path``, or ``dotted.key.path``
+    when exactly one run generated that key path.
+    """
+    run_name, sep, keypath = target.partition(':')
+    if sep:
+        return genrefs.get(run_name, {}).get(keypath)
+    found: List[str] = [refs[target] for refs in genrefs.values() if target in refs]
+    return found[0] if len(found) == 1 else None
+
+
 # XRefRole child class which helps do Key1.Key2.
 
 # how xrefrole and :doc: work 
@@ -68,11 +77,85 @@ class JinjagenDomain(Domain):
 
     name = 'jinja'
     label = 'jinjagen'
+    data_version = 1
     roles = {
-        'genref': XRefRole() # reference to generated document
+        'genref': JinjagenGenDocRefRole(warn_dangling=True) # reference to generated document
+    }
+    initial_data: Dict[str, Any] = {
+        'genrefs': {}, # run name -> dotted key path -> docname
+        'genref_targets': {}, # docname -> genref targets it uses
+        'generated_docs': set(), # docnames generated by this build
+        'changed_docs': set(), # of those, the ones whose file was rewritten
+        'relinked_docs': set(), # docnames whose genrefs resolve differently than before
     }
 
-
-
-    
-
+    @property
+    def genrefs(self) -> Dict[str, Dict[str, str]]:
+        return self.data.setdefault('genrefs', {})
+
+    @property
+    def genref_targets(self) -> Dict[str, List[str]]:
+        return self.data.setdefault('genref_targets', {})
+
+    def index_gen_roots(self,
+                        gen_roots: FileGenRoots,
+                        src_dir: str,
+                        entry_filter: Optional[Callable[[FileGenNode, FileGenRunEntry], bool]] = None) -> None:
+        """Replace the genref index with the entries of *gen_roots* passing
+        *entry_filter*. The tree's own ``entry_filter`` is ignored, so a shard
+        indexes the entries other shards render too.
+        """
+        self.data['genrefs'] = {}
+        for gen_node, run_entry in gen_tree_run_entries(gen_roots, all_entries=True):
+            if entry_filter is None or entry_filter(gen_node, run_entry):
+                self.add_genref(gen_node, run_entry, src_dir)
+
+    def add_genref(self, gen_node: FileGenNode, run_entry: FileGenRunEntry, src_dir: str) -> None:
+        docname: Optional[str] = run_entry.docname(src_dir)
+        if docname is not None:
+            self.genrefs.setdefault(run_entry.run_data.run_def.name, {})['.'.join(gen_node.keypath)] = docname
+
+    def lookup_genref(self, target: str) -> Optional[str]:
+        return lookup_genref(self.genrefs, target)
+
+    def process_doc(self, env: BuildEnvironment, docname: str, document: Any) -> None:
+        targets: List[str] = sorted({node['reftarget'] for node in document.findall(pending_xref)
+                                     if node.get('refdomain') == self.name})
+        if targets:
+            self.genref_targets[docname] = targets
+
+    def clear_doc(self, docname: str) -> None:
+        # the genref index is rebuilt from the generation tree on every builder-inited
+        self.genref_targets.pop(docname, None)
+
+    def merge_domaindata(self, docnames: List[str], otherdata: Dict[str, Any]) -> None:
+        for run_name, refs in otherdata.get('genrefs', {}).items():
+            self.genrefs.setdefault(run_name, {}).update(refs)
+        for docname in docnames:
+            if docname in otherdata.get('genref_targets', {}):
+                self.genref_targets[docname] = otherdata['genref_targets'][docname]
+
+    def resolve_xref(self,
+                     env: BuildEnvironment,
+                     fromdocname: str,
+                     builder: Builder,
+                     typ: str,
+                     target: str,
+                     node: pending_xref,
+                     contnode: Element) -> Optional[Element]:
+        docname: Optional[str] = self.lookup_genref(target)
+        # outputs without a source suffix are generated but are not documents
+        if docname is None or docname not in env.found_docs:
+            return None
+        return make_refnode(builder, fromdocname, docname, None, contnode, target)
+
+    def resolve_any_xref(self,
+                         env: BuildEnvironment,
+                         fromdocname: str,
+                         builder: Builder,
+                         target: str,
+                         node: pending_xref,
+                         contnode: Element) -> List[Tuple[str, Element]]:
+        refnode: Optional[Element] = self.resolve_xref(
+            env, fromdocname, builder, 'genref', target, node, contnode)
+        return [('jinja:genref', refnode)] if refnode is not None else []
@@ -1,26 +1,46 @@
 from __future__ import annotations
-from typing import NewType, Protocol, Callable, TypeVar, Generic, Mapping, Any, List, Dict, Tuple, Optional, Iterable, Sequence, Generator, Iterator
+from typing import Callable, Any, List, Dict, Tuple, Optional, Iterable, Sequence, Iterator, Set, Union
 from typing import ForwardRef
 from typing import cast
 
 from collections import deque
 from pathlib import Path
+from functools import lru_cache
+import hashlib
+import os
+import time
 from enum import Enum
 
-from dataclasses import dataclass
+from dataclasses import dataclass, field
 
-from jinja2 import Template
+from jinja2 import Template, Environment
 from jinja2.sandbox import SandboxedEnvironment
 # from sphinx.application import Sphinx
 # from sphinx.util.osutil import ensuredir
 from sphinx.util.logging import getLogger
 from sphinx.jinja2glue import BuiltinTemplateLoader
 from .util import JinjaEnvFactory
-
+from .cache import FileGenCache, fingerprint
+from .deps import TemplateDependencyGraph
+from .shard import GenShard
+from .sources import KeyPathSource
+from .stats import FileGenWriteStats, GenReport
+
+from .context import GenContexts
+from .navigation import GenNavigation, build_navigation
 from .node import StrKeyNodeBase, StrKeyNodeBaseP, StrKeyRootNodes, NodeFactory, LookupElseCreateNode
 
 logger = getLogger(__name__)
 
+# buffer for streamed renders, written out as the template generates chunks
+STREAM_BUFFER_SIZE = 1 << 20
+
+
+@lru_cache(maxsize=None)
+def base_path(base_dir: str) -> Path:
+    return Path(base_dir)
+
+
 #TODO make generic tree, lookup keys in one in other
 @dataclass
 class GenKeyNode(StrKeyNodeBase):
@@ -43,6 +63,19 @@ class GenKeyRoots(StrKeyRootNodes[GenKeyNode]):
     pass
 
 
+def gen_key_roots_from_keypaths(keypaths: Iterable[Sequence[str]]) -> GenKeyRoots:
+    key_roots: GenKeyRoots = GenKeyRoots({})
+    for keypath in keypaths:
+        siblings: Dict[str, GenKeyNode] = key_roots.roots
+        for key in keypath:
+            node: Optional[GenKeyNode] = siblings.get(key)
+            if node is None:
+                node = GenKeyNode(key, {})
+                siblings[key] = node
+            siblings = node.children
+    return key_roots
+
+
 
 class FileGenRunNameOption(Enum):
     ALL_KEYS_DIRS = 1,
@@ -52,17 +85,19 @@ class FileGenRunNameOption(Enum):
 
 @dataclass
 class FileGenRunDef:
-    gen_key_roots: GenKeyRoots
+    gen_key_roots: Union[GenKeyRoots, KeyPathSource]
     name: str
     template_filepath: str
     suffix: str
     name_option: FileGenRunNameOption
     base_dir_override: Optional[str]
+    trusted: bool = False # render unsandboxed from a precompiled bundle when enabled
+    streaming: bool = False # write chunks from Template.generate instead of one rendered string
 
     def entry_filepath_from_key_path(self, 
         has_siblings: bool, 
         base_dir: str, 
-        from_root_keypath: List[str]) -> Path:
+        from_root_keypath: Sequence[str]) -> Path:
         # return Path(base_dir, *from_root_keypath, f'{self.name}.{self.suffix}')
         dirs_to_use: Iterable[str]
         filename_to_use: str
@@ -79,19 +114,104 @@ class FileGenRunDef:
         base_dir_to_use = self.base_dir_override or base_dir
         return Path(base_dir_to_use, *dirs_to_use, filename_to_use)
 
+    def entry_filepath_from_key_dir(self,
+        has_siblings: bool,
+        base_dir: str,
+        key_dir: str) -> Path:
+        # same as entry_filepath_from_key_path, from a node's precomputed key_dir
+        dir_to_use: str
+        filename_to_use: str
+        if key_dir \
+            and (self.name_option == FileGenRunNameOption.ALWAYS_PREPEND_LAST_KEY \
+                or (self.name_option == FileGenRunNameOption.PREPEND_LAST_KEY_FOR_SINGLE_ENTRY \
+                    and not has_siblings)):
+            dir_to_use, _, last_key = key_dir.rpartition('/')
+            filename_to_use = f'{last_key}_{self.name}'
+        else:
+            dir_to_use = key_dir
+            filename_to_use = self.name
 
-    def create_run_data(self, template_env: SandboxedEnvironment) -> FileGenRunData:
+        return base_path(self.base_dir_override or base_dir).joinpath(dir_to_use, filename_to_use)
+
+    def fingerprint_parts(self) -> List[str]:
+        return [self.name,
+            self.template_filepath,
+            self.suffix,
+            self.name_option.name,
+            self.base_dir_override or '']
+
+    def keypaths(self) -> Iterator[Tuple[str, ...]]:
+        """Leaf key paths of the run, in key tree order."""
+        if isinstance(self.gen_key_roots, KeyPathSource):
+            yield from self.gen_key_roots
+            return
+        stack: List[Tuple[Tuple[str, ...], GenKeyNode]] = [
+            ((key,), node) for key, node in reversed(list(self.gen_key_roots.roots.items()))]
+        while stack:
+            keypath, node = stack.pop()
+            if not node.children:
+                yield keypath
+            stack.extend(((*keypath, key), child) for key, child in reversed(list(node.children.items())))
+
+    def key_roots(self) -> GenKeyRoots:
+        """The run's key tree, built in memory when the run has a key path source."""
+        if isinstance(self.gen_key_roots, KeyPathSource):
+            return gen_key_roots_from_keypaths(self.gen_key_roots)
+        return self.gen_key_roots
+
+    def create_run_data(self, template_env: Environment) -> FileGenRunData:
         return FileGenRunData(self, template_env.get_template(self.template_filepath))
 
 
 
+def gen_tree_fingerprint(run_defs: Iterable[FileGenRunDef]) -> str:
+    """Fingerprint of every run's definition and key paths, which make up
+    the generation tree: its nodes, their entries and output paths.
+    Templates can read any node through ``gen_roots`` and their neighbours
+    through ``gen_nav``, so each entry depends on the whole tree.
+    """
+    return fingerprint(part
+                       for run_def in run_defs
+                       for part in (*run_def.fingerprint_parts(),
+                                    *('\x1f'.join(keypath) for keypath in run_def.keypaths())))
+
+
 @dataclass
 class FileGenRunData:
     run_def: FileGenRunDef
     template: Template
 
 @dataclass
-class FileGenNode(StrKeyNodeBaseP):
+class CachedKeyPathNode:
+    """Keeps a node's key path and key directory, each computed once from
+    its parent's when the node is created. Requires ``key`` and ``parent``.
+    """
+    _keypath: Tuple[str, ...] = field(init=False, repr=False, compare=False)
+    _key_dir: str = field(init=False, repr=False, compare=False)
+
+    def __post_init__(self) -> None:
+        parent = self.parent # type: ignore
+        if parent is None:
+            self._keypath = (self.key,) # type: ignore
+            self._key_dir = self.key # type: ignore
+        else:
+            self._keypath = (*parent.keypath, self.key) # type: ignore
+            self._key_dir = f'{parent.key_dir}/{self.key}' # type: ignore
+
+    @property
+    def keypath(self) -> Tuple[str, ...]: return self._keypath
+
+    @property
+    def key_dir(self) -> str:
+        """Key path as a relative directory, e.g. ``gen/recipe_youtube``."""
+        return self._key_dir
+
+    def from_root_keypath(self, include_self: bool) -> Iterator[str]:
+        return iter(self._keypath if include_self else self._keypath[:-1])
+
+
+@dataclass
+class FileGenNode(CachedKeyPathNode, StrKeyNodeBaseP):
     _key: str
     _parent: Optional[FileGenNode]
     _children: Dict[str, FileGenNode]
@@ -112,7 +232,11 @@ class FileGenNode(StrKeyNodeBaseP):
 
 @dataclass
 class FileGenRoots(StrKeyRootNodes[FileGenNode]):
-    pass
+    navigation: Optional[GenNavigation] = field(default=None, repr=False, compare=False)
+    contexts: Optional[GenContexts] = field(default=None, repr=False, compare=False)
+    # entries to render in this build, e.g. one shard's; None renders all
+    entry_filter: Optional[Callable[[FileGenNode, FileGenRunEntry], bool]] = \
+        field(default=None, repr=False, compare=False)
 
 # take out of tree, just needed for context, should be generated by Node and Run, for each key
 @dataclass
@@ -122,6 +246,15 @@ class FileGenRunEntry:
     run_data: FileGenRunData # same for all entries under same name
     filepath: Path # can be calculated, run output_dir + parent parent parent to root, combine gen_keys
 
+    def docname(self, src_dir: str) -> Optional[str]:
+        """Sphinx docname of the output, None when it is written outside *src_dir*."""
+        try:
+            docname: str = self.filepath.relative_to(src_dir).as_posix()
+        except ValueError:
+            return None
+        suffix: str = f'.{self.run_data.run_def.suffix}'
+        return docname[:-len(suffix)] if docname.endswith(suffix) else docname
+
 
 # def create_file_gen_run_entry(src_dir: str,
 #                               run: FileGenRunDef, 
@@ -131,7 +264,7 @@ class FileGenRunEntry:
 
 
 @dataclass
-class FileGenBuilderNode(StrKeyNodeBaseP):
+class FileGenBuilderNode(CachedKeyPathNode, StrKeyNodeBaseP):
     _key: str
     _parent: Optional[FileGenBuilderNode]
     _children: Dict[str, FileGenBuilderNode]
@@ -157,9 +290,9 @@ class FileGenBuilderNode(StrKeyNodeBaseP):
             fgre: FileGenRunEntry = FileGenRunEntry(
                 gen_key=self.key, 
                 run_data=r, 
-                filepath=r.run_def.entry_filepath_from_key_path(has_siblings, 
+                filepath=r.run_def.entry_filepath_from_key_dir(has_siblings, 
                     base_dir, 
-                    list(self.from_root_keypath(include_self=True))))
+                    self.key_dir))
             rs[r.run_def.name] = fgre
         return rs
         #lookup_file_node.run_entry_by_name[run_def.name] = FileGenRunEntry(
@@ -190,10 +323,15 @@ class FileContext:
     gen_run_entry: FileGenRunEntry # dont need name, on FileGenEntry
 
     def get_render_kwargs(self) -> Dict[str, Any]:
+        navigation: Optional[GenNavigation] = self.gen_roots.navigation
+        contexts: Optional[GenContexts] = self.gen_roots.contexts
         return {
             'gen_node': self.gen_node
             , 'gen_roots': self.gen_roots
             , 'gen_run_entry': self.gen_run_entry
+            , 'gen_nav': navigation.for_node(self.gen_node) if navigation is not None else None
+            , 'gen_ctx': contexts.for_entry(self.gen_node, self.gen_run_entry.run_data.run_def.name) \
+                if contexts is not None else None
         }
 
     def render(self) -> str:
@@ -220,7 +358,7 @@ def update_gen_builder_tree(
     node_factory: FileGenBuilderNodeFactory = FileGenBuilderNodeFactory()
     q: deque[GenBuilderTreeElt] = \
         deque(GenBuilderTreeElt(root_key_node, gen_roots.lookup_else_create_node(root_key_node.key, node_factory)) \
-            for root_key_node in run_data.run_def.gen_key_roots.roots.values())
+            for root_key_node in run_data.run_def.key_roots().roots.values())
 
     while q:
         elt: GenBuilderTreeElt = q.pop()
@@ -246,7 +384,7 @@ def update_gen_builder_tree_old(
 
     run_def: FileGenRunDef = run_data.run_def
     q: deque[UpdateGenBuilderTreeElt] = deque(UpdateGenBuilderTreeElt(
-        gen_roots, key_node) for key_node in run_def.gen_key_roots.roots.values())
+        gen_roots, key_node) for key_node in run_def.key_roots().roots.values())
 
     while q:
         elt: UpdateGenBuilderTreeElt = q.pop()
@@ -304,52 +442,303 @@ def gen_tree_from_runs(base_dir: str, runs: List[FileGenRunData]) -> FileGenRoot
     return build_tree(gen_builder_roots, base_dir) 
 
 
-def render_and_write_gen_node(
-    gen_roots: FileGenRoots,
-    gen_node: FileGenNode) -> None:
-    for name, run_entry in gen_node.run_entry_by_name.items():
+def content_digest(content: bytes) -> str:
+    return hashlib.sha256(content).hexdigest()
+
 
-        # gen_node.children_by_gen_key
+def write_if_changed(filepath: Path, content: str) -> bool:
+    """Write *content* to *filepath* unless the file on disk already holds
+    the same bytes, so unchanged outputs keep their mtime.
+    Returns whether the file was written.
+    """
+    return write_bytes_if_changed(filepath, content.encode('utf-8'))
 
-        # try:
-        name_ctxt = FileContext(gen_node, gen_roots, run_entry)
 
+def temp_filepath(filepath: Path) -> Path:
+    return filepath.with_name(f'.{filepath.name}.jinjagen-tmp')
+
+
+def write_bytes_if_changed(filepath: Path,
+    encoded: bytes,
+    make_parents: bool = True,
+    atomic: bool = False) -> bool:
+    """``write_if_changed`` for encoded content. Without *make_parents* the
+    directory must already exist; *atomic* writes a temporary file and
+    renames it over *filepath*, so readers never see a partial file.
+    """
+    try:
+        existing: Optional[bytes] = filepath.read_bytes()
+    except (FileNotFoundError, IsADirectoryError):
+        existing = None
+
+    if existing is not None \
+        and len(existing) == len(encoded) \
+        and content_digest(existing) == content_digest(encoded):
+        return False
+
+    if make_parents:
+        filepath.parent.mkdir(exist_ok=True, parents=True)
+    if atomic:
+        tmp_filepath: Path = temp_filepath(filepath)
         try:
-            run_entry.filepath.parent.mkdir(exist_ok=True, parents=True)
-            run_entry.filepath.write_text(name_ctxt.render())
-        except Exception as ex:
-            logger.error('wtf')
-            raise ex
-        # except Exception as ex:
-        #   logger.error( 'Error %s'.format(format_exception(Exception, ex)))
+            tmp_filepath.write_bytes(encoded)
+            os.replace(tmp_filepath, filepath)
+        except BaseException:
+            tmp_filepath.unlink(missing_ok=True)
+            raise
+    else:
+        filepath.write_bytes(encoded)
+    return True
+
+
+def file_digest(filepath: Path) -> Optional[str]:
+    digest = hashlib.sha256()
+    try:
+        with open(filepath, 'rb') as f:
+            for block in iter(lambda: f.read(STREAM_BUFFER_SIZE), b''):
+                digest.update(block)
+    except (FileNotFoundError, IsADirectoryError):
+        return None
+    return digest.hexdigest()
+
+
+def write_chunks_if_changed(filepath: Path,
+    chunks: Iterable[str],
+    make_parents: bool = True) -> Tuple[bool, int]:
+    """Streaming ``write_if_changed``: encode and write *chunks* to a
+    temporary file next to *filepath*, then move it into place unless the
+    existing file holds the same bytes. The page is never held in memory.
+    Returns whether the file was written and its size.
+    """
+    if make_parents:
+        filepath.parent.mkdir(exist_ok=True, parents=True)
+    tmp_filepath: Path = temp_filepath(filepath)
+    digest = hashlib.sha256()
+    nbytes: int = 0
+    try:
+        with open(tmp_filepath, 'wb', buffering=STREAM_BUFFER_SIZE) as f:
+            for chunk in chunks:
+                encoded: bytes = chunk.encode('utf-8')
+                digest.update(encoded)
+                nbytes += f.write(encoded)
+        if filepath.is_file() \
+            and filepath.stat().st_size == nbytes \
+            and file_digest(filepath) == digest.hexdigest():
+            tmp_filepath.unlink()
+            return False, nbytes
+        os.replace(tmp_filepath, filepath)
+    except BaseException:
+        tmp_filepath.unlink(missing_ok=True)
+        raise
+    return True, nbytes
+
+
+def render_to_file(render_kwargs: Dict[str, Any],
+    template: Template,
+    filepath: Path,
+    streaming: bool = False,
+    make_parents: bool = True) -> Tuple[bool, int, float, float]:
+    """Render *template* with *render_kwargs* into *filepath*.
+    Returns (written, bytes, render seconds, write seconds); streamed
+    renders interleave both, so all their time counts as render time.
+    """
+    render_start: float = time.perf_counter()
+    if streaming:
+        written, nbytes = write_chunks_if_changed(filepath,
+            template.generate(render_kwargs),
+            make_parents)
+        return written, nbytes, time.perf_counter() - render_start, 0.0
+    encoded: bytes = template.render(render_kwargs).encode('utf-8')
+    write_start: float = time.perf_counter()
+    written = write_bytes_if_changed(filepath, encoded, make_parents)
+    return written, len(encoded), write_start - render_start, time.perf_counter() - write_start
+
+
+def render_and_write_run_entry(
+    gen_roots: FileGenRoots,
+    gen_node: FileGenNode,
+    name: str,
+    run_entry: FileGenRunEntry,
+    stats: FileGenWriteStats,
+    cache: Optional[FileGenCache] = None) -> None:
+    entry_fingerprint: Optional[str] = None
+    if cache is not None:
+        entry_fingerprint = cache.entry_fingerprint(
+            name, gen_node.from_root_keypath(include_self=True))
+        if cache.is_fresh(run_entry.filepath, entry_fingerprint):
+            cache.record(run_entry.filepath, entry_fingerprint)
+            stats.cached += 1
+            return
+
+    # try:
+    name_ctxt = FileContext(gen_node, gen_roots, run_entry)
+
+    try:
+        written, nbytes, render_seconds, write_seconds = render_to_file(name_ctxt.get_render_kwargs(),
+            run_entry.run_data.template,
+            run_entry.filepath,
+            run_entry.run_data.run_def.streaming)
+        stats.record(written, nbytes, str(run_entry.filepath))
+        stats.record_timing(name,
+            run_entry.run_data.run_def.template_filepath,
+            str(run_entry.filepath),
+            render_seconds,
+            write_seconds)
+        if cache is not None and entry_fingerprint is not None:
+            cache.record(run_entry.filepath, entry_fingerprint)
+    except Exception as ex:
+        logger.error('wtf')
+        raise ex
+    # except Exception as ex:
+    #   logger.error( 'Error %s'.format(format_exception(Exception, ex)))
+
+
+def render_and_write_gen_node(
+    gen_roots: FileGenRoots,
+    gen_node: FileGenNode,
+    stats: Optional[FileGenWriteStats] = None,
+    cache: Optional[FileGenCache] = None) -> FileGenWriteStats:
+    stats = stats if stats is not None else FileGenWriteStats()
+    for name, run_entry in gen_node.run_entry_by_name.items():
+        if gen_roots.entry_filter is not None and not gen_roots.entry_filter(gen_node, run_entry):
+            continue
+        render_and_write_run_entry(gen_roots, gen_node, name, run_entry, stats, cache)
+    return stats
+
+
+def gen_tree_run_entries(gen_roots: FileGenRoots,
+    all_entries: bool = False) -> List[Tuple[FileGenNode, FileGenRunEntry]]:
+    """All run entries passing ``entry_filter``, or all of the tree's with
+    *all_entries*, in the order render_and_write_gen_tree renders them.
+    """
+    entries: List[Tuple[FileGenNode, FileGenRunEntry]] = []
+    entry_filter = None if all_entries else gen_roots.entry_filter
+    q: deque[FileGenNode] = deque(gen_roots.roots.values())
+    while q:
+        elmt = q.pop()
+        entries.extend((elmt, run_entry) for run_entry in elmt.run_entry_by_name.values()
+                       if entry_filter is None or entry_filter(elmt, run_entry))
+        for elmt_child in elmt.children.values():
+            q.appendleft(elmt_child)
+    return entries
 
 
-def render_and_write_gen_tree(gen_roots: FileGenRoots) -> None:
+def render_and_write_gen_tree(gen_roots: FileGenRoots,
+    cache: Optional[FileGenCache] = None) -> FileGenWriteStats:
+    stats: FileGenWriteStats = FileGenWriteStats()
     q: deque[FileGenNode] = deque(gen_roots.roots.values())
 
     # bfs
     while q:
         elmt = q.pop()
-        render_and_write_gen_node(gen_roots, elmt)
+        render_and_write_gen_node(gen_roots, elmt, stats, cache)
 
         for elmt_child in elmt.children.values():
             q.appendleft(elmt_child)
 
+    return stats
+
+
+RenderGenTree = Callable[[FileGenRoots, Optional[FileGenCache]], FileGenWriteStats]
+BuildGenTree = Callable[[str, List[FileGenRunData]], FileGenRoots]
+
+
+def add_runs_to_cache(cache: FileGenCache,
+    run_defs: List[FileGenRunDef],
+    contexts: Optional[GenContexts] = None,
+    tree: Optional[str] = None) -> None:
+    """Fingerprint each run for *cache*, whose template graph is set.
+    *tree* saves reading the key paths again when the caller has their
+    fingerprint already.
+    """
+    tree = tree if tree is not None else gen_tree_fingerprint(run_defs)
+    for run_def in run_defs:
+        context_versions: Optional[str] = contexts.fingerprint(run_def.name) if contexts is not None else ''
+        cache.add_run(run_def.name,
+            run_def.template_filepath,
+            [*run_def.fingerprint_parts(), tree, context_versions or ''],
+            volatile=context_versions is None)
+
+
+def prepare_cache(cache: FileGenCache,
+    template_env: SandboxedEnvironment,
+    run_defs: List[FileGenRunDef],
+    report: GenReport,
+    contexts: Optional[GenContexts] = None,
+    tree: Optional[str] = None) -> None:
+    with report.phase('template graph'):
+        cache.template_graph = TemplateDependencyGraph.build(template_env, run_defs)
+        if cache.previous_template_graph is not None:
+            changed: Set[str] = cache.changed_templates()
+            if changed:
+                logger.info('jinjagen: changed templates %s affect runs %s',
+                    ', '.join(sorted(changed)), ', '.join(sorted(cache.affected_runs())) or 'none')
+    with report.phase('fingerprint'):
+        add_runs_to_cache(cache, run_defs, contexts, tree)
+
+
+def load_runs(template_env: SandboxedEnvironment,
+    run_defs: List[FileGenRunDef],
+    cache: Optional[FileGenCache],
+    trusted_env: Optional[Environment],
+    report: GenReport,
+    contexts: Optional[GenContexts] = None) -> List[FileGenRunData]:
+    # fetch run templates
+    with report.phase('load templates'):
+        runs: List[FileGenRunData] = [
+            run_def.create_run_data(trusted_env if run_def.trusted and trusted_env else template_env)
+            for run_def in run_defs]
+
+    if cache is not None:
+        prepare_cache(cache, template_env, run_defs, report, contexts)
+    return runs
+
+
+def finish_gen(stats: FileGenWriteStats,
+    cache: Optional[FileGenCache],
+    report: GenReport) -> None:
+    report.write_stats = stats
+    logger.info('jinjagen: %d files written, %d unchanged, %d up to date, %d in memory',
+        stats.written, stats.skipped, stats.cached, stats.virtual)
+
+    if cache is not None:
+        with report.phase('save manifest'):
+            cache.save()
+
 
 def gen_from_run_defs(template_env: SandboxedEnvironment,
     run_defs: List[FileGenRunDef],
-    src_dir: str) -> FileGenRoots:
+    src_dir: str,
+    cache: Optional[FileGenCache] = None,
+    render_tree: RenderGenTree = render_and_write_gen_tree,
+    trusted_env: Optional[Environment] = None,
+    build_gen_tree: BuildGenTree = gen_tree_from_runs,
+    report: Optional[GenReport] = None,
+    navigation: bool = False,
+    contexts: Optional[GenContexts] = None,
+    shard: Optional[GenShard] = None,
+    entry_filter: Optional[Callable[[FileGenNode, FileGenRunEntry], bool]] = None) -> FileGenRoots:
     #get_template_env(app)
-
-    # fetch run templates
-    runs: List[FileGenRunData] = [run_def.create_run_data(template_env) for run_def in run_defs]
+    report = report if report is not None else GenReport()
+    runs: List[FileGenRunData] = load_runs(template_env, run_defs, cache, trusted_env, report, contexts)
 
     # gen tree with output filepaths
     # assert app.env is not None
-    gen_roots: FileGenRoots = gen_tree_from_runs(src_dir, runs)
+    with report.phase('build tree'):
+        gen_roots: FileGenRoots = build_gen_tree(src_dir, runs)
+    gen_roots.contexts = contexts
+    gen_roots.entry_filter = entry_filter
+    if shard is not None:
+        with report.phase('shard'):
+            shard.apply(gen_roots, cache)
+    if navigation:
+        with report.phase('navigation'):
+            gen_roots.navigation = build_navigation(gen_roots, src_dir)
 
     # str(app.env.srcdir)
 
     # render and write
-    render_and_write_gen_tree(gen_roots)
-    return gen_roots
\ No newline at end of file
+    with report.phase('render and write'):
+        stats: FileGenWriteStats = render_tree(gen_roots, cache)
+    finish_gen(stats, cache, report)
+    return gen_roots
@@ -0,0 +1,72 @@
+from __future__ import annotations
+from typing import Any, Callable, Hashable, List, Optional, Tuple
+
+from collections import OrderedDict
+
+from jinja2 import nodes
+from jinja2.environment import Environment
+from jinja2.exceptions import TemplateSyntaxError
+from jinja2.ext import Extension
+from jinja2.parser import Parser
+from jinja2.runtime import Context
+
+DEFAULT_FRAGMENT_CACHE_SIZE = 1024
+FRAGMENT_SCOPES = ('run', 'node', 'global')
+
+
+class FragmentCacheExtension(Extension):
+    """``{% cache key %}...{% endcache %}`` renders its body once and reuses
+    the output for later entries. The key is combined with a scope,
+    ``{% cache key, "node" %}``: ``run`` (default) shares the fragment
+    between entries of the same run, ``node`` between the runs' entries
+    of one node and ``global`` between all entries. The cache lives on the
+    environment, so fragments are reused within one build, and keeps the
+    ``fragment_cache_size`` most recently used fragments.
+    """
+    tags = {'cache'}
+
+    def __init__(self, environment: Environment) -> None:
+        super().__init__(environment)
+        environment.extend(
+            fragment_cache_size=DEFAULT_FRAGMENT_CACHE_SIZE,
+            fragment_cache=OrderedDict(),
+            fragment_cache_hits=0)
+
+    def parse(self, parser: Parser) -> nodes.Node:
+        lineno: int = next(parser.stream).lineno
+        args: List[nodes.Expr] = [nodes.ContextReference(), parser.parse_expression()]
+        if parser.stream.skip_if('comma'):
+            scope: nodes.Expr = parser.parse_expression()
+            if isinstance(scope, nodes.Const) and scope.value not in FRAGMENT_SCOPES:
+                raise TemplateSyntaxError(
+                    f'cache scope must be one of {", ".join(FRAGMENT_SCOPES)}', lineno, parser.name, parser.filename)
+            args.append(scope)
+        else:
+            args.append(nodes.Const('run'))
+        body: List[nodes.Node] = parser.parse_statements(('name:endcache',), drop_needle=True)
+        return nodes.CallBlock(self.call_method('_cached_fragment', args), [], [], body).set_lineno(lineno)
+
+    def _cached_fragment(self, context: Context, key: Hashable, scope: str, caller: Callable[[], str]) -> str:
+        scope_key: Optional[Hashable] = None
+        if scope == 'run':
+            run_entry: Any = context.get('gen_run_entry')
+            scope_key = run_entry.run_data.run_def.name if run_entry is not None else None
+        elif scope == 'node':
+            gen_node: Any = context.get('gen_node')
+            scope_key = tuple(gen_node.keypath) if gen_node is not None else None
+        elif scope != 'global':
+            raise ValueError(f'cache scope must be one of {", ".join(FRAGMENT_SCOPES)}, not {scope!r}')
+        cache_key: Tuple[str, Optional[Hashable], Hashable] = (scope, scope_key, key)
+
+        cache: OrderedDict = self.environment.fragment_cache # type: ignore
+        fragment: Optional[str] = cache.get(cache_key)
+        if fragment is not None:
+            cache.move_to_end(cache_key)
+            self.environment.fragment_cache_hits += 1 # type: ignore
+            return fragment
+
+        fragment = caller()
+        cache[cache_key] = fragment
+        if len(cache) > self.environment.fragment_cache_size: # type: ignore
+            cache.popitem(last=False)
+        return fragment
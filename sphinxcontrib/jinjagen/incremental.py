@@ -0,0 +1,104 @@
+from __future__ import annotations
+from typing import Dict, List, Set, cast
+
+from pathlib import Path
+
+from sphinx.application import Sphinx
+from sphinx.environment import BuildEnvironment
+from sphinx.util.logging import getLogger
+
+from .cache import FileGenCache
+from .ext import JinjagenDomain, lookup_genref
+from .stats import FileGenWriteStats
+
+logger = getLogger(__name__)
+
+
+def remove_stale_outputs(cache: FileGenCache) -> List[str]:
+    """Delete outputs the previous build generated and this one did not,
+    so Sphinx sees their docs removed and purges them. Only run with
+    ``jinjagen_remove_stale``: the files are in the source tree and
+    whatever sits at a stale path now is deleted too.
+    """
+    removed: List[str] = []
+    for filepath in cache.stale_paths():
+        try:
+            Path(filepath).unlink()
+            removed.append(filepath)
+            Path(filepath).parent.rmdir()
+        except FileNotFoundError:
+            pass
+        except OSError:
+            # directory still has other files
+            pass
+    if removed:
+        logger.info('jinjagen: removed %d stale generated files', len(removed))
+    return removed
+
+
+def record_generated_docs(env: BuildEnvironment,
+    previous_genrefs: Dict[str, Dict[str, str]],
+    stats: FileGenWriteStats) -> None:
+    """Remember which docs this build generated, which of them were
+    rewritten and which docs' genrefs now point elsewhere, for the
+    env-get-outdated and env-get-updated handlers.
+    """
+    domain: JinjagenDomain = cast(JinjagenDomain, env.get_domain(JinjagenDomain.name))
+    domain.data['generated_docs'] = {docname for refs in domain.genrefs.values() for docname in refs.values()}
+    domain.data['changed_docs'] = {docname for docname in map(env.path2doc, stats.written_files)
+                                   if docname is not None}
+    domain.data['relinked_docs'] = {
+        docname for docname, targets in domain.genref_targets.items()
+        if any(lookup_genref(previous_genrefs, target) != domain.lookup_genref(target) for target in targets)}
+
+
+def outdated_besides_mtime(env: BuildEnvironment, docname: str) -> bool:
+    """Whether Sphinx would re-read *docname* even with its source mtime
+    unchanged: its doctree is missing, it is always re-read or one of its
+    dependencies, e.g. an ``.. include::``, changed since it was read.
+    """
+    doctree_path: Path = Path(env.doctreedir, docname + '.doctree')
+    if docname in env.reread_always or not doctree_path.is_file():
+        return True
+    read_mtime: int = doctree_path.stat().st_mtime_ns
+    for dep in env.dependencies.get(docname, ()):
+        try:
+            if Path(env.srcdir, dep).stat().st_mtime_ns > read_mtime:
+                return True
+        except OSError:
+            return True
+    return False
+
+
+def env_get_outdated(app: Sphinx, env: BuildEnvironment,
+    added: Set[str], changed: Set[str], removed: Set[str]) -> List[str]:
+    """Generated docs count as changed when jinjagen rewrote them, whatever
+    their mtime says; a doc not regenerated keeps its doctree unless
+    something other than its mtime makes it outdated.
+    """
+    domain: JinjagenDomain = cast(JinjagenDomain, env.get_domain(JinjagenDomain.name))
+    generated: Set[str] = domain.data.get('generated_docs', set())
+    rewritten: Set[str] = domain.data.get('changed_docs', set())
+    changed.difference_update([docname for docname in (generated - rewritten) & changed
+                               if not outdated_besides_mtime(env, docname)])
+    return sorted(rewritten & set(env.all_docs))
+
+
+def env_get_updated(app: Sphinx, env: BuildEnvironment) -> List[str]:
+    """Docs whose genrefs resolve to different docs, e.g. because their
+    target was generated or removed, are written again.
+    """
+    domain: JinjagenDomain = cast(JinjagenDomain, env.get_domain(JinjagenDomain.name))
+    return sorted(domain.data.get('relinked_docs', set()))
+
+
+def env_purge_doc(app: Sphinx, env: BuildEnvironment, docname: str) -> None:
+    """Forget removed docs, e.g. generated ones whose entry disappeared, so
+    env-get-updated does not ask to write them.
+    """
+    # docs about to be re-read are purged too
+    if docname in env.found_docs:
+        return
+    domain: JinjagenDomain = cast(JinjagenDomain, env.get_domain(JinjagenDomain.name))
+    for key in ('generated_docs', 'changed_docs', 'relinked_docs'):
+        domain.data.get(key, set()).discard(docname)
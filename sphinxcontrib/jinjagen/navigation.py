@@ -0,0 +1,98 @@
+from __future__ import annotations
+from typing import Any, Dict, List, Optional, Tuple, TYPE_CHECKING
+
+from dataclasses import dataclass, field
+
+from .node import StrKeyNodeBaseP, StrKeyRootNodes
+
+if TYPE_CHECKING:
+    from .filegen2 import FileGenRunEntry
+
+
+@dataclass(eq=False)
+class NodeNavigation:
+    """Precomputed neighbourhood of one generation node, given to templates
+    as ``gen_nav`` so navigation does not walk ``gen_roots`` on every page.
+
+    ``siblings`` is the parent's ``children`` list (the roots for a root)
+    and includes this node at ``index``; it is shared, not copied.
+    """
+    node: Any = field(repr=False)
+    key: str
+    keypath: Tuple[str, ...]
+    entries: Dict[str, FileGenRunEntry] = field(repr=False)
+    docnames: Dict[str, str]
+    parent: Optional[NodeNavigation] = field(repr=False)
+    siblings: List[NodeNavigation] = field(repr=False)
+    index: int
+    children: List[NodeNavigation] = field(default_factory=list, repr=False)
+    descendants: int = 0
+    # entries per run in this node's subtree, its own included
+    subtree_entries_by_run: Dict[str, int] = field(default_factory=dict)
+
+    @property
+    def ancestors(self) -> List[NodeNavigation]:
+        """Root first, excluding this node."""
+        ancestors: List[NodeNavigation] = []
+        nav: Optional[NodeNavigation] = self.parent
+        while nav is not None:
+            ancestors.append(nav)
+            nav = nav.parent
+        ancestors.reverse()
+        return ancestors
+
+    @property
+    def previous(self) -> Optional[NodeNavigation]:
+        return self.siblings[self.index - 1] if self.index > 0 else None
+
+    @property
+    def next(self) -> Optional[NodeNavigation]:
+        return self.siblings[self.index + 1] if self.index + 1 < len(self.siblings) else None
+
+
+@dataclass
+class GenNavigation:
+    roots: List[NodeNavigation]
+    by_keypath: Dict[Tuple[str, ...], NodeNavigation]
+
+    def for_node(self, gen_node: Any) -> Optional[NodeNavigation]:
+        return self.by_keypath.get(tuple(gen_node.keypath))
+
+
+def build_navigation(gen_roots: StrKeyRootNodes, src_dir: Optional[str] = None) -> GenNavigation:
+    """One pass over *gen_roots* computing every node's ``NodeNavigation``.
+    Docnames are filled for outputs inside *src_dir* when given.
+    """
+    roots: List[NodeNavigation] = []
+    by_keypath: Dict[Tuple[str, ...], NodeNavigation] = {}
+    # pre-order, so every parent precedes its children
+    order: List[NodeNavigation] = []
+    stack: List[Tuple[StrKeyNodeBaseP, Optional[NodeNavigation]]] = \
+        [(node, None) for node in reversed(list(gen_roots.roots.values()))]
+    while stack:
+        node, parent = stack.pop()
+        siblings: List[NodeNavigation] = roots if parent is None else parent.children
+        entries: Dict[str, FileGenRunEntry] = node.run_entry_by_name
+        docnames: Dict[str, str] = {}
+        if src_dir is not None:
+            for run_name, run_entry in entries.items():
+                docname: Optional[str] = run_entry.docname(src_dir)
+                if docname is not None:
+                    docnames[run_name] = docname
+        keypath: Tuple[str, ...] = tuple(node.keypath)
+        nav: NodeNavigation = NodeNavigation(
+            node, node.key, keypath, entries, docnames, parent, siblings, len(siblings))
+        siblings.append(nav)
+        by_keypath[keypath] = nav
+        order.append(nav)
+        stack.extend((child, nav) for child in reversed(list(node.children.values())))
+
+    for nav in reversed(order):
+        for run_name in nav.entries:
+            nav.subtree_entries_by_run[run_name] = nav.subtree_entries_by_run.get(run_name, 0) + 1
+        if nav.parent is not None:
+            nav.parent.descendants += nav.descendants + 1
+            for run_name, count in nav.subtree_entries_by_run.items():
+                nav.parent.subtree_entries_by_run[run_name] = \
+                    nav.parent.subtree_entries_by_run.get(run_name, 0) + count
+    return GenNavigation(roots, by_keypath)
@@ -1,5 +1,4 @@
 from __future__ import annotations
-from _typeshed import NoneType
 from typing import NewType, Protocol, Callable, TypeVar, Generic, Mapping, Any, List, Dict, Tuple, Optional, Iterable, Sequence, Generator, Iterator
 from typing import ForwardRef
 from typing import cast, Type
@@ -22,8 +21,8 @@ class NodeFactoryReqP(Protocol[TNode]):
 
 class LookupElseCreateNode(ABC, Generic[TNode]):
 
-    @abstractmethod
     @property
+    @abstractmethod
     def lookup_nodes(self) -> Dict[str, TNode]:...
 
     @abstractmethod 
@@ -35,12 +34,12 @@ class LookupElseCreateNode(ABC, Generic[TNode]):
 #ABC dataclass
 class StrKeyNodeBase(LookupElseCreateNode[TNode], ABC):
 
-    @abstractmethod
     @property
+    @abstractmethod
     def key(self) -> str:...
     
-    @abstractmethod
     @property
+    @abstractmethod
     def children(self: TNode) -> Dict[str, TNode]: ...
 
     @property
@@ -67,8 +66,8 @@ class StrKeyNodeBase(LookupElseCreateNode[TNode], ABC):
 
 class StrKeyNodeBaseP(StrKeyNodeBase, ABC):
 
-    @abstractmethod
     @property
+    @abstractmethod
     def parent(self: TNodeP) -> Optional[TNodeP]: ...
     
     def to_root_path(self: TNodeP, include_self: bool) -> Generator[TNodeP, None, None]:
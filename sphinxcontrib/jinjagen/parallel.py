@@ -0,0 +1,138 @@
+from __future__ import annotations
+from typing import Callable, List, Tuple, Optional
+
+import multiprocessing
+import traceback
+
+from dataclasses import dataclass
+
+from jinja2.sandbox import SandboxedEnvironment
+from sphinx.errors import ExtensionError
+from sphinx.util.logging import getLogger
+
+from .cache import FileGenCache
+from .filegen2 import (FileContext, FileGenNode, FileGenRoots, FileGenRunEntry, FileGenWriteStats,
+                       gen_tree_run_entries, render_and_write_gen_tree, render_to_file)
+from .writer import make_output_dirs
+
+logger = getLogger(__name__)
+
+EnvBuilder = Callable[[], SandboxedEnvironment]
+# (written, bytes, render seconds, write seconds, formatted error)
+EntryResult = Tuple[bool, int, float, float, Optional[str]]
+
+# chunks handed out per worker, keeps workers busy when entry costs vary
+CHUNKS_PER_JOB = 4
+
+
+def parallel_available() -> bool:
+    # workers inherit the tree and env factory by forking, as sphinx -j does
+    return 'fork' in multiprocessing.get_all_start_methods()
+
+
+@dataclass
+class ParallelRenderState:
+    gen_roots: FileGenRoots
+    entries: List[Tuple[FileGenNode, FileGenRunEntry]]
+    env_builder: EnvBuilder
+    template_env: Optional[SandboxedEnvironment] = None
+
+
+# set in the parent before forking, so workers receive it without pickling
+_state: Optional[ParallelRenderState] = None
+
+
+def _init_worker() -> None:
+    assert _state is not None
+    _state.template_env = _state.env_builder()
+
+
+def _render_chunk(bounds: Tuple[int, int]) -> List[EntryResult]:
+    assert _state is not None and _state.template_env is not None
+    results: List[EntryResult] = []
+    for gen_node, run_entry in _state.entries[bounds[0]:bounds[1]]:
+        try:
+            run_def = run_entry.run_data.run_def
+            # trusted runs keep the template inherited from the parent, precompiled when bundled
+            template = run_entry.run_data.template if run_def.trusted \
+                else _state.template_env.get_template(run_def.template_filepath)
+            written, nbytes, render_seconds, write_seconds = render_to_file(
+                FileContext(gen_node, _state.gen_roots, run_entry).get_render_kwargs(),
+                template,
+                run_entry.filepath,
+                run_def.streaming,
+                make_parents=False)
+            results.append((written, nbytes, render_seconds, write_seconds, None))
+        except Exception:
+            results.append((False, 0, 0.0, 0.0, traceback.format_exc()))
+    return results
+
+
+def chunk_bounds(n: int, jobs: int) -> List[Tuple[int, int]]:
+    chunk_size: int = max(1, -(-n // (jobs * CHUNKS_PER_JOB)))
+    return [(i, min(i + chunk_size, n)) for i in range(0, n, chunk_size)]
+
+
+def render_and_write_gen_tree_parallel(
+    gen_roots: FileGenRoots,
+    cache: Optional[FileGenCache] = None,
+    env_builder: Optional[EnvBuilder] = None,
+    jobs: int = 1) -> FileGenWriteStats:
+    """Render the tree's run entries across a pool of *jobs* processes.
+    Each worker builds its template env once through *env_builder*.
+    Results and errors are reported in tree order regardless of scheduling.
+    """
+    global _state
+
+    if jobs <= 1 or env_builder is None:
+        return render_and_write_gen_tree(gen_roots, cache)
+    if not parallel_available():
+        logger.warning('jinjagen: parallel rendering needs fork, rendering serially')
+        return render_and_write_gen_tree(gen_roots, cache)
+
+    stats: FileGenWriteStats = FileGenWriteStats()
+    pending: List[Tuple[FileGenNode, FileGenRunEntry, Optional[str]]] = []
+    for gen_node, run_entry in gen_tree_run_entries(gen_roots):
+        entry_fingerprint: Optional[str] = None
+        if cache is not None:
+            entry_fingerprint = cache.entry_fingerprint(
+                run_entry.run_data.run_def.name, gen_node.from_root_keypath(include_self=True))
+            if cache.is_fresh(run_entry.filepath, entry_fingerprint):
+                cache.record(run_entry.filepath, entry_fingerprint)
+                stats.cached += 1
+                continue
+        pending.append((gen_node, run_entry, entry_fingerprint))
+
+    if not pending:
+        return stats
+    make_output_dirs(run_entry.filepath for _, run_entry, _ in pending)
+
+    _state = ParallelRenderState(gen_roots, [(n, e) for n, e, _ in pending], env_builder)
+    try:
+        with multiprocessing.get_context('fork').Pool(jobs, initializer=_init_worker) as pool:
+            results: List[EntryResult] = [
+                result
+                for chunk in pool.imap(_render_chunk, chunk_bounds(len(pending), jobs))
+                for result in chunk]
+    finally:
+        _state = None
+
+    failed: int = 0
+    for (gen_node, run_entry, entry_fingerprint), result in zip(pending, results):
+        written, nbytes, render_seconds, write_seconds, error = result
+        if error is not None:
+            logger.error('jinjagen: failed to render %s\n%s', run_entry.filepath, error)
+            failed += 1
+            continue
+        stats.record(written, nbytes, str(run_entry.filepath))
+        stats.record_timing(run_entry.run_data.run_def.name,
+            run_entry.run_data.run_def.template_filepath,
+            str(run_entry.filepath),
+            render_seconds,
+            write_seconds)
+        if cache is not None and entry_fingerprint is not None:
+            cache.record(run_entry.filepath, entry_fingerprint)
+
+    if failed:
+        raise ExtensionError(f'jinjagen: failed to render {failed} file(s)')
+    return stats
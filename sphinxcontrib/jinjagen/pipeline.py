@@ -0,0 +1,262 @@
+from __future__ import annotations
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional, Sequence, Tuple
+
+import heapq
+from pathlib import Path
+
+from dataclasses import dataclass, field
+
+from jinja2 import Environment
+from jinja2.sandbox import SandboxedEnvironment
+from sphinx.errors import ExtensionError
+from sphinx.util.logging import getLogger
+
+from .cache import FileGenCache, fingerprint
+from .context import GenContexts
+from .filegen2 import (FileGenNode, FileGenRoots, FileGenRunData, FileGenRunDef, FileGenRunEntry, GenKeyNode,
+                       finish_gen, load_runs, prepare_cache, render_to_file)
+from .sources import KeyPathSource
+from .stats import FileGenWriteStats, GenReport
+
+logger = getLogger(__name__)
+
+EntrySink = Callable[[FileGenNode, FileGenRunEntry], None]
+
+
+@dataclass
+class GenTreeSummary:
+    """Whole-tree facts computed before a streamed generation. Templates
+    get it as ``gen_summary`` and as ``gen_roots``, since the full tree is
+    never held in memory.
+    """
+    root_keys: List[str] = field(default_factory=list)
+    entries_by_run: Dict[str, int] = field(default_factory=dict)
+    leaves: int = 0
+    max_depth: int = 0
+    # of the runs and their key paths, in place of gen_tree_fingerprint
+    tree_fingerprint: str = ''
+
+    @property
+    def entries(self) -> int:
+        return sum(self.entries_by_run.values())
+
+
+def _sorted_key_tree_keypaths(key_node: GenKeyNode, prefix: Tuple[str, ...]) -> Iterator[Tuple[str, ...]]:
+    stack: List[Tuple[GenKeyNode, Tuple[str, ...]]] = [(key_node, prefix)]
+    while stack:
+        node, parent_keypath = stack.pop()
+        keypath: Tuple[str, ...] = (*parent_keypath, node.key)
+        if node.children:
+            stack.extend((node.children[key], keypath) for key in sorted(node.children, reverse=True))
+        else:
+            yield keypath
+
+
+def _checked_sorted(run_name: str, keypaths: Iterable[Sequence[str]]) -> Iterator[Tuple[str, ...]]:
+    prev: Tuple[str, ...] = ()
+    for keypath in keypaths:
+        current: Tuple[str, ...] = tuple(keypath)
+        if current < prev:
+            raise ExtensionError(
+                f'jinjagen: key paths of run {run_name} must be sorted to stream, {current} after {prev}')
+        yield current
+        prev = current
+
+
+def sorted_run_keypaths(run_def: FileGenRunDef) -> Iterator[Tuple[str, ...]]:
+    """Leaf key paths of a run in sorted order. Key path sources are
+    expected to be sorted already and are only checked.
+    """
+    if isinstance(run_def.gen_key_roots, KeyPathSource):
+        return _checked_sorted(run_def.name, run_def.gen_key_roots)
+    roots: Dict[str, GenKeyNode] = run_def.gen_key_roots.roots
+    return (keypath for key in sorted(roots) for keypath in _sorted_key_tree_keypaths(roots[key], ()))
+
+
+def _indexed(keypaths: Iterator[Tuple[str, ...]], index: int) -> Iterator[Tuple[Tuple[str, ...], int]]:
+    return ((keypath, index) for keypath in keypaths)
+
+
+def merged_keypaths(runs: List[FileGenRunData]) -> Iterator[Tuple[Tuple[str, ...], List[FileGenRunData]]]:
+    """Leaf key paths of all runs merged in sorted order, each with the
+    runs that have it.
+    """
+    current: Optional[Tuple[str, ...]] = None
+    current_indices: List[int] = []
+    for keypath, index in heapq.merge(*(_indexed(sorted_run_keypaths(run_data.run_def), index)
+                                        for index, run_data in enumerate(runs))):
+        if keypath != current:
+            if current is not None:
+                yield current, [runs[i] for i in current_indices]
+            current, current_indices = keypath, []
+        # a run listing the same key path twice still gets one entry
+        if not current_indices or current_indices[-1] != index:
+            current_indices.append(index)
+    if current is not None:
+        yield current, [runs[i] for i in current_indices]
+
+
+def summarize_runs(runs: List[FileGenRunData]) -> GenTreeSummary:
+    summary: GenTreeSummary = GenTreeSummary()
+
+    def tree_parts() -> Iterator[str]:
+        for run_data in runs:
+            yield from run_data.run_def.fingerprint_parts()
+        for keypath, keypath_runs in merged_keypaths(runs):
+            if not summary.root_keys or summary.root_keys[-1] != keypath[0]:
+                summary.root_keys.append(keypath[0])
+            summary.leaves += 1
+            summary.max_depth = max(summary.max_depth, len(keypath))
+            for run_data in keypath_runs:
+                summary.entries_by_run[run_data.run_def.name] = \
+                    summary.entries_by_run.get(run_data.run_def.name, 0) + 1
+            yield '\x1f'.join(keypath)
+            yield ' '.join(run_data.run_def.name for run_data in keypath_runs)
+
+    # one pass over the key paths for both
+    summary.tree_fingerprint = fingerprint(tree_parts())
+    return summary
+
+
+class StreamingGenerator:
+    """Renders the merged key trees of the runs depth first, holding only
+    the nodes on the current key path. A node is rendered and released
+    once the key paths move past its subtree, so memory follows the tree
+    depth rather than its size. Templates see ancestors through
+    ``gen_node.parent`` but no finished siblings.
+    """
+
+    def __init__(self,
+        base_dir: str,
+        summary: GenTreeSummary,
+        cache: Optional[FileGenCache] = None,
+        on_entry: Optional[EntrySink] = None,
+        contexts: Optional[GenContexts] = None,
+        entry_filter: Optional[Callable[[FileGenNode, FileGenRunEntry], bool]] = None) -> None:
+        self.base_dir: str = base_dir
+        self.summary: GenTreeSummary = summary
+        self.cache: Optional[FileGenCache] = cache
+        self.on_entry: Optional[EntrySink] = on_entry
+        self.contexts: Optional[GenContexts] = contexts
+        self.entry_filter: Optional[Callable[[FileGenNode, FileGenRunEntry], bool]] = entry_filter
+        self.stats: FileGenWriteStats = FileGenWriteStats()
+        self.gen_roots: FileGenRoots = FileGenRoots({})
+        self._path_nodes: List[FileGenNode] = []
+        self._made_dir: Optional[Path] = None
+
+    def render_kwargs(self, gen_node: FileGenNode, run_entry: FileGenRunEntry) -> Dict[str, Any]:
+        return {
+            'gen_node': gen_node,
+            'gen_roots': self.summary,
+            'gen_summary': self.summary,
+            'gen_run_entry': run_entry,
+            'gen_nav': None,
+            'gen_ctx': self.contexts.for_entry(gen_node, run_entry.run_data.run_def.name) \
+                if self.contexts is not None else None,
+        }
+
+    def _render_node(self, gen_node: FileGenNode) -> None:
+        for name, run_entry in gen_node.run_entry_by_name.items():
+            if self.entry_filter is not None and not self.entry_filter(gen_node, run_entry):
+                continue
+            if self.on_entry is not None:
+                self.on_entry(gen_node, run_entry)
+            entry_fingerprint: Optional[str] = None
+            if self.cache is not None:
+                entry_fingerprint = self.cache.entry_fingerprint(name, gen_node.keypath)
+                if self.cache.is_fresh(run_entry.filepath, entry_fingerprint):
+                    self.cache.record(run_entry.filepath, entry_fingerprint)
+                    self.stats.cached += 1
+                    continue
+            if run_entry.filepath.parent != self._made_dir:
+                run_entry.filepath.parent.mkdir(exist_ok=True, parents=True)
+                self._made_dir = run_entry.filepath.parent
+            try:
+                written, nbytes, render_seconds, write_seconds = render_to_file(
+                    self.render_kwargs(gen_node, run_entry),
+                    run_entry.run_data.template,
+                    run_entry.filepath,
+                    run_entry.run_data.run_def.streaming,
+                    make_parents=False)
+            except Exception as ex:
+                raise ExtensionError(f'jinjagen: failed to render {run_entry.filepath}', ex) from ex
+            self.stats.record(written, nbytes, str(run_entry.filepath))
+            self.stats.record_timing(name,
+                run_entry.run_data.run_def.template_filepath,
+                str(run_entry.filepath),
+                render_seconds,
+                write_seconds)
+            if self.cache is not None and entry_fingerprint is not None:
+                self.cache.record(run_entry.filepath, entry_fingerprint)
+
+    def _release(self, depth: int) -> None:
+        # deepest first, so a node renders after its whole subtree
+        while len(self._path_nodes) > depth:
+            gen_node: FileGenNode = self._path_nodes.pop()
+            self._render_node(gen_node)
+            siblings = self.gen_roots.roots if gen_node.parent is None else gen_node.parent.children
+            del siblings[gen_node.key]
+
+    def add(self, keypath: Tuple[str, ...], keypath_runs: List[FileGenRunData]) -> None:
+        common: int = 0
+        for gen_node, key in zip(self._path_nodes, keypath):
+            if gen_node.key != key:
+                break
+            common += 1
+        self._release(common)
+        for key in keypath[common:]:
+            parent: Optional[FileGenNode] = self._path_nodes[-1] if self._path_nodes else None
+            gen_node: FileGenNode = FileGenNode(key, parent, {}, {})
+            (self.gen_roots.roots if parent is None else parent.children)[key] = gen_node
+            self._path_nodes.append(gen_node)
+
+        leaf: FileGenNode = self._path_nodes[-1]
+        for run_data in keypath_runs:
+            run_def = run_data.run_def
+            leaf.run_entry_by_name[run_def.name] = FileGenRunEntry(
+                gen_key=leaf.key,
+                run_data=run_data,
+                filepath=run_def.entry_filepath_from_key_dir(
+                    len(keypath_runs) > 1, self.base_dir, leaf.key_dir))
+
+    def finish(self) -> FileGenWriteStats:
+        self._release(0)
+        return self.stats
+
+
+def stream_from_run_defs(template_env: SandboxedEnvironment,
+    run_defs: List[FileGenRunDef],
+    src_dir: str,
+    cache: Optional[FileGenCache] = None,
+    trusted_env: Optional[Environment] = None,
+    report: Optional[GenReport] = None,
+    on_entry: Optional[EntrySink] = None,
+    contexts: Optional[GenContexts] = None,
+    entry_filter: Optional[Callable[[FileGenNode, FileGenRunEntry], bool]] = None) -> GenTreeSummary:
+    """Bounded memory counterpart of ``gen_from_run_defs``. The runs' key
+    paths are read twice, once for the summary and the cache's tree
+    fingerprint and once to render, and every entry is passed to
+    *on_entry* before it is released. Both reads must yield the same key
+    paths.
+    """
+    report = report if report is not None else GenReport()
+    runs: List[FileGenRunData] = load_runs(template_env, run_defs, None, trusted_env, report)
+
+    with report.phase('summarize'):
+        summary: GenTreeSummary = summarize_runs(runs)
+    if cache is not None:
+        prepare_cache(cache, template_env, run_defs, report, contexts, summary.tree_fingerprint)
+
+    with report.phase('render and write'):
+        generator: StreamingGenerator = StreamingGenerator(src_dir, summary, cache, on_entry, contexts,
+            entry_filter)
+        leaves: int = 0
+        for keypath, keypath_runs in merged_keypaths(runs):
+            generator.add(keypath, keypath_runs)
+            leaves += 1
+        if leaves != summary.leaves:
+            raise ExtensionError(f'jinjagen: key path sources yielded {summary.leaves} key paths to summarize '
+                                 f'and {leaves} to render; every read of a source must yield the same key paths')
+        stats: FileGenWriteStats = generator.finish()
+    finish_gen(stats, cache, report)
+    return summary
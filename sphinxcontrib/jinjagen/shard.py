@@ -0,0 +1,170 @@
+from __future__ import annotations
+from typing import Any, Callable, Dict, List, Optional, Sequence, Set, Tuple, Union, TYPE_CHECKING
+
+import argparse
+import hashlib
+import json
+import sys
+from pathlib import Path
+
+from dataclasses import dataclass
+
+from sphinx.errors import ExtensionError
+from sphinx.util.logging import getLogger
+
+from .cache import FileGenCache, MANIFEST_VERSION, fingerprint
+
+if TYPE_CHECKING:
+    from .filegen2 import FileGenRoots
+
+logger = getLogger(__name__)
+
+SHARD_STRATEGIES = ('hash', 'range')
+
+
+def shard_manifest_filename(index: int, count: int) -> str:
+    return f'jinjagen_manifest.shard-{index}-of-{count}.json'
+
+
+def keypath_shard(keypath: Sequence[str], count: int) -> int:
+    """Stable across processes and machines, unlike ``hash``."""
+    digest: str = hashlib.sha256('\0'.join(keypath).encode('utf-8')).hexdigest()
+    return int(digest[:16], 16) % count
+
+
+@dataclass(frozen=True)
+class GenShard:
+    """Shard *index* of *count* renders only its part of the tree's nodes,
+    all runs of a node together. ``hash`` spreads nodes by a hash of their
+    key path; ``range`` cuts the tree in depth-first order into ranges with
+    as many entries each, keeping subtrees together.
+    """
+    index: int
+    count: int
+    strategy: str = 'hash'
+
+    @classmethod
+    def from_config(cls,
+        value: Union[None, str, Sequence[int]],
+        strategy: str = 'hash') -> Optional[GenShard]:
+        """From ``jinjagen_shard``: ``(index, count)`` or ``"index/count"``
+        as given to ``-D``.
+        """
+        if not value:
+            return None
+        try:
+            index, count = (int(part) for part in value.split('/')) if isinstance(value, str) else value
+        except ValueError:
+            raise ExtensionError(f'jinjagen_shard must be (index, count), not {value!r}') from None
+        if not 0 <= index < count:
+            raise ExtensionError(f'jinjagen_shard index must be in [0, {count}), not {index}')
+        if strategy not in SHARD_STRATEGIES:
+            raise ExtensionError(f'jinjagen_shard_strategy must be one of {", ".join(SHARD_STRATEGIES)}')
+        return cls(index, count, strategy)
+
+    @property
+    def manifest_filename(self) -> str:
+        return shard_manifest_filename(self.index, self.count)
+
+    def assign(self, gen_roots: FileGenRoots) -> Tuple[Dict[Tuple[str, ...], int], int, str]:
+        """Key paths of this shard's nodes with their number of entries, the
+        number of entries in the whole tree and a fingerprint of the whole
+        tree, the same on every shard.
+        """
+        nodes: List[Tuple[Tuple[str, ...], int]] = []
+        parts: List[str] = []
+        stack: List[Any] = list(reversed(list(gen_roots.roots.values())))
+        while stack:
+            node: Any = stack.pop()
+            if node.run_entry_by_name:
+                keypath: Tuple[str, ...] = tuple(node.keypath)
+                nodes.append((keypath, len(node.run_entry_by_name)))
+                parts.extend('\x1f'.join((*keypath, run_name)) for run_name in node.run_entry_by_name)
+            stack.extend(reversed(list(node.children.values())))
+
+        total: int = sum(n for _, n in nodes)
+        mine: Dict[Tuple[str, ...], int] = {}
+        before: int = 0
+        for keypath, n in nodes:
+            shard: int = keypath_shard(keypath, self.count) if self.strategy == 'hash' \
+                else before * self.count // total
+            if shard == self.index:
+                mine[keypath] = n
+            before += n
+        return mine, total, fingerprint(parts)
+
+    def apply(self, gen_roots: FileGenRoots, cache: Optional[FileGenCache] = None) -> int:
+        """Restrict *gen_roots* to this shard's entries, on top of any
+        ``entry_filter`` already set, and describe the shard in *cache*'s
+        manifest for ``merge_shard_manifests``.
+        """
+        mine, total, tree = self.assign(gen_roots)
+        entry_filter: Optional[Callable[[Any, Any], bool]] = gen_roots.entry_filter
+        gen_roots.entry_filter = lambda gen_node, run_entry: tuple(gen_node.keypath) in mine \
+            and (entry_filter is None or entry_filter(gen_node, run_entry))
+        selected: int = sum(mine.values())
+        if cache is not None:
+            cache.shard = {'index': self.index, 'count': self.count, 'strategy': self.strategy,
+                           'total': total, 'tree': tree}
+        logger.info('jinjagen: shard %d of %d renders %d of %d entries', self.index, self.count, selected, total)
+        return selected
+
+
+def merge_shard_manifests(manifest_paths: Sequence[Path]) -> Dict[str, str]:
+    """Entries of all shard manifests, after checking the shards are of the
+    same tree and together cover it exactly once.
+    """
+    errors: List[str] = []
+    shards: List[Tuple[Path, Dict[str, Any], Dict[str, str]]] = []
+    for path in manifest_paths:
+        data: Dict[str, Any] = json.loads(Path(path).read_text())
+        if data.get('version') != MANIFEST_VERSION or 'shard' not in data:
+            errors.append(f'{path}: not a jinjagen shard manifest')
+            continue
+        shards.append((path, data['shard'], data['entries']))
+    if errors or not shards:
+        raise ExtensionError('\n'.join(errors) or 'jinjagen: no shard manifests')
+
+    first: Dict[str, Any] = shards[0][1]
+    for path, shard, _ in shards[1:]:
+        for key in ('count', 'strategy', 'total', 'tree'):
+            if shard[key] != first[key]:
+                errors.append(f'{path}: {key} {shard[key]!r} differs from {shards[0][0]}: {first[key]!r}')
+    indices: List[int] = sorted(shard['index'] for _, shard, _ in shards)
+    if indices != list(range(first['count'])):
+        missing: Set[int] = set(range(first['count'])) - set(indices)
+        duplicated: Set[int] = {index for index in indices if indices.count(index) > 1}
+        errors.append(f'shards missing: {sorted(missing)}, given more than once: {sorted(duplicated)}')
+
+    merged: Dict[str, str] = {}
+    owner: Dict[str, Path] = {}
+    for path, _, entries in shards:
+        for filepath, entry_fingerprint in entries.items():
+            if filepath in merged:
+                errors.append(f'{filepath} generated by both {owner[filepath]} and {path}')
+            merged[filepath] = entry_fingerprint
+            owner[filepath] = path
+    if not errors and len(merged) != first['total']:
+        errors.append(f'shards cover {len(merged)} of {first["total"]} entries')
+    if errors:
+        raise ExtensionError('\n'.join(errors))
+    return merged
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(prog='python -m sphinxcontrib.jinjagen merge-shards',
+        description='Check that shard manifests cover the generation tree exactly once and merge them.')
+    parser.add_argument('manifests', nargs='+', type=Path)
+    parser.add_argument('-o', dest='output', type=Path,
+        help='write the merged manifest, e.g. doctrees/jinjagen_manifest.json')
+    args = parser.parse_args(argv)
+    try:
+        merged: Dict[str, str] = merge_shard_manifests(args.manifests)
+    except ExtensionError as ex:
+        print(ex.message, file=sys.stderr)
+        return 1
+    if args.output is not None:
+        args.output.parent.mkdir(exist_ok=True, parents=True)
+        args.output.write_text(json.dumps({'version': MANIFEST_VERSION, 'entries': merged}, sort_keys=True))
+    print(f'jinjagen: {len(args.manifests)} shards cover all {len(merged)} entries')
+    return 0
@@ -0,0 +1,92 @@
+from __future__ import annotations
+from typing import Any, Callable, Iterable, Iterator, Optional, Sequence, Tuple, Union
+
+import csv
+import json
+from abc import ABC, abstractmethod
+from dataclasses import dataclass, field
+from pathlib import Path
+
+from sphinx.errors import ExtensionError
+
+KeyPath = Sequence[str]
+
+
+class KeyPathSource(ABC):
+    """Leaf key paths of a run, read lazily every time the source is
+    iterated. A run given a source instead of ``GenKeyRoots`` never
+    materializes its nested key tree with the fused tree builder.
+
+    A build reads the key paths more than once, e.g. to fingerprint the
+    tree and to build it, so every iteration must yield the same ones.
+    """
+    prefix: Tuple[str, ...]
+
+    @abstractmethod
+    def source_keypaths(self) -> Iterator[KeyPath]:
+        ...
+
+    def __iter__(self) -> Iterator[Tuple[str, ...]]:
+        for keypath in self.source_keypaths():
+            yield (*self.prefix, *keypath)
+
+
+@dataclass
+class IterableKeyPaths(KeyPathSource):
+    """Key paths from a re-iterable collection, or from a callable
+    returning a fresh iterable (e.g. a generator function). Iterators and
+    generators can only be read once and are rejected.
+    """
+    keypaths: Union[Iterable[KeyPath], Callable[[], Iterable[KeyPath]]] = field(compare=False)
+    prefix: Tuple[str, ...] = ()
+
+    def __post_init__(self) -> None:
+        if not callable(self.keypaths) and iter(self.keypaths) is self.keypaths:
+            raise ExtensionError('jinjagen: IterableKeyPaths needs key paths it can read more than once, '
+                                 'pass a list or a function returning an iterable instead of an iterator')
+
+    def source_keypaths(self) -> Iterator[KeyPath]:
+        return iter(self.keypaths() if callable(self.keypaths) else self.keypaths)
+
+
+@dataclass
+class JsonlKeyPaths(KeyPathSource):
+    """One key path per line of a JSON lines file: either a list of keys,
+    or an object whose *key_fields* hold the keys in order.
+    """
+    path: Path
+    key_fields: Optional[Sequence[str]] = None
+    prefix: Tuple[str, ...] = ()
+
+    def source_keypaths(self) -> Iterator[KeyPath]:
+        with open(self.path, encoding='utf-8') as f:
+            for line in f:
+                if not line.strip():
+                    continue
+                record: Any = json.loads(line)
+                if self.key_fields is None:
+                    yield [str(key) for key in record]
+                else:
+                    yield [str(record[key_field]) for key_field in self.key_fields]
+
+
+@dataclass
+class CsvKeyPaths(KeyPathSource):
+    """One key path per CSV row, from the *key_columns* (by header name)
+    in order, or from every column after the header row when None.
+    """
+    path: Path
+    key_columns: Optional[Sequence[str]] = None
+    prefix: Tuple[str, ...] = ()
+    dialect: str = 'excel'
+
+    def source_keypaths(self) -> Iterator[KeyPath]:
+        with open(self.path, newline='', encoding='utf-8') as f:
+            if self.key_columns is None:
+                reader = csv.reader(f, dialect=self.dialect)
+                next(reader, None) # header
+                yield from reader
+            else:
+                key_columns: Sequence[str] = self.key_columns
+                for row in csv.DictReader(f, dialect=self.dialect):
+                    yield [row[column] for column in key_columns]
@@ -0,0 +1,160 @@
+from __future__ import annotations
+from typing import Any, Callable, Collection, Dict, Iterator, List, Optional, Sequence, Tuple
+
+import os
+import sqlite3
+import threading
+from dataclasses import dataclass
+from pathlib import Path
+
+from .context import JinjagenContextBase
+from .sources import KeyPath, KeyPathSource
+
+# rows fetched per round trip when streaming key paths
+FETCH_SIZE = 1000
+# below SQLite's default limit of 999 host parameters per statement
+MAX_LOOKUP_PARAMS = 500
+
+
+class SqliteConnectionPool:
+    """Read-only connections to one database, one per process and thread.
+    A forked render worker opens its own connection on first use instead of
+    reusing the parent's, which SQLite does not allow.
+    """
+
+    def __init__(self, database: Path) -> None:
+        self.database: Path = database
+        self._connections: Dict[Tuple[int, int], sqlite3.Connection] = {}
+        self._lock: threading.Lock = threading.Lock()
+
+    def connection(self) -> sqlite3.Connection:
+        owner: Tuple[int, int] = (os.getpid(), threading.get_ident())
+        connection: Optional[sqlite3.Connection] = self._connections.get(owner)
+        if connection is None:
+            connection = sqlite3.connect(f'{Path(self.database).resolve().as_uri()}?mode=ro', uri=True)
+            connection.row_factory = sqlite3.Row
+            with self._lock:
+                self._connections[owner] = connection
+        return connection
+
+    def close(self) -> None:
+        """Close this process's connections."""
+        with self._lock:
+            for owner in [owner for owner in self._connections if owner[0] == os.getpid()]:
+                self._connections.pop(owner).close()
+
+
+_pools: Dict[str, SqliteConnectionPool] = {}
+_pools_lock: threading.Lock = threading.Lock()
+
+
+def sqlite_pool(database: Path) -> SqliteConnectionPool:
+    """The pool shared by every source and provider reading *database*."""
+    key: str = str(Path(database).resolve())
+    with _pools_lock:
+        pool: Optional[SqliteConnectionPool] = _pools.get(key)
+        if pool is None:
+            pool = _pools[key] = SqliteConnectionPool(Path(database))
+    return pool
+
+
+@dataclass
+class SqlKeyPaths(KeyPathSource):
+    """One key path per row of *query*, from all its columns in order.
+    Rows are fetched in batches from a streaming cursor; add an ORDER BY
+    for ``jinjagen_streaming_tree``, which needs sorted key paths.
+    """
+    database: Path
+    query: str
+    params: Sequence[Any] = ()
+    prefix: Tuple[str, ...] = ()
+
+    def source_keypaths(self) -> Iterator[KeyPath]:
+        cursor: sqlite3.Cursor = sqlite_pool(self.database).connection().execute(self.query, tuple(self.params))
+        try:
+            while True:
+                rows: List[sqlite3.Row] = cursor.fetchmany(FETCH_SIZE)
+                if not rows:
+                    return
+                for row in rows:
+                    yield [str(value) for value in row]
+        finally:
+            cursor.close()
+
+
+class SqlContextProvider(JinjagenContextBase):
+    """Context rows of each node from *query*, whose ``{keys}`` placeholder
+    becomes a list of parameters, e.g.
+    ``SELECT * FROM recipe WHERE name IN ({keys})``. Rows are grouped by
+    *key_column* and fetched for all children of a node's parent at once,
+    since siblings are rendered together, or for the node alone when its
+    siblings are not known yet. Templates get a list of rows as
+    dicts for the node, or the first row (or None) with *one* set.
+    """
+
+    def __init__(self,
+        database: Path,
+        query: str,
+        key_column: str,
+        one: bool = False,
+        node_key: Optional[Callable[[Any], Any]] = None,
+        runs: Optional[Collection[str]] = None,
+        subtree: Sequence[str] = ()) -> None:
+        super().__init__(runs, subtree)
+        self.database: Path = database
+        self.query: str = query
+        self.key_column: str = key_column
+        self.one: bool = one
+        self.node_key: Optional[Callable[[Any], Any]] = node_key
+        self._rows_by_parent: Dict[Tuple[str, ...], Dict[Any, List[Dict[str, Any]]]] = {}
+
+    def load(self) -> Any:
+        # start of a build, rows from a previous one may be stale
+        self._rows_by_parent.clear()
+        return None
+
+    def fingerprint(self) -> Optional[str]:
+        """Size and mtime of the database, and of its write-ahead log."""
+        stats: List[str] = []
+        for path in (self.database, Path(f'{self.database}-wal')):
+            try:
+                stat: os.stat_result = path.stat()
+            except FileNotFoundError:
+                continue
+            stats.append(f'{path.name}:{stat.st_size}:{stat.st_mtime_ns}')
+        return ' '.join(stats) or None
+
+    def key_of(self, gen_node: Any) -> Any:
+        return self.node_key(gen_node) if self.node_key is not None else gen_node.key
+
+    def fetch_rows(self, keys: Sequence[Any]) -> Dict[Any, List[Dict[str, Any]]]:
+        rows_by_key: Dict[Any, List[Dict[str, Any]]] = {key: [] for key in keys}
+        connection: sqlite3.Connection = sqlite_pool(self.database).connection()
+        for start in range(0, len(keys), MAX_LOOKUP_PARAMS):
+            batch: Sequence[Any] = keys[start:start + MAX_LOOKUP_PARAMS]
+            query: str = self.query.format(keys=', '.join('?' * len(batch)))
+            for row in connection.execute(query, tuple(batch)):
+                rows_by_key.setdefault(row[self.key_column], []).append(dict(row))
+        return rows_by_key
+
+    def lookup(self, data: Any, gen_node: Any) -> Any:
+        parent: Any = gen_node.parent
+        parent_keypath: Tuple[str, ...] = tuple(parent.keypath) if parent is not None else ()
+        rows_by_key: Optional[Dict[Any, List[Dict[str, Any]]]] = self._rows_by_parent.get(parent_keypath)
+        if rows_by_key is None:
+            # only the latest parent is kept, as siblings render together
+            self._rows_by_parent.clear()
+            rows_by_key = self._rows_by_parent[parent_keypath] = {}
+        key: Any = self.key_of(gen_node)
+        if key not in rows_by_key:
+            # siblings known by now, in one batch; roots and streamed trees
+            # only know the node itself, so later siblings fetch their own
+            siblings: Collection[Any] = parent.children.values() if parent is not None else []
+            keys: List[Any] = [sibling_key for sibling_key in dict.fromkeys(
+                                   [key, *(self.key_of(sibling) for sibling in siblings)])
+                               if sibling_key not in rows_by_key]
+            rows_by_key.update(self.fetch_rows(keys))
+        rows: List[Dict[str, Any]] = rows_by_key.get(key, [])
+        if self.one:
+            return rows[0] if rows else None
+        return rows
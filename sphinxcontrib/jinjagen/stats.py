@@ -0,0 +1,108 @@
+from __future__ import annotations
+from typing import Any, List, Dict, Optional, Tuple, Iterator
+
+import heapq
+import json
+import time
+from contextlib import contextmanager
+from pathlib import Path
+
+from dataclasses import dataclass, field
+
+from sphinx.util.logging import getLogger
+
+logger = getLogger(__name__)
+
+DEFAULT_SLOWEST_N = 10
+
+
+@dataclass
+class FileGenWriteStats:
+    written: int = 0
+    skipped: int = 0
+    cached: int = 0
+    virtual: int = 0
+    bytes_written: int = 0
+    render_seconds: float = 0.0
+    write_seconds: float = 0.0
+    seconds_by_run: Dict[str, float] = field(default_factory=dict)
+    seconds_by_template: Dict[str, float] = field(default_factory=dict)
+    slowest_n: int = DEFAULT_SLOWEST_N
+    slowest: List[Tuple[float, str]] = field(default_factory=list) # min-heap of (render seconds, filepath)
+    written_files: List[str] = field(default_factory=list)
+
+    def record(self, was_written: bool, nbytes: int = 0, filepath: Optional[str] = None) -> None:
+        if was_written:
+            self.written += 1
+            self.bytes_written += nbytes
+            if filepath is not None:
+                self.written_files.append(filepath)
+        else:
+            self.skipped += 1
+
+    def record_timing(self,
+        run_name: str,
+        template_name: str,
+        filepath: str,
+        render_seconds: float,
+        write_seconds: float) -> None:
+        self.render_seconds += render_seconds
+        self.write_seconds += write_seconds
+        self.seconds_by_run[run_name] = self.seconds_by_run.get(run_name, 0.0) + render_seconds
+        self.seconds_by_template[template_name] = \
+            self.seconds_by_template.get(template_name, 0.0) + render_seconds
+        if len(self.slowest) < self.slowest_n:
+            heapq.heappush(self.slowest, (render_seconds, filepath))
+        elif self.slowest and render_seconds > self.slowest[0][0]:
+            heapq.heapreplace(self.slowest, (render_seconds, filepath))
+
+    def slowest_entries(self) -> List[Tuple[float, str]]:
+        return sorted(self.slowest, reverse=True)
+
+    def as_dict(self) -> Dict[str, Any]:
+        return {
+            'files': {'written': self.written, 'unchanged': self.skipped, 'up_to_date': self.cached,
+                      'in_memory': self.virtual},
+            'bytes_written': self.bytes_written,
+            'render_seconds': self.render_seconds,
+            'write_seconds': self.write_seconds,
+            'render_seconds_by_run': self.seconds_by_run,
+            'render_seconds_by_template': self.seconds_by_template,
+            'slowest': [{'seconds': s, 'filepath': f} for s, f in self.slowest_entries()],
+        }
+
+
+@dataclass
+class GenReport:
+    """Wall time per generation phase plus the render/write counters of the
+    run, logged as a summary and optionally written as JSON for CI.
+    """
+    phase_seconds: Dict[str, float] = field(default_factory=dict)
+    write_stats: FileGenWriteStats = field(default_factory=FileGenWriteStats)
+
+    @contextmanager
+    def phase(self, name: str) -> Iterator[None]:
+        start: float = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.phase_seconds[name] = \
+                self.phase_seconds.get(name, 0.0) + time.perf_counter() - start
+
+    def as_dict(self) -> Dict[str, Any]:
+        return {'phases': self.phase_seconds, **self.write_stats.as_dict()}
+
+    def log_summary(self) -> None:
+        stats: FileGenWriteStats = self.write_stats
+        logger.info('jinjagen: %s', ', '.join(
+            f'{name} {seconds:.2f}s' for name, seconds in self.phase_seconds.items()))
+        logger.info('jinjagen: render %.2fs, write %.2fs, %d bytes written',
+            stats.render_seconds, stats.write_seconds, stats.bytes_written)
+        for run_name, seconds in sorted(stats.seconds_by_run.items(), key=lambda i: -i[1]):
+            logger.info('jinjagen:   run %s %.2fs', run_name, seconds)
+        for seconds, filepath in stats.slowest_entries():
+            logger.verbose('jinjagen:   slow %.3fs %s', seconds, filepath)
+
+    def write_json(self, path: Path) -> None:
+        path.parent.mkdir(exist_ok=True, parents=True)
+        path.write_text(json.dumps(self.as_dict(), indent=2, sort_keys=True))
@@ -0,0 +1,129 @@
+from __future__ import annotations
+from typing import Dict, Iterator, List, Optional, Sequence, Tuple, Union
+
+import dataclasses
+import os
+from dataclasses import dataclass
+from fnmatch import fnmatchcase
+
+from .cache import FileGenCache, fingerprint
+from .filegen2 import FileGenNode, FileGenRunDef, FileGenRunEntry, GenKeyNode, GenKeyRoots
+from .sources import KeyPath, KeyPathSource
+
+ONLY_ENV_VAR = 'JINJAGEN_ONLY'
+ONLY_RUNS_ENV_VAR = 'JINJAGEN_ONLY_RUNS'
+
+Patterns = Union[None, str, Sequence[str]]
+
+
+def _patterns(value: Patterns) -> Tuple[str, ...]:
+    if not value:
+        return ()
+    if isinstance(value, str):
+        value = value.split(',')
+    return tuple(pattern.strip() for pattern in value if pattern.strip())
+
+
+@dataclass(frozen=True)
+class GenSubset:
+    """Part of the tree to generate while working on one area, from
+    ``jinjagen_only`` dotted key path globs such as
+    ``gen.recipe_youtube.*`` and ``jinjagen_only_runs`` run name globs.
+    A glob selects the key paths it matches and their subtrees; the key
+    trees are pruned to those before the generation tree is built. Runs
+    are filtered when rendering, as dropping them from the tree could
+    change the other runs' file names.
+    """
+    keypath_globs: Tuple[Tuple[str, ...], ...] = ()
+    run_globs: Tuple[str, ...] = ()
+
+    @classmethod
+    def from_config(cls, only: Patterns = None, only_runs: Patterns = None) -> Optional[GenSubset]:
+        """``JINJAGEN_ONLY`` and ``JINJAGEN_ONLY_RUNS``, comma separated,
+        override the config values when set.
+        """
+        keypath_globs: Tuple[str, ...] = _patterns(os.environ.get(ONLY_ENV_VAR) or only)
+        run_globs: Tuple[str, ...] = _patterns(os.environ.get(ONLY_RUNS_ENV_VAR) or only_runs)
+        if not keypath_globs and not run_globs:
+            return None
+        return cls(tuple(tuple(glob.split('.')) for glob in keypath_globs), run_globs)
+
+    def includes_run(self, run_name: str) -> bool:
+        return not self.run_globs or any(fnmatchcase(run_name, glob) for glob in self.run_globs)
+
+    def _matches_prefix(self, keypath: Sequence[str], glob: Tuple[str, ...]) -> bool:
+        return all(fnmatchcase(key, pattern) for key, pattern in zip(keypath, glob))
+
+    def includes_keypath(self, keypath: Sequence[str]) -> bool:
+        return not self.keypath_globs or any(
+            len(keypath) >= len(glob) and self._matches_prefix(keypath, glob) for glob in self.keypath_globs)
+
+    def includes_entry(self, gen_node: FileGenNode, run_entry: FileGenRunEntry) -> bool:
+        return self.includes_run(run_entry.run_data.run_def.name)
+
+    def includes_genref(self, run_name: str, dotted_keypath: str) -> bool:
+        return self.includes_run(run_name) and self.includes_keypath(dotted_keypath.split('.'))
+
+    def _leads_to_match(self, keypath: Sequence[str]) -> bool:
+        return any(self._matches_prefix(keypath, glob) for glob in self.keypath_globs)
+
+    def _prune(self, node: GenKeyNode, keypath: Tuple[str, ...]) -> Optional[GenKeyNode]:
+        if self.includes_keypath(keypath):
+            return node
+        if not self._leads_to_match(keypath):
+            return None
+        children: Dict[str, GenKeyNode] = {}
+        for key, child in node.children.items():
+            pruned: Optional[GenKeyNode] = self._prune(child, (*keypath, key))
+            if pruned is not None:
+                children[key] = pruned
+        return GenKeyNode(node.key, children) if children else None
+
+    def prune_key_roots(self, key_roots: GenKeyRoots) -> GenKeyRoots:
+        """Selected subtrees and the ancestors leading to them; selected
+        subtrees are shared with *key_roots*, not copied.
+        """
+        roots: Dict[str, GenKeyNode] = {}
+        for key, node in key_roots.roots.items():
+            pruned: Optional[GenKeyNode] = self._prune(node, (key,))
+            if pruned is not None:
+                roots[key] = pruned
+        return GenKeyRoots(roots)
+
+    def apply(self, run_defs: List[FileGenRunDef]) -> List[FileGenRunDef]:
+        """Run definitions with pruned key trees; the originals are kept."""
+        if not self.keypath_globs:
+            return run_defs
+        return [dataclasses.replace(run_def, gen_key_roots=
+                    SubsetKeyPaths(run_def.gen_key_roots, self) if isinstance(run_def.gen_key_roots, KeyPathSource)
+                    else self.prune_key_roots(run_def.gen_key_roots))
+                for run_def in run_defs]
+
+    def apply_to_cache(self, cache: FileGenCache) -> None:
+        """Carry over the previous build's entries outside the subset, and
+        record the rendered ones under fingerprints a full build does not
+        match, as they may have read the pruned tree.
+        """
+        cache.keep_previous()
+        cache.partial = fingerprint(['\x1f'.join(self.run_globs),
+                                     *('.'.join(glob) for glob in self.keypath_globs)])
+
+    def merge_genrefs(self, previous: Dict[str, Dict[str, str]], genrefs: Dict[str, Dict[str, str]]) -> None:
+        """Keep the previous build's genrefs to docs outside the subset,
+        which stay on disk untouched.
+        """
+        for run_name, refs in previous.items():
+            for dotted_keypath, docname in refs.items():
+                if not self.includes_genref(run_name, dotted_keypath):
+                    genrefs.setdefault(run_name, {}).setdefault(dotted_keypath, docname)
+
+
+@dataclass
+class SubsetKeyPaths(KeyPathSource):
+    """The key paths of *source* selected by *subset*, in source order."""
+    source: KeyPathSource
+    subset: GenSubset
+    prefix: Tuple[str, ...] = ()
+
+    def source_keypaths(self) -> Iterator[KeyPath]:
+        return (keypath for keypath in self.source if self.subset.includes_keypath(keypath))
@@ -4,14 +4,19 @@ from typing import ForwardRef
 from typing import cast
 
 from dataclasses import dataclass
+from pathlib import Path
 
-from jinja2 import Template
+from jinja2 import FileSystemBytecodeCache
 from jinja2.sandbox import SandboxedEnvironment
 from sphinx.application import Sphinx
 # from sphinx.util.osutil import ensuredir
 from sphinx.util.logging import getLogger
 from sphinx.jinja2glue import BuiltinTemplateLoader
 
+from .fragcache import FragmentCacheExtension
+
+BYTECODE_CACHE_DIRNAME = 'jinjagen_bytecode'
+
 
 class JinjaEnvFactory(Protocol):
 
@@ -26,11 +31,39 @@ class BuiltinTemplateLoaderEnvFactory(JinjaEnvFactory):
     def build_env(self, app: Sphinx) -> SandboxedEnvironment:
         template_loader = BuiltinTemplateLoader()
         template_loader.init(app.builder) #type: ignore
-        return SandboxedEnvironment(loader=template_loader)
+        env = SandboxedEnvironment(loader=template_loader, extensions=[FragmentCacheExtension])
+        env.fragment_cache_size = app.config.jinjagen_fragment_cache_size # type: ignore
+        return env
         # env.filters.update(conf.jinja_filters)
         # env.tests.update(conf.jinja_tests)
         # env.globals.update(conf.jinja_globals)
         # env.policies.update(conf.jinja_policies)
 
+    # the config value is compared with the pickled one from the last build;
+    # without this every build would count as a config change and re-read all docs
+    def __eq__(self, other: object) -> bool:
+        return type(other) is type(self)
+
+    def __hash__(self) -> int:
+        return hash(type(self))
+
 
     
+
+
+def bytecode_cache_dir(app: Sphinx) -> Path:
+    return Path(app.doctreedir, BYTECODE_CACHE_DIRNAME)
+
+
+def build_env_with_bytecode_cache(env_factory: JinjaEnvFactory, app: Sphinx) -> SandboxedEnvironment:
+    """Build the factory's env and give it an on-disk bytecode cache under
+    the doctree dir, unless the factory configured its own. Jinja checks
+    each cached entry against a checksum of the template source, so edited
+    templates are recompiled.
+    """
+    env: SandboxedEnvironment = env_factory.build_env(app)
+    if env.bytecode_cache is None:
+        cache_dir: Path = bytecode_cache_dir(app)
+        cache_dir.mkdir(exist_ok=True, parents=True)
+        env.bytecode_cache = FileSystemBytecodeCache(str(cache_dir))
+    return env
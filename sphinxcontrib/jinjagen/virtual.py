@@ -0,0 +1,136 @@
+from __future__ import annotations
+from typing import Any, Callable, List, Dict, Set, Optional
+
+import os
+import time
+from io import StringIO
+from pathlib import Path
+
+from sphinx.application import Sphinx
+from sphinx.environment import BuildEnvironment
+from sphinx.io import SphinxFileInput
+
+from .cache import FileGenCache
+from .filegen2 import (FileContext, FileGenRoots, FileGenRunEntry, gen_tree_run_entries,
+                       render_and_write_run_entry)
+from .stats import FileGenWriteStats
+
+
+class VirtualDocs:
+    """Generated documents kept in memory instead of being written to srcdir.
+
+    ``collect`` is used as the tree renderer: every entry inside srcdir
+    becomes a docname whose source is handed to Sphinx by
+    ``VirtualSourceInput`` when the doc is read. With *deferred* set the
+    render itself waits until then, otherwise changed docs are rendered
+    up front. Entries outside srcdir are still written to disk.
+    """
+
+    def __init__(self, src_dir: str, doc2path: Callable[[str], Any], deferred: bool = True) -> None:
+        self.src_dir: str = src_dir
+        self.doc2path: Callable[[str], Any] = doc2path
+        self.deferred: bool = deferred
+        self.contexts: Dict[str, FileContext] = {}
+        self.contents: Dict[str, str] = {}
+        self.docname_by_source: Dict[str, str] = {}
+        self.changed: Set[str] = set()
+
+    def collect(self, gen_roots: FileGenRoots,
+        cache: Optional[FileGenCache] = None) -> FileGenWriteStats:
+        stats: FileGenWriteStats = FileGenWriteStats()
+        for gen_node, run_entry in gen_tree_run_entries(gen_roots):
+            name: str = run_entry.run_data.run_def.name
+            docname: Optional[str] = run_entry.docname(self.src_dir)
+            if docname is None:
+                render_and_write_run_entry(gen_roots, gen_node, name, run_entry, stats, cache)
+                continue
+
+            self.contexts[docname] = FileContext(gen_node, gen_roots, run_entry)
+            self.docname_by_source[os.fspath(self.doc2path(docname))] = docname
+            stats.virtual += 1
+            if cache is not None:
+                entry_fingerprint: str = cache.entry_fingerprint(
+                    name, gen_node.from_root_keypath(include_self=True))
+                cache.record(run_entry.filepath, entry_fingerprint)
+                if cache.is_unchanged(run_entry.filepath, entry_fingerprint):
+                    continue
+            self.changed.add(docname)
+            if not self.deferred:
+                self._render(docname, stats)
+        return stats
+
+    def _render(self, docname: str, stats: Optional[FileGenWriteStats] = None) -> str:
+        file_context: FileContext = self.contexts[docname]
+        run_entry: FileGenRunEntry = file_context.gen_run_entry
+        render_start: float = time.perf_counter()
+        content: str = file_context.render()
+        if stats is not None:
+            stats.record_timing(run_entry.run_data.run_def.name,
+                run_entry.run_data.run_def.template_filepath,
+                str(run_entry.filepath),
+                time.perf_counter() - render_start,
+                0.0)
+        self.contents[docname] = content
+        return content
+
+    def source(self, source_path: str) -> Optional[str]:
+        """Content of the virtual doc read from *source_path*, if it is one."""
+        docname: Optional[str] = self.docname_by_source.get(source_path)
+        if docname is None:
+            return None
+        content: Optional[str] = self.contents.pop(docname, None)
+        return content if content is not None else self._render(docname)
+
+
+# set in builder-inited; docutils creates the source input without access to the app
+_active: Optional[VirtualDocs] = None
+
+
+def activate(virtual_docs: Optional[VirtualDocs]) -> None:
+    global _active
+    _active = virtual_docs
+
+
+class VirtualSourceInput(SphinxFileInput):
+    """SphinxFileInput reading virtual docs from memory and everything else from disk."""
+
+    def __init__(self, *args: Any, **kwargs: Any) -> None:
+        if _active is not None and kwargs.get('source') is None and kwargs.get('source_path'):
+            content: Optional[str] = _active.source(os.fspath(kwargs['source_path']))
+            if content is not None:
+                kwargs['source'] = StringIO(content)
+        super().__init__(*args, **kwargs)
+
+
+def install_source_input(app: Sphinx) -> bool:
+    """Have the publishers of every source filetype read through
+    ``VirtualSourceInput``. False when this Sphinx does not cache publishers.
+    """
+    if not hasattr(app.registry, 'get_publisher'):
+        return False
+    for filetype in set(app.config.source_suffix.values()):
+        app.registry.get_publisher(app, filetype).source_class = VirtualSourceInput
+    return True
+
+
+def env_get_outdated(app: Sphinx, env: BuildEnvironment,
+    added: Set[str], changed: Set[str], removed: Set[str]) -> List[str]:
+    """Register the virtual docnames, which Sphinx cannot discover in srcdir,
+    and report the ones whose generation fingerprint changed.
+    """
+    if _active is None:
+        return []
+    docnames: Set[str] = set(_active.contexts)
+    env.found_docs.update(docnames)
+    removed.difference_update(docnames)
+    added.update(docnames - set(env.all_docs))
+    outdated: Set[str] = {docname for docname in docnames
+        if not Path(env.doctreedir, f'{docname}.doctree').is_file()}
+    return sorted(_active.changed | outdated)
+
+
+def html_page_context(app: Sphinx, pagename: str, templatename: str,
+    context: Dict[str, Any], doctree: Any) -> None:
+    # there is no source file to copy for "show source"
+    if _active is not None and pagename in _active.contexts:
+        context['sourcename'] = ''
@@ -0,0 +1,235 @@
+from __future__ import annotations
+from typing import Any, Callable, Collection, Dict, List, Mapping, Optional, Set, Tuple
+
+import argparse
+import os
+import time
+from pathlib import Path
+
+from jinja2 import Environment, TemplateNotFound
+from sphinx.application import Sphinx
+from sphinx.util.logging import getLogger
+
+from .bundle import build_trusted_env_from_runs
+from .cache import FileGenCache
+from .config import GenConfig
+from .context import GenContexts
+from .deps import TemplateDependencyGraph
+from .filegen2 import (BuildGenTree, FileGenNode, FileGenRoots, FileGenRunData, FileGenRunDef, FileGenRunEntry,
+                       add_runs_to_cache, gen_tree_from_runs, gen_tree_run_entries,
+                       render_and_write_gen_tree, render_and_write_run_entry)
+from .navigation import build_navigation
+from .shard import GenShard
+from .stats import FileGenWriteStats
+
+logger = getLogger(__name__)
+
+DEFAULT_WATCH_INTERVAL = 0.5
+
+# data file -> names of the jinjagen_contexts it feeds, None for all
+WatchFiles = Mapping[Path, Optional[Collection[str]]]
+
+
+class GenWatcher:
+    """Generation kept alive between edits. The tree, the environment with
+    its compiled templates and the loaded contexts stay in memory; each
+    ``poll`` finds templates the loader reports out of date and data files
+    whose mtime changed, and re-renders only the entries they affect.
+
+    Changes to run definitions or key paths are not picked up; restart.
+    Trusted runs render from *trusted_env*, whose bundle is recompiled in
+    *bundle_dir* when their templates change.
+    """
+
+    def __init__(self,
+        template_env: Environment,
+        run_defs: List[FileGenRunDef],
+        src_dir: str,
+        contexts: Optional[GenContexts] = None,
+        watch_files: Optional[WatchFiles] = None,
+        build_gen_tree: BuildGenTree = gen_tree_from_runs,
+        navigation: bool = False,
+        trusted_env: Optional[Environment] = None,
+        bundle_dir: Optional[Path] = None,
+        shard: Optional[GenShard] = None,
+        entry_filter: Optional[Callable[[FileGenNode, FileGenRunEntry], bool]] = None) -> None:
+        self.template_env: Environment = template_env
+        self.run_defs: List[FileGenRunDef] = run_defs
+        self.src_dir: str = src_dir
+        self.contexts: Optional[GenContexts] = contexts
+        self.watch_files: WatchFiles = watch_files or {}
+        self.build_gen_tree: BuildGenTree = build_gen_tree
+        self.navigation: bool = navigation
+        self.trusted_env: Optional[Environment] = trusted_env
+        self.bundle_dir: Optional[Path] = bundle_dir
+        self.shard: Optional[GenShard] = shard
+        self.entry_filter: Optional[Callable[[FileGenNode, FileGenRunEntry], bool]] = entry_filter
+        self.gen_roots: Optional[FileGenRoots] = None
+        self.graph: TemplateDependencyGraph = TemplateDependencyGraph()
+        self._runs: Dict[str, FileGenRunData] = {}
+        self._uptodate: Dict[str, Callable[[], bool]] = {}
+        self._mtimes: Dict[Path, Optional[int]] = {}
+
+    @classmethod
+    def from_app(cls, app: Sphinx, config: Optional[GenConfig] = None) -> GenWatcher:
+        """Set up like builder-inited, e.g. for the same subset and shard."""
+        config = config if config is not None else GenConfig.from_app(app)
+        watch_files: Dict[Path, Optional[Collection[str]]] = {
+            Path(app.confdir, path): names for path, names in app.config.jinjagen_watch_files.items()}
+        return cls(config.template_env,
+            config.run_defs,
+            str(app.srcdir),
+            config.contexts,
+            watch_files,
+            config.build_gen_tree,
+            app.config.jinjagen_navigation,
+            config.trusted_env,
+            Path(app.doctreedir),
+            config.shard,
+            config.entry_filter)
+
+    def _run_env(self, run_def: FileGenRunDef) -> Environment:
+        return self.trusted_env if run_def.trusted and self.trusted_env is not None else self.template_env
+
+    def build(self, cache: Optional[FileGenCache] = None) -> FileGenWriteStats:
+        """Build the tree and render everything, skipping outputs *cache*
+        knows to be up to date.
+        """
+        self.graph = TemplateDependencyGraph.build(self.template_env, self.run_defs)
+        if cache is not None:
+            cache.template_graph = self.graph
+            add_runs_to_cache(cache, self.run_defs, self.contexts)
+        runs: List[FileGenRunData] = [run_def.create_run_data(self._run_env(run_def))
+                                      for run_def in self.run_defs]
+        self._runs = {run_data.run_def.name: run_data for run_data in runs}
+        self.gen_roots = self.build_gen_tree(self.src_dir, runs)
+        self.gen_roots.contexts = self.contexts
+        self.gen_roots.entry_filter = self.entry_filter
+        if self.shard is not None:
+            self.shard.apply(self.gen_roots, cache)
+        if self.navigation:
+            self.gen_roots.navigation = build_navigation(self.gen_roots, self.src_dir)
+        self._snapshot_templates(self.graph.digests)
+        self._mtimes = {path: self._mtime(path) for path in self.watch_files}
+
+        stats: FileGenWriteStats = render_and_write_gen_tree(self.gen_roots, cache)
+        if cache is not None:
+            cache.save()
+        return stats
+
+    def _snapshot_templates(self, names: Collection[str]) -> None:
+        for name in names:
+            try:
+                _, _, uptodate = self.template_env.loader.get_source(self.template_env, name) # type: ignore
+            except TemplateNotFound:
+                self._uptodate.pop(name, None)
+                continue
+            # no uptodate means the loader never reloads it
+            self._uptodate[name] = uptodate if uptodate is not None else lambda: True
+
+    @staticmethod
+    def _mtime(path: Path) -> Optional[int]:
+        try:
+            return os.stat(path).st_mtime_ns
+        except FileNotFoundError:
+            return None
+
+    def changed_templates(self) -> Set[str]:
+        changed: Set[str] = {name for name, uptodate in self._uptodate.items() if not uptodate()}
+        # a template missing before may have been added
+        for name in self.graph.missing:
+            try:
+                self.template_env.loader.get_source(self.template_env, name) # type: ignore
+                changed.add(name)
+            except TemplateNotFound:
+                pass
+        return changed
+
+    def changed_files(self) -> Set[Path]:
+        return {path for path, mtime in self._mtimes.items() if self._mtime(path) != mtime}
+
+    def poll(self) -> Optional[FileGenWriteStats]:
+        """Re-render what changed since the last poll; None if nothing did."""
+        changed_templates: Set[str] = self.changed_templates()
+        changed_files: Set[Path] = self.changed_files()
+        if not changed_templates and not changed_files:
+            return None
+        return self.update(changed_templates, changed_files)
+
+    def update(self, changed_templates: Collection[str], changed_files: Collection[Path]) -> FileGenWriteStats:
+        assert self.gen_roots is not None, 'build() first'
+        start: float = time.perf_counter()
+        if changed_templates:
+            # edges of the edited templates may have changed too
+            self.graph = TemplateDependencyGraph.build(self.template_env, self.run_defs)
+            self._snapshot_templates(self.graph.digests)
+        runs: Set[str] = self.graph.affected_runs(changed_templates)
+        if self.trusted_env is not None and self.bundle_dir is not None \
+                and any(self._runs[run_name].run_def.trusted for run_name in runs):
+            self.trusted_env = build_trusted_env_from_runs(self.template_env, self.run_defs, self.bundle_dir)
+        for run_name in runs:
+            run_def: FileGenRunDef = self._runs[run_name].run_def
+            self._runs[run_name].template = self._run_env(run_def).get_template(run_def.template_filepath)
+
+        context_names: Set[str] = set()
+        for path in changed_files:
+            self._mtimes[path] = self._mtime(path)
+            if self.contexts is not None:
+                names: Optional[Collection[str]] = self.watch_files[path]
+                context_names.update(self.contexts.providers if names is None else names)
+        if self.contexts is not None and context_names:
+            self.contexts.invalidate(context_names)
+        # {% cache %} fragments may hold output of the old templates or data
+        for env in (self.template_env, self.trusted_env):
+            fragment_cache: Optional[Dict[Any, str]] = getattr(env, 'fragment_cache', None)
+            if fragment_cache is not None:
+                fragment_cache.clear()
+
+        stats: FileGenWriteStats = FileGenWriteStats()
+        for gen_node, run_entry in gen_tree_run_entries(self.gen_roots):
+            run_name: str = run_entry.run_data.run_def.name
+            if run_name in runs or self._uses_contexts(gen_node, run_name, context_names):
+                render_and_write_run_entry(self.gen_roots, gen_node, run_name, run_entry, stats)
+        logger.info('jinjagen: %d files written, %d unchanged in %.3fs',
+            stats.written, stats.skipped, time.perf_counter() - start)
+        return stats
+
+    def _uses_contexts(self, gen_node: FileGenNode, run_name: str, context_names: Collection[str]) -> bool:
+        if self.contexts is None:
+            return False
+        keypath: Tuple[str, ...] = tuple(gen_node.keypath)
+        return any(self.contexts.providers[name].applies_to(run_name, keypath) for name in context_names)
+
+    def watch(self, interval: float = DEFAULT_WATCH_INTERVAL, stop: Optional[Callable[[], bool]] = None) -> None:
+        """Poll every *interval* seconds until *stop* returns true or Ctrl-C."""
+        try:
+            while stop is None or not stop():
+                try:
+                    self.poll()
+                except Exception as ex:
+                    # keep watching, the next edit of a template or data file may fix it
+                    logger.warning('jinjagen: %s: %s', type(ex).__name__, ex)
+                time.sleep(interval)
+        except KeyboardInterrupt:
+            pass
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(prog='python -m sphinxcontrib.jinjagen watch',
+        description='Regenerate jinjagen outputs as templates and data files change.')
+    parser.add_argument('sourcedir')
+    parser.add_argument('outputdir')
+    parser.add_argument('-c', dest='confdir', help='directory of conf.py, default sourcedir')
+    parser.add_argument('-d', dest='doctreedir', help='default outputdir/.doctrees')
+    parser.add_argument('-b', dest='builder', default='html')
+    args = parser.parse_args(argv)
+
+    doctreedir: str = args.doctreedir or os.path.join(args.outputdir, '.doctrees')
+    # starting sphinx runs the usual generation, which the watcher's build then finds up to date
+    app: Sphinx = Sphinx(args.sourcedir, args.confdir or args.sourcedir, args.outputdir, doctreedir, args.builder)
+    config: GenConfig = GenConfig.from_app(app)
+    watcher: GenWatcher = GenWatcher.from_app(app, config)
+    watcher.build(config.load_cache(app))
+    logger.info('jinjagen: watching templates and %d data files', len(watcher.watch_files))
+    watcher.watch(app.config.jinjagen_watch_interval)
+    return 0
@@ -0,0 +1,157 @@
+from __future__ import annotations
+from typing import Any, Iterable, List, Set, Tuple, Optional
+
+import queue
+import threading
+import time
+import traceback
+from pathlib import Path
+
+from sphinx.errors import ExtensionError
+from sphinx.util.logging import getLogger
+
+from .cache import FileGenCache
+from .filegen2 import (FileContext, FileGenNode, FileGenRoots, FileGenRunEntry, FileGenWriteStats,
+                       gen_tree_run_entries, render_to_file, write_bytes_if_changed)
+
+logger = getLogger(__name__)
+
+DEFAULT_QUEUE_SIZE = 64
+DEFAULT_WRITER_THREADS = 2
+
+# (index, written, bytes, write seconds, formatted error)
+WriteResult = Tuple[int, bool, int, float, Optional[str]]
+
+
+def output_dirs(filepaths: Iterable[Path]) -> List[Path]:
+    """Distinct parent directories of *filepaths*, parents before children."""
+    return sorted({filepath.parent for filepath in filepaths})
+
+
+def make_output_dirs(filepaths: Iterable[Path]) -> None:
+    """Create every output directory once, instead of once per file."""
+    made: Set[Path] = set()
+    for directory in output_dirs(filepaths):
+        # parents=True is only needed when the parent was not created just before
+        directory.mkdir(exist_ok=True, parents=directory.parent not in made)
+        made.add(directory)
+
+
+class AsyncFileWriter:
+    """Writes rendered outputs from a bounded queue on *threads* writer
+    threads, so rendering continues while files are written. ``submit``
+    blocks once *queue_size* outputs are waiting, bounding the rendered
+    content held in memory. Writes are atomic and skip unchanged files;
+    output directories must already exist.
+    """
+
+    def __init__(self, queue_size: int = DEFAULT_QUEUE_SIZE, threads: int = DEFAULT_WRITER_THREADS) -> None:
+        self._queue: queue.Queue[Optional[Tuple[int, Path, bytes]]] = queue.Queue(max(1, queue_size))
+        self.results: List[WriteResult] = []
+        self._threads: List[threading.Thread] = [
+            threading.Thread(target=self._drain, name=f'jinjagen-writer-{i}', daemon=True)
+            for i in range(max(1, threads))]
+        for thread in self._threads:
+            thread.start()
+
+    def _drain(self) -> None:
+        while True:
+            item: Optional[Tuple[int, Path, bytes]] = self._queue.get()
+            if item is None:
+                return
+            index, filepath, encoded = item
+            write_start: float = time.perf_counter()
+            try:
+                written: bool = write_bytes_if_changed(filepath, encoded, make_parents=False, atomic=True)
+                self.results.append(
+                    (index, written, len(encoded), time.perf_counter() - write_start, None))
+            except Exception:
+                self.results.append((index, False, 0, 0.0, traceback.format_exc()))
+
+    def submit(self, index: int, filepath: Path, encoded: bytes) -> None:
+        self._queue.put((index, filepath, encoded))
+
+    def close(self) -> List[WriteResult]:
+        """Wait for queued writes to finish; results are in submit order."""
+        for _ in self._threads:
+            self._queue.put(None)
+        for thread in self._threads:
+            thread.join()
+        return sorted(self.results)
+
+    def __enter__(self) -> AsyncFileWriter:
+        return self
+
+    def __exit__(self, *exc_info: Any) -> None:
+        self.close()
+
+
+def render_and_write_gen_tree_async(
+    gen_roots: FileGenRoots,
+    cache: Optional[FileGenCache] = None,
+    queue_size: int = DEFAULT_QUEUE_SIZE,
+    threads: int = DEFAULT_WRITER_THREADS) -> FileGenWriteStats:
+    """Render the tree's run entries in this thread while an
+    ``AsyncFileWriter`` writes them. Streaming runs write as they render.
+    Results and errors are reported in tree order.
+    """
+    stats: FileGenWriteStats = FileGenWriteStats()
+    pending: List[Tuple[FileGenNode, FileGenRunEntry, Optional[str]]] = []
+    for gen_node, run_entry in gen_tree_run_entries(gen_roots):
+        entry_fingerprint: Optional[str] = None
+        if cache is not None:
+            entry_fingerprint = cache.entry_fingerprint(
+                run_entry.run_data.run_def.name, gen_node.from_root_keypath(include_self=True))
+            if cache.is_fresh(run_entry.filepath, entry_fingerprint):
+                cache.record(run_entry.filepath, entry_fingerprint)
+                stats.cached += 1
+                continue
+        pending.append((gen_node, run_entry, entry_fingerprint))
+
+    if not pending:
+        return stats
+    make_output_dirs(run_entry.filepath for _, run_entry, _ in pending)
+
+    render_seconds: List[float] = [0.0] * len(pending)
+    results: List[WriteResult] = []
+    with AsyncFileWriter(queue_size, threads) as writer:
+        for index, (gen_node, run_entry, _) in enumerate(pending):
+            file_context: FileContext = FileContext(gen_node, gen_roots, run_entry)
+            try:
+                if run_entry.run_data.run_def.streaming:
+                    written, nbytes, render_seconds[index], write_seconds = render_to_file(
+                        file_context.get_render_kwargs(),
+                        run_entry.run_data.template,
+                        run_entry.filepath,
+                        streaming=True,
+                        make_parents=False)
+                    results.append((index, written, nbytes, write_seconds, None))
+                    continue
+                render_start: float = time.perf_counter()
+                encoded: bytes = file_context.render().encode('utf-8')
+                render_seconds[index] = time.perf_counter() - render_start
+            except Exception:
+                results.append((index, False, 0, 0.0, traceback.format_exc()))
+                continue
+            writer.submit(index, run_entry.filepath, encoded)
+    results = sorted(results + writer.results)
+
+    failed: int = 0
+    for index, written, nbytes, write_seconds, error in results:
+        _, run_entry, entry_fingerprint = pending[index]
+        if error is not None:
+            logger.error('jinjagen: failed to generate %s\n%s', run_entry.filepath, error)
+            failed += 1
+            continue
+        stats.record(written, nbytes, str(run_entry.filepath))
+        stats.record_timing(run_entry.run_data.run_def.name,
+            run_entry.run_data.run_def.template_filepath,
+            str(run_entry.filepath),
+            render_seconds[index],
+            write_seconds)
+        if cache is not None and entry_fingerprint is not None:
+            cache.record(run_entry.filepath, entry_fingerprint)
+
+    if failed:
+        raise ExtensionError(f'jinjagen: failed to generate {failed} file(s)')
+    return stats
@@ -0,0 +1,31 @@
+from sphinxcontrib.jinjagen.filegen2 import FileGenRunDef, FileGenRunNameOption, GenKeyNode, GenKeyRoots
+
+extensions = ["sphinxcontrib.jinjagen"]
+exclude_patterns = ["_build"]
+
+templates_path = ['_templates']
+
+N = GenKeyNode.from_children_iter
+
+gen_key_roots_recipe: GenKeyRoots = GenKeyRoots.from_roots_iter([
+    N('gen', [
+        N('recipe_all_recipes', [N('french toast', []), N('chicken speedie', [])]),
+        N('recipe_youtube', [N('columbian stew', [])])
+    ])
+])
+
+gen_key_roots_recipe_source: GenKeyRoots = GenKeyRoots.from_roots_iter([
+    N('gen', [N('recipe_all_recipes', []), N('recipe_youtube', []), N('recipe_serious', [])])
+])
+
+# not a source suffix, so no documents
+gen_key_roots_plain: GenKeyRoots = GenKeyRoots.from_roots_iter([N('gen', [N('plain', [])])])
+
+jinjagen_runs = [
+    FileGenRunDef(gen_key_roots_recipe, 'recipe.rst', 'recipe.jinja', 'rst',
+                  FileGenRunNameOption.ALL_KEYS_DIRS, None),
+    FileGenRunDef(gen_key_roots_recipe_source, 'recipe_source.rst', 'recipe_source.jinja', 'rst',
+                  FileGenRunNameOption.ALL_KEYS_DIRS, None),
+    FileGenRunDef(gen_key_roots_plain, 'plain.txt', 'recipe.jinja', 'txt',
+                  FileGenRunNameOption.ALL_KEYS_DIRS, None),
+]
@@ -0,0 +1,955 @@
+import os
+import sqlite3
+import time
+from pathlib import Path
+
+import pytest
+from jinja2 import DictLoader, FunctionLoader, StrictUndefined, UndefinedError
+from jinja2.sandbox import SandboxedEnvironment
+from sphinx.errors import ExtensionError
+
+from sphinxcontrib.jinjagen.bundle import build_trusted_env_from_runs
+from sphinxcontrib.jinjagen.bulk import gen_tree_from_keypaths, gen_tree_from_runs_fused
+from sphinxcontrib.jinjagen.cache import FileGenCache
+from sphinxcontrib.jinjagen.compact import CompactGenRoots, gen_compact_tree_from_runs
+from sphinxcontrib.jinjagen.deps import TEMPLATE_GRAPH_FILENAME, TemplateDependencyGraph
+from sphinxcontrib.jinjagen.filegen2 import (FileGenRunDef, FileGenRunNameOption, GenKeyNode,
+                                             GenKeyRoots, add_runs_to_cache, gen_tree_from_runs,
+                                             gen_tree_run_entries, gen_from_run_defs,
+                                             render_and_write_gen_tree, write_chunks_if_changed,
+                                             write_if_changed)
+from sphinxcontrib.jinjagen.context import ContextProvider, GenContexts, JinjagenContextBase
+from sphinxcontrib.jinjagen.fragcache import FragmentCacheExtension
+from sphinxcontrib.jinjagen.incremental import remove_stale_outputs
+from sphinxcontrib.jinjagen.navigation import build_navigation
+from sphinxcontrib.jinjagen.parallel import render_and_write_gen_tree_parallel
+from sphinxcontrib.jinjagen.shard import GenShard, merge_shard_manifests
+from sphinxcontrib.jinjagen.pipeline import stream_from_run_defs
+from sphinxcontrib.jinjagen.sql import SqlContextProvider, SqlKeyPaths, sqlite_pool
+from sphinxcontrib.jinjagen.subset import GenSubset
+from sphinxcontrib.jinjagen.sources import CsvKeyPaths, IterableKeyPaths, JsonlKeyPaths, KeyPathSource
+from sphinxcontrib.jinjagen.virtual import VirtualDocs
+from sphinxcontrib.jinjagen.watch import GenWatcher
+from sphinxcontrib.jinjagen.writer import output_dirs, render_and_write_gen_tree_async
+
+
+def make_env(templates):
+    return SandboxedEnvironment(loader=DictLoader(templates))
+
+
+def make_run_def(name, template_filepath, keys):
+    key_roots = GenKeyRoots.from_roots_iter([GenKeyNode.from_children_iter(
+        'gen', [GenKeyNode.from_children_iter(k, []) for k in keys])])
+    return FileGenRunDef(key_roots, name, template_filepath, 'rst',
+                         FileGenRunNameOption.ALL_KEYS_DIRS, None)
+
+
+def add_runs(cache, template_env, run_defs):
+    cache.template_graph = TemplateDependencyGraph.build(template_env, run_defs)
+    add_runs_to_cache(cache, run_defs)
+
+
+def build(template_env, run_defs, base_dir, cache=None):
+    if cache is not None:
+        add_runs(cache, template_env, run_defs)
+    runs = [run_def.create_run_data(template_env) for run_def in run_defs]
+    return render_and_write_gen_tree(gen_tree_from_runs(base_dir, runs), cache)
+
+
+def test_write_if_changed_keeps_mtime(tmp_path: Path):
+    filepath = tmp_path / 'gen' / 'recipe'
+
+    assert write_if_changed(filepath, 'Recipe\nstew')
+    mtime_ns = filepath.stat().st_mtime_ns
+
+    assert not write_if_changed(filepath, 'Recipe\nstew')
+    assert filepath.stat().st_mtime_ns == mtime_ns
+
+    assert write_if_changed(filepath, 'Recipe\nmeatball')
+    assert filepath.read_text() == 'Recipe\nmeatball'
+
+
+def test_cache_renders_only_changed_entries(tmp_path: Path):
+    templates = {
+        'recipe.jinja': '{% include "header.jinja" %}{{ gen_run_entry.gen_key }}',
+        'header.jinja': 'Recipe\n',
+    }
+    run_defs = [make_run_def('recipe', 'recipe.jinja', ['stew', 'meatball'])]
+    manifest_path = tmp_path / 'doctrees' / 'manifest.json'
+    out_dir = str(tmp_path / 'out')
+
+    assert TemplateDependencyGraph.build(make_env(templates), run_defs).dependencies('recipe.jinja') == \
+        ['header.jinja', 'recipe.jinja']
+
+    cache = FileGenCache.load(manifest_path)
+    assert build(make_env(templates), run_defs, out_dir, cache).written == 2
+    cache.save()
+
+    cache = FileGenCache.load(manifest_path)
+    stats = build(make_env(templates), run_defs, out_dir, cache)
+    assert (stats.written, stats.cached) == (0, 2)
+    cache.save()
+
+    templates['header.jinja'] = 'Recipe!\n'
+    cache = FileGenCache.load(manifest_path)
+    assert build(make_env(templates), run_defs, out_dir, cache).written == 2
+    cache.save()
+
+    cache = FileGenCache.load(manifest_path, force=True)
+    stats = build(make_env(templates), run_defs, out_dir, cache)
+    assert (stats.skipped, stats.cached) == (2, 0)
+
+
+def test_cache_tracks_missing_optional_templates(tmp_path: Path):
+    templates = {'recipe.jinja': '{% include "optional.jinja" ignore missing %}{{ gen_run_entry.gen_key }}'}
+    run_defs = [make_run_def('recipe', 'recipe.jinja', ['stew'])]
+    manifest_path = tmp_path / 'doctrees' / 'manifest.json'
+    out_dir = tmp_path / 'out'
+
+    graph = TemplateDependencyGraph.build(make_env(templates), run_defs)
+    assert graph.missing == {'optional.jinja'}
+    assert graph.dependencies('recipe.jinja') == ['recipe.jinja']
+
+    cache = FileGenCache.load(manifest_path)
+    assert build(make_env(templates), run_defs, str(out_dir), cache).written == 1
+    cache.save()
+    cache = FileGenCache.load(manifest_path)
+    assert build(make_env(templates), run_defs, str(out_dir), cache).cached == 1
+    cache.save()
+
+    templates['optional.jinja'] = 'Recipe '
+    cache = FileGenCache.load(manifest_path)
+    assert build(make_env(templates), run_defs, str(out_dir), cache).written == 1
+    assert (out_dir / 'gen' / 'stew' / 'recipe').read_text() == 'Recipe stew'
+
+
+def test_cache_rerenders_dynamic_includes(tmp_path: Path):
+    templates = {'recipe.jinja': '{% include gen_node.key ~ ".jinja" %}', 'stew.jinja': 'v1',
+                 'source.jinja': '{% include "stew.jinja" %}'}
+    run_defs = [make_run_def('recipe', 'recipe.jinja', ['stew']), make_run_def('source', 'source.jinja', ['stew'])]
+    manifest_path = tmp_path / 'doctrees' / 'manifest.json'
+    out_dir = tmp_path / 'out'
+
+    graph = TemplateDependencyGraph.build(make_env(templates), run_defs)
+    assert graph.is_dynamic('recipe.jinja') and not graph.is_dynamic('source.jinja')
+    assert graph.dependencies('recipe.jinja') == ['recipe.jinja', 'source.jinja', 'stew.jinja']
+
+    cache = FileGenCache.load(manifest_path)
+    build(make_env(templates), run_defs, str(out_dir), cache)
+    cache.save()
+    cache = FileGenCache.load(manifest_path)
+    assert build(make_env(templates), run_defs, str(out_dir), cache).cached == 1
+    cache.save()
+
+    # without the source run, the graph does not know stew.jinja at all
+    cache = FileGenCache.load(manifest_path)
+    build(make_env(templates), run_defs[:1], str(out_dir), cache)
+    cache.save()
+    templates['stew.jinja'] = 'v2'
+    cache = FileGenCache.load(manifest_path)
+    build(make_env(templates), run_defs[:1], str(out_dir), cache)
+    assert (out_dir / 'gen' / 'stew' / 'recipe').read_text() == 'v2'
+
+
+class NoSourceLoader(DictLoader):
+    has_source_access = False
+
+    def get_source(self, environment, template):
+        raise RuntimeError('no source')
+
+    def load(self, environment, name, globals=None):
+        return environment.from_string(self.mapping[name], globals)
+
+
+def test_cache_rerenders_templates_without_source(tmp_path: Path):
+    templates = {'recipe.jinja': '{{ gen_run_entry.gen_key }}'}
+    run_defs = [make_run_def('recipe', 'recipe.jinja', ['stew'])]
+    manifest_path = tmp_path / 'doctrees' / 'manifest.json'
+
+    for _ in range(2):
+        cache = FileGenCache.load(manifest_path)
+        stats = build(SandboxedEnvironment(loader=NoSourceLoader(templates)), run_defs, str(tmp_path / 'out'), cache)
+        cache.save()
+        assert stats.cached == 0
+        assert cache.volatile_runs == {'recipe'}
+
+
+def test_cache_rerenders_when_key_set_changes(tmp_path: Path):
+    templates = {'recipe.jinja': '{% for k in gen_node.parent.children %}{{ k }} {% endfor %}'}
+    manifest_path = tmp_path / 'doctrees' / 'manifest.json'
+    out_dir = tmp_path / 'out'
+
+    cache = FileGenCache.load(manifest_path)
+    build(make_env(templates), [make_run_def('recipe', 'recipe.jinja', ['stew'])], str(out_dir), cache)
+    cache.save()
+
+    cache = FileGenCache.load(manifest_path)
+    stats = build(make_env(templates), [make_run_def('recipe', 'recipe.jinja', ['stew', 'toast'])],
+                  str(out_dir), cache)
+    assert (stats.written, stats.cached) == (2, 0)
+    assert (out_dir / 'gen' / 'stew' / 'recipe').read_text() == 'stew toast '
+
+
+def test_parallel_render_matches_serial(tmp_path: Path):
+    templates = {'recipe.jinja': '{{ gen_run_entry.gen_key }} {{ gen_node.parent.key }}'}
+    keys = [f'dish{i}' for i in range(20)]
+    run_defs = [make_run_def('recipe', 'recipe.jinja', keys)]
+    runs = [run_def.create_run_data(make_env(templates)) for run_def in run_defs]
+
+    stats = render_and_write_gen_tree_parallel(
+        gen_tree_from_runs(str(tmp_path), runs),
+        env_builder=lambda: make_env(templates),
+        jobs=3)
+
+    assert stats.written == 20
+    assert (tmp_path / 'gen' / 'dish7' / 'recipe').read_text() == 'dish7 gen'
+
+
+def test_trusted_bundle_renders_like_sandbox(tmp_path: Path):
+    templates = {
+        'recipe.jinja': '{% extends "base.jinja" %}{% block body %}{{ gen_run_entry.gen_key }}{% endblock %}',
+        'base.jinja': 'Recipe {% block body %}{% endblock %}',
+        'unused.jinja': '{{ broken',
+    }
+    run_def = make_run_def('recipe', 'recipe.jinja', ['stew'])
+    run_def.trusted = True
+
+    trusted_env = build_trusted_env_from_runs(make_env(templates), [run_def], tmp_path)
+    bundles = list(tmp_path.glob('*.zip'))
+
+    assert not isinstance(trusted_env, SandboxedEnvironment)
+    assert trusted_env.get_template('recipe.jinja').render(gen_run_entry={'gen_key': 'stew'}) == \
+        'Recipe stew'
+    build_trusted_env_from_runs(make_env(templates), [run_def], tmp_path)
+    assert list(tmp_path.glob('*.zip')) == bundles
+
+
+def test_trusted_bundle_without_list_templates(tmp_path: Path):
+    templates = {
+        'recipe.jinja': '{% include "header.jinja" %}{{ gen_run_entry.gen_key }}',
+        'header.jinja': 'Recipe ',
+    }
+    run_def = make_run_def('recipe', 'recipe.jinja', ['stew'])
+    run_def.trusted = True
+    # like Sphinx's BuiltinTemplateLoader, cannot list its templates
+    template_env = SandboxedEnvironment(loader=FunctionLoader(templates.get))
+
+    trusted_env = build_trusted_env_from_runs(template_env, [run_def], tmp_path)
+    assert trusted_env.get_template('recipe.jinja').render(gen_run_entry={'gen_key': 'stew'}) == \
+        'Recipe stew'
+
+
+def test_trusted_bundle_keeps_env_options(tmp_path: Path):
+    templates = {'recipe.jinja': '<< if gen_run_entry >>\n  [= gen_run_entry.gen_key =]\n<< endif >>\n'}
+    run_def = make_run_def('recipe', 'recipe.jinja', ['stew'])
+    run_def.trusted = True
+
+    def options_env(**options):
+        return SandboxedEnvironment(loader=DictLoader(templates), block_start_string='<<', block_end_string='>>',
+            variable_start_string='[=', variable_end_string='=]', undefined=StrictUndefined, **options)
+
+    for template_env in (options_env(), options_env(trim_blocks=True, lstrip_blocks=True,
+                                                   keep_trailing_newline=True)):
+        trusted_env = build_trusted_env_from_runs(template_env, [run_def], tmp_path)
+        entry = {'gen_key': 'stew'}
+        assert trusted_env.get_template('recipe.jinja').render(gen_run_entry=entry) == \
+            template_env.get_template('recipe.jinja').render(gen_run_entry=entry)
+        with pytest.raises(UndefinedError):
+            trusted_env.get_template('recipe.jinja').render()
+    assert len(list(tmp_path.glob('*.zip'))) == 1
+
+
+def test_compact_tree_matches_gen_tree(tmp_path: Path):
+    templates = {'recipe.jinja': '{{ gen_node.parent.key }}/{{ gen_run_entry.gen_key }}'
+                                 '{% for k in gen_node.children %}{{ k }}{% endfor %}'}
+    run_defs = [make_run_def('recipe', 'recipe.jinja', ['stew', 'meatball']),
+                make_run_def('source', 'recipe.jinja', ['stew', 'youtube'])]
+    runs = [run_def.create_run_data(make_env(templates)) for run_def in run_defs]
+
+    render_and_write_gen_tree(gen_tree_from_runs(str(tmp_path / 'a'), runs))
+    render_and_write_gen_tree(gen_compact_tree_from_runs(str(tmp_path / 'b'), runs))
+
+    def read_all(base_dir):
+        return {p.relative_to(base_dir): p.read_text() for p in base_dir.rglob('*') if p.is_file()}
+    assert read_all(tmp_path / 'a') == read_all(tmp_path / 'b')
+    assert len(read_all(tmp_path / 'b')) == 4
+
+
+def test_fused_builders_match_gen_tree():
+    templates = {'recipe.jinja': ''}
+    run_defs = [make_run_def('recipe', 'recipe.jinja', ['stew', 'meatball']),
+                make_run_def('source', 'recipe.jinja', ['youtube', 'stew'])]
+    run_defs[1].name_option = FileGenRunNameOption.PREPEND_LAST_KEY_FOR_SINGLE_ENTRY
+    runs = [run_def.create_run_data(make_env(templates)) for run_def in run_defs]
+
+    def flatten(gen_roots):
+        return [(n.key, [k for k in n.children], {name: e.filepath for name, e in n.run_entry_by_name.items()})
+                for n, _ in gen_tree_run_entries(gen_roots)]
+
+    expected = flatten(gen_tree_from_runs('out', runs))
+    assert flatten(gen_tree_from_runs_fused('out', runs)) == expected
+    assert flatten(gen_tree_from_keypaths('out', [
+        (runs[0], [('gen', 'stew'), ('gen', 'meatball')]),
+        (runs[1], [('gen', 'youtube'), ('gen', 'stew')])])) == expected
+
+
+def test_nodes_cache_keypath_and_key_dir():
+    run_def = make_run_def('recipe', 'recipe.jinja', ['stew'])
+    run_def.name_option = FileGenRunNameOption.ALWAYS_PREPEND_LAST_KEY
+    runs = [run_def.create_run_data(make_env({'recipe.jinja': ''}))]
+
+    for gen_roots in (gen_tree_from_runs('out', runs), gen_compact_tree_from_runs('out', runs)):
+        stew = gen_roots.roots['gen'].children['stew']
+        assert stew.keypath == ('gen', 'stew')
+        assert stew.keypath is stew.keypath
+        assert stew.parent.keypath == ('gen',)
+        assert list(stew.from_root_keypath(False)) == ['gen']
+        assert stew.key_dir == 'gen/stew'
+        assert stew.run_entry_by_name['recipe'].filepath == Path('out', 'gen', 'stew_recipe')
+
+
+def test_virtual_docs_render_in_memory(tmp_path: Path):
+    templates = {'recipe.jinja': 'Recipe {{ gen_run_entry.gen_key }}'}
+    run_defs = [make_run_def('recipe', 'recipe.jinja', ['stew', 'meatball'])]
+    src_dir = str(tmp_path)
+    manifest_path = tmp_path / 'doctrees' / 'manifest.json'
+
+    def collect(deferred):
+        template_env = make_env(templates)
+        cache = FileGenCache.load(manifest_path)
+        add_runs(cache, template_env, run_defs)
+        runs = [run_def.create_run_data(template_env) for run_def in run_defs]
+        virtual_docs = VirtualDocs(src_dir, lambda docname: tmp_path / f'{docname}.rst', deferred)
+        stats = virtual_docs.collect(gen_tree_from_runs(src_dir, runs), cache)
+        cache.save()
+        return virtual_docs, stats
+
+    virtual_docs, stats = collect(deferred=True)
+    assert (stats.written, stats.virtual) == (0, 2)
+    assert virtual_docs.changed == {'gen/stew/recipe', 'gen/meatball/recipe'}
+    assert not virtual_docs.contents
+    assert virtual_docs.source(str(tmp_path / 'gen' / 'stew' / 'recipe.rst')) == 'Recipe stew'
+    assert virtual_docs.source(str(tmp_path / 'index.rst')) is None
+    assert not (tmp_path / 'gen').exists()
+
+    virtual_docs, _ = collect(deferred=False)
+    assert not virtual_docs.changed and not virtual_docs.contents
+
+    templates['recipe.jinja'] = 'Recipe: {{ gen_run_entry.gen_key }}'
+    virtual_docs, _ = collect(deferred=False)
+    assert virtual_docs.contents == {'gen/stew/recipe': 'Recipe: stew',
+                                     'gen/meatball/recipe': 'Recipe: meatball'}
+
+
+def test_streaming_render_matches_render(tmp_path: Path):
+    templates = {'table.jinja': '{% for i in range(1000) %}| {{ gen_run_entry.gen_key }} | {{ i }} |\n{% endfor %}'}
+    run_defs = [make_run_def('table', 'table.jinja', ['stew', 'meatball'])]
+    stream_run_defs = [make_run_def('table', 'table.jinja', ['stew', 'meatball'])]
+    stream_run_defs[0].streaming = True
+
+    build(make_env(templates), run_defs, str(tmp_path / 'render'))
+    assert build(make_env(templates), stream_run_defs, str(tmp_path / 'stream')).written == 2
+    for filepath in (tmp_path / 'render').rglob('*'):
+        if filepath.is_file():
+            assert (tmp_path / 'stream' / filepath.relative_to(tmp_path / 'render')).read_bytes() \
+                == filepath.read_bytes()
+
+    stats = build(make_env(templates), stream_run_defs, str(tmp_path / 'stream'))
+    assert (stats.written, stats.skipped) == (0, 2)
+    assert write_chunks_if_changed(tmp_path / 'stream' / 'gen' / 'stew' / 'table', ['x']) == (True, 1)
+    assert not list((tmp_path / 'stream').rglob('*.jinjagen-tmp'))
+
+
+def test_async_writer_matches_serial(tmp_path: Path):
+    templates = {'recipe.jinja': 'Recipe {{ gen_run_entry.gen_key }}'}
+    run_defs = [make_run_def('recipe', 'recipe.jinja', [f'key{i}' for i in range(50)])]
+    template_env = make_env(templates)
+    runs = [run_def.create_run_data(template_env) for run_def in run_defs]
+
+    build(template_env, run_defs, str(tmp_path / 'serial'))
+    gen_roots = gen_tree_from_runs(str(tmp_path / 'async'), runs)
+    assert len(output_dirs(e.filepath for _, e in gen_tree_run_entries(gen_roots))) == 50
+
+    cache = FileGenCache.load(None)
+    add_runs(cache, template_env, run_defs)
+    stats = render_and_write_gen_tree_async(gen_roots, cache, queue_size=4, threads=3)
+    assert (stats.written, len(cache.current)) == (50, 50)
+    assert [f.relative_to(tmp_path / 'async') for f in sorted((tmp_path / 'async').rglob('*'))] == \
+        [f.relative_to(tmp_path / 'serial') for f in sorted((tmp_path / 'serial').rglob('*'))]
+    assert (tmp_path / 'async' / 'gen' / 'key7' / 'recipe').read_text() == 'Recipe key7'
+
+    stats = render_and_write_gen_tree_async(gen_roots, queue_size=4, threads=3)
+    assert (stats.written, stats.skipped) == (0, 50)
+
+
+def test_key_path_sources_build_same_tree(tmp_path: Path):
+    (tmp_path / 'keys.csv').write_text('source,recipe,rating\nyoutube,stew,5\nyoutube,toast,3\nserious,stew,4\n')
+    (tmp_path / 'keys.jsonl').write_text(
+        '{"source": "youtube", "recipe": "stew"}\n{"source": "youtube", "recipe": "toast"}\n\n'
+        '{"source": "serious", "recipe": "stew"}\n')
+    keypaths = [('gen', 'youtube', 'stew'), ('gen', 'youtube', 'toast'), ('gen', 'serious', 'stew')]
+    sources = [
+        CsvKeyPaths(tmp_path / 'keys.csv', ['source', 'recipe'], prefix=('gen',)),
+        JsonlKeyPaths(tmp_path / 'keys.jsonl', ['source', 'recipe'], prefix=('gen',)),
+        IterableKeyPaths(lambda: (keypath[1:] for keypath in keypaths), prefix=('gen',)),
+    ]
+    for source in sources:
+        assert list(source) == keypaths
+
+    def flatten(gen_roots):
+        return [(n.keypath, {name: e.filepath for name, e in n.run_entry_by_name.items()})
+                for n, _ in gen_tree_run_entries(gen_roots)]
+
+    template_env = make_env({'recipe.jinja': ''})
+    run_def = FileGenRunDef(sources[0], 'recipe', 'recipe.jinja', 'rst', FileGenRunNameOption.ALL_KEYS_DIRS, None)
+    runs = [run_def.create_run_data(template_env)]
+    expected = flatten(gen_tree_from_runs('out', runs))
+    assert [keypath for keypath, _ in expected if _] == keypaths
+    for source in sources:
+        run_def.gen_key_roots = source
+        assert flatten(gen_tree_from_runs_fused('out', runs)) == expected
+        assert flatten(gen_compact_tree_from_runs('out', runs)) == expected
+
+
+def test_streaming_tree_matches_built_tree(tmp_path: Path):
+    templates = {'recipe.jinja': '{{ gen_node.parent.key }}/{{ gen_run_entry.gen_key }}'
+                             '{% if gen_summary %} of {{ gen_summary.leaves }}{% endif %}'}
+    keys = [f'key{i}' for i in range(20)]
+    run_defs = [make_run_def('recipe', 'recipe.jinja', keys),
+                FileGenRunDef(IterableKeyPaths(lambda: [('gen', key) for key in sorted(keys[10:] + ['extra'])]),
+                              'source', 'recipe.jinja', 'rst', FileGenRunNameOption.ALL_KEYS_DIRS, None)]
+
+    build(make_env(templates), run_defs, str(tmp_path / 'built'))
+    held = []
+
+    def on_entry(gen_node, run_entry):
+        held.append(sum(len(n.children) for n in (gen_node.parent, gen_node) if n is not None))
+
+    summary = stream_from_run_defs(make_env(templates), run_defs, str(tmp_path / 'streamed'), on_entry=on_entry)
+    assert (summary.leaves, summary.entries_by_run) == (21, {'recipe': 20, 'source': 11})
+    assert len(held) == 31 and max(held) == 1
+
+    built = sorted(f.relative_to(tmp_path / 'built') for f in (tmp_path / 'built').rglob('*') if f.is_file())
+    streamed = sorted(f.relative_to(tmp_path / 'streamed') for f in (tmp_path / 'streamed').rglob('*') if f.is_file())
+    assert streamed == built
+    assert (tmp_path / 'built' / 'gen' / 'key3' / 'recipe').read_text() == 'gen/key3'
+    assert (tmp_path / 'streamed' / 'gen' / 'key3' / 'recipe').read_text() == 'gen/key3 of 21'
+
+
+def test_streaming_reads_key_paths_twice_with_cache(tmp_path: Path):
+    templates = {'recipe.jinja': '{{ gen_run_entry.gen_key }}'}
+    keys = ['meatball', 'stew']
+    reads = []
+
+    def keypaths():
+        reads.append(1)
+        return [('gen', key) for key in keys]
+    run_def = FileGenRunDef(IterableKeyPaths(keypaths), 'recipe', 'recipe.jinja', 'rst',
+                            FileGenRunNameOption.ALL_KEYS_DIRS, None)
+    manifest_path = tmp_path / 'doctrees' / 'manifest.json'
+
+    stream_from_run_defs(make_env(templates), [run_def], str(tmp_path), FileGenCache.load(manifest_path))
+    assert len(reads) == 2
+    cache = FileGenCache.load(manifest_path)
+    stream_from_run_defs(make_env(templates), [run_def], str(tmp_path), cache)
+    assert cache.current == cache.previous and len(cache.current) == 2
+
+    keys.append('toast')
+    cache = FileGenCache.load(manifest_path)
+    stream_from_run_defs(make_env(templates), [run_def], str(tmp_path), cache)
+    assert not set(cache.current.values()) & set(cache.previous.values())
+
+
+class OnceKeyPaths(KeyPathSource):
+    """Breaks the KeyPathSource contract by yielding its key paths once."""
+    prefix = ()
+
+    def __init__(self, keypaths):
+        self.keypaths = iter(keypaths)
+
+    def source_keypaths(self):
+        return self.keypaths
+
+
+def test_streaming_rejects_one_shot_key_paths(tmp_path: Path):
+    templates = {'recipe.jinja': '{{ gen_run_entry.gen_key }}'}
+    keypaths = [('gen', 'meatball'), ('gen', 'stew')]
+
+    with pytest.raises(ExtensionError):
+        IterableKeyPaths(iter(keypaths))
+    with pytest.raises(ExtensionError):
+        IterableKeyPaths(keypath for keypath in keypaths)
+
+    run_def = FileGenRunDef(OnceKeyPaths(keypaths), 'recipe', 'recipe.jinja', 'rst',
+                            FileGenRunNameOption.ALL_KEYS_DIRS, None)
+    with pytest.raises(ExtensionError, match='2 key paths to summarize and 0 to render'):
+        stream_from_run_defs(make_env(templates), [run_def], str(tmp_path))
+
+
+def test_navigation_summaries(tmp_path: Path):
+    templates = {'recipe.jinja': '{{ gen_nav.parent.key }}:{{ gen_nav.index }}/{{ gen_nav.siblings|length }}'
+                                 '{% if gen_nav.next %} next {{ gen_nav.next.docnames.recipe }}{% endif %}'}
+    run_defs = [make_run_def('recipe', 'recipe.jinja', ['stew', 'meatball', 'toast']),
+                make_run_def('source', 'recipe.jinja', ['toast'])]
+    template_env = make_env(templates)
+    runs = [run_def.create_run_data(template_env) for run_def in run_defs]
+    gen_roots = gen_tree_from_runs(str(tmp_path), runs)
+    gen_roots.navigation = build_navigation(gen_roots, str(tmp_path))
+
+    root_nav = gen_roots.navigation.roots[0]
+    assert [nav.key for nav in root_nav.children] == ['stew', 'meatball', 'toast']
+    assert (root_nav.descendants, root_nav.subtree_entries_by_run) == (3, {'recipe': 3, 'source': 1})
+    toast_nav = gen_roots.navigation.for_node(gen_roots.roots['gen'].children['toast'])
+    assert [nav.key for nav in toast_nav.ancestors] == ['gen']
+    assert toast_nav.previous.key == 'meatball' and toast_nav.next is None
+    assert toast_nav.docnames == {'recipe': 'gen/toast/recipe', 'source': 'gen/toast/source'}
+
+    compact_roots = gen_compact_tree_from_runs(str(tmp_path), runs)
+    compact_roots.navigation = build_navigation(compact_roots, str(tmp_path))
+    assert gen_roots.navigation.for_node(compact_roots.roots['gen']).descendants == 3
+
+    render_and_write_gen_tree(gen_roots)
+    assert (tmp_path / 'gen' / 'meatball' / 'recipe').read_text() == 'gen:1/3 next gen/toast/recipe'
+
+
+def test_navigation_rerenders_when_neighbours_change(tmp_path: Path):
+    templates = {'recipe.jinja': '{{ gen_nav.docnames|dictsort|map("last")|join(" ") }}'
+                                 '{% if gen_nav.next %} next {{ gen_nav.next.key }}{% endif %}',
+                 'source.jinja': 'source'}
+    manifest_path = tmp_path / 'doctrees' / 'manifest.json'
+
+    def gen(recipe_keys, source_name_option):
+        source_run_def = make_run_def('source', 'source.jinja', ['stew'])
+        source_run_def.name_option = source_name_option
+        cache = FileGenCache.load(manifest_path)
+        run_defs = [make_run_def('recipe', 'recipe.jinja', recipe_keys), source_run_def]
+        gen_from_run_defs(make_env(templates), run_defs, str(tmp_path), cache, navigation=True)
+        return (tmp_path / 'gen' / 'stew' / 'recipe').read_text()
+
+    assert gen(['stew'], FileGenRunNameOption.ALL_KEYS_DIRS) == 'gen/stew/recipe gen/stew/source'
+    assert gen(['stew', 'toast'], FileGenRunNameOption.ALL_KEYS_DIRS) == \
+        'gen/stew/recipe gen/stew/source next toast'
+    assert gen(['stew', 'toast'], FileGenRunNameOption.ALWAYS_PREPEND_LAST_KEY) == \
+        'gen/stew/recipe gen/stew_source next toast'
+
+
+def test_fragment_cache_scopes(tmp_path: Path):
+    templates = {'recipe.jinja': '{% cache "all" %}{{ count("all") }}{% endcache %} '
+                                 '{% cache "run" %}{{ count(gen_run_entry.run_data.run_def.name) }}{% endcache %} '
+                                 '{% cache "node", "node" %}{{ count(gen_node.key) }}{% endcache %}'}
+    templates['all.jinja'] = templates['recipe.jinja'].replace('"all" %}', '"all", "global" %}')
+    counts = {}
+
+    def count(name):
+        counts[name] = counts.get(name, 0) + 1
+        return counts[name]
+
+    template_env = SandboxedEnvironment(loader=DictLoader(templates), extensions=[FragmentCacheExtension])
+    template_env.globals['count'] = count
+    run_defs = [make_run_def('recipe', 'all.jinja', ['stew', 'meatball']),
+                make_run_def('source', 'all.jinja', ['stew', 'toast'])]
+    build(template_env, run_defs, str(tmp_path))
+    assert counts == {'all': 1, 'recipe': 1, 'source': 1, 'stew': 1, 'meatball': 1, 'toast': 1}
+    assert (tmp_path / 'gen' / 'stew' / 'source').read_text() == '1 1 1'
+    assert template_env.fragment_cache_hits == 3 + 2 + 1
+
+    template_env.fragment_cache_size = 1
+    template_env.fragment_cache.clear()
+    counts.clear()
+    build(template_env, [make_run_def('recipe', 'recipe.jinja', ['stew', 'meatball'])], str(tmp_path))
+    assert counts == {'all': 2, 'recipe': 2, 'stew': 1, 'meatball': 1}
+
+
+def test_context_providers_load_once(tmp_path: Path):
+    templates = {'recipe.jinja': '{{ gen_ctx.ratings[gen_node.key] }} {{ gen_ctx.rating }}'
+                                 '{% if "authors" in gen_ctx %} {{ gen_ctx.authors }}{% endif %}'}
+    loads = []
+
+    def load_ratings():
+        loads.append('ratings')
+        return {'stew': 5, 'meatball': 3, 'toast': 4}
+
+    lookups = []
+
+    def rating(ratings, gen_node):
+        lookups.append(gen_node.key)
+        return ratings[gen_node.key] * '*'
+
+    contexts = GenContexts({
+        'ratings': ContextProvider(load_ratings),
+        'rating': ContextProvider(load_ratings, rating),
+        'authors': ContextProvider(lambda: 'ann', runs=['source']),
+        'unused': ContextProvider(lambda: loads.append('unused')),
+    })
+    template_env = make_env(templates)
+    run_defs = [make_run_def('recipe', 'recipe.jinja', ['stew', 'meatball']),
+                make_run_def('source', 'recipe.jinja', ['stew', 'toast'])]
+    runs = [run_def.create_run_data(template_env) for run_def in run_defs]
+    gen_roots = gen_tree_from_runs(str(tmp_path), runs)
+    gen_roots.contexts = contexts
+    render_and_write_gen_tree(gen_roots)
+
+    assert loads == ['ratings', 'ratings']
+    assert sorted(lookups) == ['meatball', 'stew', 'toast']
+    assert (tmp_path / 'gen' / 'stew' / 'recipe').read_text() == '5 *****'
+    assert (tmp_path / 'gen' / 'toast' / 'source').read_text() == '4 **** ann'
+
+
+def test_context_versions_in_run_fingerprints(tmp_path: Path):
+    templates = {'recipe.jinja': '{{ gen_ctx.ratings[gen_node.key] }}', 'source.jinja': 'source'}
+    run_defs = [make_run_def('recipe', 'recipe.jinja', ['stew']),
+                make_run_def('source', 'source.jinja', ['stew'])]
+    manifest_path = tmp_path / 'doctrees' / 'manifest.json'
+    ratings = {'version': '1', 'stew': 5}
+
+    def gen(fingerprint):
+        contexts = GenContexts({'ratings': ContextProvider(lambda: dict(ratings), runs=['recipe'],
+                                                           fingerprint=fingerprint)})
+        cache = FileGenCache.load(manifest_path)
+        gen_roots = gen_from_run_defs(make_env(templates), run_defs, str(tmp_path), cache, contexts=contexts)
+        up_to_date = {}
+        for _, entry in gen_tree_run_entries(gen_roots):
+            filepath = str(entry.filepath)
+            up_to_date[entry.run_data.run_def.name] = cache.previous.get(filepath) == cache.current[filepath]
+        return up_to_date
+
+    assert gen(lambda: ratings['version']) == {'recipe': False, 'source': False}
+    assert gen(lambda: ratings['version']) == {'recipe': True, 'source': True}
+    ratings.update(version='2', stew=4)
+    assert gen(lambda: ratings['version']) == {'recipe': False, 'source': True}
+    assert (tmp_path / 'gen' / 'stew' / 'recipe').read_text() == '4'
+    assert gen(None) == {'recipe': False, 'source': True}
+    assert gen(None) == {'recipe': False, 'source': True}
+
+
+@pytest.fixture
+def recipes_db(tmp_path: Path) -> Path:
+    database = tmp_path / 'recipes.sqlite'
+    with sqlite3.connect(database) as connection:
+        connection.execute('CREATE TABLE recipe (source TEXT, name TEXT, rating INTEGER)')
+        connection.execute('CREATE TABLE step (recipe TEXT, number INTEGER, text TEXT)')
+        connection.executemany('INSERT INTO recipe VALUES (?, ?, ?)', [
+            ('youtube', 'stew', 5), ('youtube', 'toast', 3), ('serious', 'meatball', 4)])
+        connection.executemany('INSERT INTO step VALUES (?, ?, ?)', [
+            ('stew', 1, 'chop'), ('stew', 2, 'simmer'), ('toast', 1, 'fry')])
+    connection.close()
+    return database
+
+
+def test_sql_key_paths_and_context_rows(tmp_path: Path, recipes_db: Path):
+    templates = {'recipe.jinja': '{{ gen_ctx.recipe.rating }}:{% for s in gen_ctx.steps %}{{ s.text }};{% endfor %}'}
+    source = SqlKeyPaths(recipes_db, 'SELECT source, name FROM recipe WHERE rating >= ? ORDER BY source, name',
+                         [3], prefix=('gen',))
+    assert list(source) == [('gen', 'serious', 'meatball'), ('gen', 'youtube', 'stew'), ('gen', 'youtube', 'toast')]
+
+    steps = SqlContextProvider(recipes_db, 'SELECT * FROM step WHERE recipe IN ({keys}) ORDER BY number', 'recipe')
+    fetched = []
+    fetch_rows = steps.fetch_rows
+    steps.fetch_rows = lambda keys: fetched.append(sorted(keys)) or fetch_rows(keys)
+    contexts = GenContexts({
+        'recipe': SqlContextProvider(recipes_db, 'SELECT * FROM recipe WHERE name IN ({keys})', 'name', one=True),
+        'steps': steps,
+    })
+    template_env = make_env(templates)
+    run_def = FileGenRunDef(source, 'recipe', 'recipe.jinja', 'rst', FileGenRunNameOption.ALL_KEYS_DIRS, None)
+    gen_roots = gen_tree_from_runs_fused(str(tmp_path / 'out'), [run_def.create_run_data(template_env)])
+    gen_roots.contexts = contexts
+    render_and_write_gen_tree(gen_roots)
+
+    assert fetched == [['meatball'], ['stew', 'toast']]
+    render_and_write_gen_tree_parallel(gen_roots, env_builder=lambda: make_env(templates), jobs=2)
+    assert (tmp_path / 'out' / 'gen' / 'youtube' / 'stew' / 'recipe').read_text() == '5:chop;simmer;'
+    assert (tmp_path / 'out' / 'gen' / 'serious' / 'meatball' / 'recipe').read_text() == '4:'
+    assert sqlite_pool(recipes_db) is sqlite_pool(tmp_path / '.' / 'recipes.sqlite')
+    sqlite_pool(recipes_db).close()
+
+    version = steps.fingerprint()
+    assert version is not None and steps.fingerprint() == version
+    os.utime(recipes_db, ns=(0, 0))
+    assert steps.fingerprint() != version
+
+
+def test_sql_context_rows_for_roots_and_streamed_siblings(tmp_path: Path, recipes_db: Path):
+    templates = {'recipe.jinja': '{{ gen_ctx.recipe.rating }}'}
+    contexts = GenContexts({
+        'recipe': SqlContextProvider(recipes_db, 'SELECT * FROM recipe WHERE name IN ({keys})', 'name', one=True),
+    })
+    template_env = make_env(templates)
+    roots_def = FileGenRunDef(IterableKeyPaths([('stew',), ('toast',)]), 'recipe', 'recipe.jinja', 'rst',
+                              FileGenRunNameOption.ALL_KEYS_DIRS, None)
+    gen_roots = gen_tree_from_runs_fused(str(tmp_path / 'roots'), [roots_def.create_run_data(template_env)])
+    gen_roots.contexts = contexts
+    render_and_write_gen_tree(gen_roots)
+    assert (tmp_path / 'roots' / 'stew' / 'recipe').read_text() == '5'
+    assert (tmp_path / 'roots' / 'toast' / 'recipe').read_text() == '3'
+
+    source = SqlKeyPaths(recipes_db, 'SELECT source, name FROM recipe ORDER BY source, name', prefix=('gen',))
+    run_def = FileGenRunDef(source, 'recipe', 'recipe.jinja', 'rst', FileGenRunNameOption.ALL_KEYS_DIRS, None)
+    stream_from_run_defs(template_env, [run_def], str(tmp_path / 'streamed'), contexts=contexts)
+    assert (tmp_path / 'streamed' / 'gen' / 'youtube' / 'stew' / 'recipe').read_text() == '5'
+    assert (tmp_path / 'streamed' / 'gen' / 'youtube' / 'toast' / 'recipe').read_text() == '3'
+    assert (tmp_path / 'streamed' / 'gen' / 'serious' / 'meatball' / 'recipe').read_text() == '4'
+    sqlite_pool(recipes_db).close()
+
+
+def test_template_graph_maps_changes_to_runs(tmp_path: Path):
+    templates = {
+        'recipe.jinja': '{% extends "base.jinja" %}{% block body %}{{ m.title(gen_run_entry.gen_key) }}{% endblock %}',
+        'source.jinja': '{% include "header.jinja" %}{% from "macros.jinja" import title %}{{ title("src") }}',
+        'base.jinja': '{% import "macros.jinja" as m %}{% block body %}{% endblock %}',
+        'macros.jinja': '{% macro title(s) %}{{ s }}{% endmacro %}',
+        'header.jinja': 'Source\n',
+        'dynamic.jinja': '{% include gen_run_entry.gen_key ~ ".jinja" %}',
+    }
+    run_defs = [make_run_def('recipe', 'recipe.jinja', ['stew', 'meatball']),
+                make_run_def('source', 'source.jinja', ['stew']),
+                make_run_def('dynamic', 'dynamic.jinja', ['header'])]
+    graph = TemplateDependencyGraph.build(make_env(templates), run_defs)
+
+    assert graph.edges['recipe.jinja'] == ['base.jinja']
+    assert graph.edges['source.jinja'] == ['header.jinja', 'macros.jinja']
+    assert graph.dependencies('recipe.jinja') == ['base.jinja', 'macros.jinja', 'recipe.jinja']
+    assert graph.dynamic == {'dynamic.jinja'}
+    assert graph.affected_runs(['macros.jinja']) == {'recipe', 'source', 'dynamic'}
+    assert graph.affected_runs(['base.jinja']) == {'recipe', 'dynamic'}
+    assert graph.affected_runs([]) == set()
+
+    runs = [run_def.create_run_data(make_env(templates)) for run_def in run_defs]
+    gen_roots = gen_tree_from_runs(str(tmp_path), runs)
+    affected = graph.affected_entries(gen_tree_run_entries(gen_roots), ['header.jinja'])
+    assert sorted(run_entry.filepath.relative_to(tmp_path).as_posix() for _, run_entry in affected) == \
+        ['gen/header/dynamic', 'gen/stew/source']
+
+    manifest_path = tmp_path / 'doctrees' / 'manifest.json'
+    cache = FileGenCache.load(manifest_path)
+    gen_from_run_defs(make_env(templates), run_defs[:2], str(tmp_path / 'out'), cache)
+    assert (manifest_path.parent / TEMPLATE_GRAPH_FILENAME).is_file()
+
+    templates['header.jinja'] = 'Sources\n'
+    cache = FileGenCache.load(manifest_path)
+    gen_from_run_defs(make_env(templates), run_defs[:2], str(tmp_path / 'out'), cache)
+    assert (cache.changed_templates(), cache.affected_runs()) == ({'header.jinja'}, {'source'})
+
+
+def test_watcher_rerenders_affected_entries(tmp_path: Path):
+    templates = {
+        'recipe.jinja': '{% import "macros.jinja" as m %}{{ m.title(gen_node.key) }} {{ gen_ctx.ratings[gen_node.key] }}',
+        'source.jinja': '{% cache "header" %}{% include "header.jinja" %}{% endcache %}{{ gen_node.key }}',
+        'macros.jinja': '{% macro title(s) %}{{ s }}{% endmacro %}',
+        'header.jinja': 'Source ',
+    }
+    ratings_file = tmp_path / 'ratings.txt'
+    ratings_file.write_text('stew=5 meatball=3')
+
+    def load_ratings():
+        return dict(pair.split('=') for pair in ratings_file.read_text().split())
+
+    contexts = GenContexts({'ratings': ContextProvider(load_ratings, runs=['recipe'])})
+    run_defs = [make_run_def('recipe', 'recipe.jinja', ['stew', 'meatball']),
+                make_run_def('source', 'source.jinja', ['stew', 'meatball'])]
+    template_env = SandboxedEnvironment(loader=DictLoader(templates), extensions=[FragmentCacheExtension])
+    watcher = GenWatcher(template_env, run_defs, str(tmp_path), contexts, {ratings_file: None})
+    assert watcher.build().written == 4
+    assert watcher.poll() is None
+
+    templates['macros.jinja'] = '{% macro title(s) %}{{ s|upper }}{% endmacro %}'
+    stats = watcher.poll()
+    assert (stats.written, stats.skipped) == (2, 0)
+    assert (tmp_path / 'gen' / 'stew' / 'recipe').read_text() == 'STEW 5'
+    assert watcher.poll() is None
+
+    templates['header.jinja'] = 'Source: '
+    assert watcher.poll().written == 2
+    assert (tmp_path / 'gen' / 'stew' / 'source').read_text() == 'Source: stew'
+
+    ratings_file.write_text('stew=4 meatball=3')
+    os.utime(ratings_file, ns=(0, 0))
+    stats = watcher.poll()
+    assert (stats.written, stats.skipped) == (1, 1)
+    assert (tmp_path / 'gen' / 'stew' / 'recipe').read_text() == 'STEW 4'
+
+
+def test_stale_outputs_removed_and_written_files_recorded(tmp_path: Path):
+    templates = {'recipe.jinja': '{{ gen_node.key }}'}
+    manifest_path = tmp_path / 'doctrees' / 'manifest.json'
+    out_dir = str(tmp_path / 'out')
+
+    cache = FileGenCache.load(manifest_path)
+    stats = build(make_env(templates), [make_run_def('recipe', 'recipe.jinja', ['stew', 'meatball'])], out_dir, cache)
+    cache.save()
+    assert sorted(Path(f).relative_to(out_dir).as_posix() for f in stats.written_files) == \
+        ['gen/meatball/recipe', 'gen/stew/recipe']
+
+    (tmp_path / 'out' / 'gen' / 'stew' / 'notes').write_text('kept')
+    cache = FileGenCache.load(manifest_path)
+    stats = build(make_env(templates), [make_run_def('recipe', 'recipe.jinja', ['toast'])], out_dir, cache)
+    assert stats.written_files == [str(tmp_path / 'out' / 'gen' / 'toast' / 'recipe')]
+    assert len(remove_stale_outputs(cache)) == 2
+    assert not (tmp_path / 'out' / 'gen' / 'meatball').exists()
+    assert sorted(p.name for p in (tmp_path / 'out' / 'gen' / 'stew').iterdir()) == ['notes']
+
+
+@pytest.mark.parametrize('strategy', ['hash', 'range'])
+def test_shards_cover_tree_once(tmp_path: Path, strategy: str):
+    templates = {'recipe.jinja': '{{ gen_node.key }}'}
+    keys = [f'dish{i}' for i in range(30)]
+    run_defs = [make_run_def('recipe', 'recipe.jinja', keys), make_run_def('source', 'recipe.jinja', keys[:10])]
+
+    manifests = []
+    for index in range(3):
+        shard = GenShard.from_config(f'{index}/3', strategy)
+        cache = FileGenCache.load(tmp_path / 'doctrees' / shard.manifest_filename)
+        gen_from_run_defs(make_env(templates), run_defs, str(tmp_path / 'out'), cache, shard=shard)
+        manifests.append(cache.manifest_path)
+        assert 0 < len(cache.current) < 40
+
+    merged = merge_shard_manifests(manifests)
+    assert len(merged) == 40
+    assert len(list((tmp_path / 'out').rglob('recipe'))) == 30
+    with pytest.raises(ExtensionError, match='shards missing: \\[2\\], given more than once: \\[1\\]'):
+        merge_shard_manifests([manifests[0], manifests[1], manifests[1]])
+    with pytest.raises(ExtensionError):
+        GenShard.from_config((3, 3))
+
+
+def test_subset_prunes_key_trees_and_keeps_other_outputs(tmp_path: Path, monkeypatch):
+    templates = {'recipe.jinja': '{{ gen_node.key }} {{ gen_node.parent.key }}'}
+    N = GenKeyNode.from_children_iter
+    key_roots = GenKeyRoots.from_roots_iter([N('gen', [
+        N('recipe_youtube', [N('stew', []), N('toast', [])]),
+        N('recipe_serious', [N('meatball', [])])])])
+    run_defs = [FileGenRunDef(key_roots, 'recipe', 'recipe.jinja', 'rst', FileGenRunNameOption.ALL_KEYS_DIRS, None),
+                FileGenRunDef(IterableKeyPaths(lambda: [('gen', 'recipe_youtube', 'stew'), ('gen', 'recipe_serious', 'meatball')]),
+                              'source', 'recipe.jinja', 'rst', FileGenRunNameOption.ALL_KEYS_DIRS, None)]
+    out_dir = tmp_path / 'out'
+    manifest_path = tmp_path / 'doctrees' / 'manifest.json'
+    cache = FileGenCache.load(manifest_path)
+    gen_from_run_defs(make_env(templates), run_defs, str(out_dir), cache)
+    remove_stale_outputs(cache)
+
+    # entries of a partial build are not up to date for the next full one
+    run_subset = GenSubset(run_globs=('source',))
+    cache = FileGenCache.load(manifest_path)
+    run_subset.apply_to_cache(cache)
+    gen_from_run_defs(make_env(templates), run_defs, str(out_dir), cache, entry_filter=run_subset.includes_entry)
+    cache = FileGenCache.load(manifest_path)
+    gen_from_run_defs(make_env(templates), run_defs, str(out_dir), cache)
+    assert sorted(Path(filepath).relative_to(out_dir).as_posix() for filepath, entry_fingerprint
+                  in cache.current.items() if cache.previous[filepath] == entry_fingerprint) == \
+        ['gen/recipe_serious/meatball/recipe', 'gen/recipe_youtube/stew/recipe', 'gen/recipe_youtube/toast/recipe']
+    mtime_ns = (out_dir / 'gen' / 'recipe_serious' / 'meatball' / 'recipe').stat().st_mtime_ns
+
+    monkeypatch.setenv('JINJAGEN_ONLY', 'gen.recipe_you*.s*')
+    subset = GenSubset.from_config(['ignored'], 'rec*')
+    assert subset.keypath_globs == (('gen', 'recipe_you*', 's*'),)
+    assert subset.prune_key_roots(key_roots).roots['gen'].children['recipe_youtube'].children.keys() == {'stew'}
+    assert list(subset.apply(run_defs)[1].gen_key_roots) == [('gen', 'recipe_youtube', 'stew')]
+
+    templates['recipe.jinja'] = '{{ gen_node.key }}!'
+    cache = FileGenCache.load(manifest_path)
+    subset.apply_to_cache(cache)
+    gen_roots = gen_from_run_defs(make_env(templates), subset.apply(run_defs), str(out_dir), cache,
+                                  entry_filter=subset.includes_entry)
+    assert [e.filepath.relative_to(out_dir).as_posix() for _, e in gen_tree_run_entries(gen_roots)] == \
+        ['gen/recipe_youtube/stew/recipe']
+    assert remove_stale_outputs(cache) == []
+    assert (out_dir / 'gen' / 'recipe_youtube' / 'stew' / 'recipe').read_text() == 'stew!'
+    assert (out_dir / 'gen' / 'recipe_youtube' / 'toast' / 'recipe').read_text() == 'toast recipe_youtube'
+    assert (out_dir / 'gen' / 'recipe_serious' / 'meatball' / 'recipe').stat().st_mtime_ns == mtime_ns
+    assert (out_dir / 'gen' / 'recipe_youtube' / 'stew' / 'source').read_text() == 'stew recipe_youtube'
+
+    genrefs = {'recipe': {'gen.recipe_youtube.stew': 'new'}}
+    subset.merge_genrefs({'recipe': {'gen.recipe_youtube.stew': 'old', 'gen.recipe_serious.meatball': 'm'},
+                          'source': {'gen.recipe_youtube.stew': 's'}}, genrefs)
+    assert genrefs == {'recipe': {'gen.recipe_youtube.stew': 'new', 'gen.recipe_serious.meatball': 'm'},
+                       'source': {'gen.recipe_youtube.stew': 's'}}
+
+
+@pytest.mark.sphinx('html', testroot='gen')
+def test_sphinx_build_generates_and_links_docs(app, warning):
+    app.build()
+
+    srcdir = Path(app.srcdir)
+    outdir = Path(app.outdir)
+    assert (srcdir / 'gen' / 'recipe_youtube' / 'columbian stew' / 'recipe.rst').read_text() == \
+        'Recipe\n======\n\ncolumbian stew'
+    assert (outdir / 'gen' / 'recipe_serious' / 'recipe_source.html').exists()
+    index_html = (outdir / 'index.html').read_text()
+    assert 'href="gen/recipe_youtube/columbian%20stew/recipe.html"' in index_html
+    assert 'href="gen/recipe_serious/recipe_source.html"' in index_html
+
+    assert (srcdir / 'gen' / 'plain' / 'plain.txt').is_file()
+    assert 'plain.html' not in index_html
+    assert 'jinja:genref reference target not found: gen.plain' in warning.getvalue()
+    assert 'jinja:genref reference target not found: gen.nope' in warning.getvalue()
+
+
+@pytest.mark.sphinx('html', testroot='gen', srcdir='gen_shard')
+def test_sphinx_shard_indexes_genrefs_of_whole_tree(app, make_app):
+    app.build()
+
+    for index in range(2):
+        shard_app = make_app('html', srcdir=app.srcdir, freshenv=True,
+            confoverrides={'jinjagen_shard': f'{index}/2', 'jinjagen_shard_strategy': 'range'})
+        shard_app.build()
+        domain = shard_app.env.get_domain('jinja')
+        assert domain.lookup_genref('recipe.rst:gen.recipe_youtube.columbian stew') == \
+            'gen/recipe_youtube/columbian stew/recipe'
+        assert domain.lookup_genref('gen.recipe_serious') == 'gen/recipe_serious/recipe_source'
+
+
+@pytest.mark.sphinx('html', testroot='gen', srcdir='gen_contexts')
+def test_sphinx_rebuild_with_contexts_rereads_nothing(app, make_app):
+    with pytest.raises(TypeError):
+        JinjagenContextBase()
+
+    def contexts():
+        return {'ratings': ContextProvider(lambda: {'stew': 5}, fingerprint=lambda: '1')}
+
+    app = make_app('html', srcdir=app.srcdir, confoverrides={'jinjagen_contexts': contexts()})
+    app.build()
+
+    read = []
+    app = make_app('html', srcdir=app.srcdir, confoverrides={'jinjagen_contexts': contexts()})
+    app.connect('source-read', lambda app, docname, source: read.append(docname))
+    app.build()
+    assert read == []
+
+
+@pytest.mark.sphinx('html', testroot='gen', srcdir='gen_watch',
+                    confoverrides={'jinjagen_only_runs': ['recipe.rst'], 'jinjagen_compact_tree': True})
+def test_watcher_follows_build_config(app):
+    watcher = GenWatcher.from_app(app)
+    watcher.build()
+    assert isinstance(watcher.gen_roots, CompactGenRoots)
+    assert {run_entry.run_data.run_def.name for _, run_entry in gen_tree_run_entries(watcher.gen_roots)} == \
+        {'recipe.rst'}
+
+    polls = []
+
+    def poll():
+        polls.append(1)
+        raise OSError('unreadable data file')
+    watcher.poll = poll
+    watcher.watch(0, stop=lambda: len(polls) == 2)
+    assert len(polls) == 2
+
+
+@pytest.mark.sphinx('html', testroot='gen', srcdir='gen_outdated')
+def test_sphinx_rebuild_rereads_generated_docs_only_when_outdated(app, make_app):
+    app.build()
+
+    srcdir = Path(app.srcdir)
+    later = time.time() + 10
+    # touched but not rewritten, only the recipe sources include notes.txt
+    for path in [srcdir / 'gen' / 'recipe_youtube' / 'columbian stew' / 'recipe.rst',
+                 srcdir / 'gen' / 'recipe_youtube' / 'recipe_source.rst',
+                 srcdir / 'notes.txt']:
+        os.utime(path, (later, later))
+
+    read = []
+    app = make_app('html', srcdir=app.srcdir)
+    app.connect('source-read', lambda app, docname, source: read.append(docname))
+    app.build()
+    assert sorted(read) == ['gen/recipe_all_recipes/recipe_source', 'gen/recipe_serious/recipe_source',
+                            'gen/recipe_youtube/recipe_source']